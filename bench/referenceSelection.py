@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""The transcript classification and selection as they were before they were vectorised, row by row loops, kept as the reference of the benchmarks and the tests.
+
+Only the DataFrame.append of the loop is replaced by pd.concat (it is gone from pandas 2) and the skipped rows are not printed, the selection is unchanged.
+
+Authors: Costas Bouyioukos, AKE Franz-Arnold and LU Antoine
+mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoine@gmail.com
+2018-19
+@UMR7216 Paris Diderot
+"""
+
+import re
+import math
+from collections import namedtuple
+
+import pandas as pd
+
+import rnaFeaturesLib as rnalib
+
+
+def select_transcripts(dfTrans, dfFeat, transcr_expr_file):
+    """Selects the transcripts according to the ENSEMBL classification, or according to a expression levels file.
+
+    The data frames are not modified (the original set their index in place).
+    Return a data frame with the transcripts info, indexed by the transcript ID (named 'index') and with object columns.
+    """
+    # Perform the transcript selection with the two ways
+    if transcr_expr_file is None:
+        trans_sorted = transcript_classification(dfTrans)
+    else:
+        genes = set(dfTrans["Gene stable ID"])
+        trans_sorted = rnalib.parse_transcripts_expression(transcr_expr_file, genes)
+    # Initialise the return data frame.
+    transcripts = pd.DataFrame()
+    # Set the index to the transcript ID
+    dfFeat = dfFeat.set_index('Transcript stable ID')
+    dfTrans = dfTrans.set_index('Transcript stable ID')
+    # Concatenate the two data frames by setting the index to the inner product.
+    dfENSEMBL = pd.concat([dfFeat, dfTrans], axis=1, join='inner')
+    dfENSEMBL = dfENSEMBL.T.drop_duplicates().T
+    # Here is the actual population of the final transcripts data frame.
+    for gene in trans_sorted:
+        for trans in trans_sorted[gene]:
+            row = dfENSEMBL.loc[trans.trans_id]
+            if row.isnull().any():
+                continue
+            else:
+                row = pd.DataFrame(row).T
+                row.reset_index(inplace=True)
+                transcripts = pd.concat([transcripts, row], ignore_index=True)
+                break
+    transcripts.set_index('index', inplace=True)
+    # Remove the transcript type column.
+    transcripts.drop('Transcript type', axis=1, inplace=True)
+    return transcripts
+
+
+def transcript_classification(ensemblTable):
+    """Return a dictionary of transcripts per gene, sorted by the ENSEMBL classification based on the Havana-APPRIS-TSL (with this order) criteria.
+
+    ensemblTable: A pandas dataframe with the ENSEMBL transcript classifications. It must contain 5 columns.
+
+    return: A dicitonary of key=geneID : value:[sorted list of transcripts]
+    """
+    # Declare the namedtuple.
+    Transcript = namedtuple('Transcript', "trans_id, havana, appris, tsl, length, sort")
+    genes_transcripts = {}
+    havanaDict = {"ensembl_havana": 0, "ensembl": 1, "havana": 2}
+    for i in range(len(ensemblTable)):
+        # Collect the attributes
+        g_id = ensemblTable.iloc[i, 0]
+        tr_id = ensemblTable.iloc[i, 1]
+        tsl = ensemblTable.iloc[i, 2]
+        appris = ensemblTable.iloc[i, 3]
+        havana = ensemblTable.iloc[i, 4]
+        tr_len = ensemblTable.iloc[i, 5]
+        # Generate the sorting tuple.
+        # Deal with the transcript source.
+        if havana in havanaDict:
+            h = havanaDict[havana]
+        else:
+            h = math.inf
+        # Deal with the APPRIS characterisation.
+        mm = re.match(r"^([a-z]+)([0-9]+)", str(appris))
+        if mm:
+            a = ""
+            if mm.group(1) == "principal":
+                a = a + "a"
+            elif mm.group(1) == "alternative":
+                a = a + "b"
+            a = a + mm.group(2)
+        else:
+            a = "z"
+        # Take the TSL order (Inf if NA)
+        tt = re.match(r"^[a-z]{3}([0-9]+)", str(tsl))
+        if tt:
+            t = int(tt.group(1))
+        else:
+            t = math.inf
+        # reverse Length
+        rl = -int(tr_len)
+        # Form the sorting tuple.
+        sort_tuple = (h, a, t, rl)
+        # Form the namedtuple
+        tr_namedtuple = Transcript(tr_id, havana, appris, tsl, tr_len, sort_tuple)
+        genes_transcripts.setdefault(g_id, [])
+        genes_transcripts[g_id].append(tr_namedtuple)
+    # Sort each list of nametuples in the dict.
+    for gene, transcript_list in genes_transcripts.items():
+        trListSorted = sorted(transcript_list, key=lambda t: t.sort)
+        genes_transcripts[gene] = trListSorted
+    return genes_transcripts
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""Benchmark the stages of the features' extraction on synthetic transcriptomes (see synthTranscriptome.py) and report them as JSON.
+
+For each size the stages run <repeats> times in a fresh process and the median time, the throughput (transcripts per second) and the peak RSS are reported, with the git commit of the checkout so that the results of several commits can be compared (see --compare).
+The rnaFeaturesLib of the checkout the script belongs to is benchmarked, not the installed one, and the stub RNAfold of this directory is used unless --real-rnafold is given.
+
+Authors: Costas Bouyioukos, AKE Franz-Arnold and LU Antoine
+mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoine@gmail.com
+2018-19
+@UMR7216 Paris Diderot
+"""
+
+__version__ = "0.1"
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(1, REPO_DIR)
+
+import numpy as np
+import pandas as pd
+
+import rnaFeaturesLib as rnalib
+import synthTranscriptome
+import referenceSelection
+
+# The local score of the TOP mRNAs, as in FeaturesExtract.calculate_features.
+TOP_SCORING = {'A': -1, 'C': 1, 'G': -1, 'T': 1, "N": 0}
+# The reference classification and selection are row by row loops, they run on the first transcripts up to this number (whole genes for the selection).
+REFERENCE_TRANSCRIPTS = 20000
+# The stages that need the results of other stages.
+STAGE_NEEDS = {"collect_features": ["load_fasta"], "free_energy": ["collect_features"], "local_score": ["collect_features"], "CAI": ["collect_features"], "fasta2table": ["load_fasta"],
+               "transcript_classification": ["read_biomart"], "select_transcripts": ["read_biomart"], "select_transcripts_expression": ["read_biomart"],
+               "transcript_classification_reference": ["read_biomart"], "select_transcripts_reference": ["read_biomart"]}
+
+
+def peak_rss():
+    """Return: The peak resident set size of the process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes.
+    return round(rss / 2**20 if sys.platform == "darwin" else rss / 2**10, 1)
+
+
+def git_commit():
+    """Return: The commit of the checkout and whether it has uncommitted changes (None if it is not a git checkout)."""
+    try:
+        commit = subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "-C", REPO_DIR, "status", "--porcelain", "--untracked-files=no"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def dataset(dataDir, nTranscripts, seed):
+    """Return: The paths of the synthetic dataset of that size and seed, generated in dataDir the first time."""
+    prefix = os.path.join(dataDir, "synth_{}_s{}".format(nTranscripts, seed))
+    paths = synthTranscriptome.dataset_paths(prefix)
+    if not all(os.path.exists(path) for path in paths.values()):
+        print("Generating {} transcripts in {}".format(nTranscripts, prefix), file=sys.stderr)
+        os.makedirs(dataDir, exist_ok=True)
+        synthTranscriptome.write_dataset(prefix, nTranscripts, seed)
+    return paths
+
+
+def bench_stages(paths):
+    """Return: A list of (name, function) of the stages, in the order they run. The functions share their results through a namespace and return the number of transcripts they processed."""
+    options = SimpleNamespace(utr3len=20000, utrFiles=None, clip=20, workers=1, codonTable="hsapiens_gene_ensembl", cacheDir=None, chunkSize=None)
+    ctx = SimpleNamespace(options=options)
+
+    def load_fasta():
+        with open(paths["fasta"]) as handle:
+            ctx.store = next(rnalib.TranscriptStore.iter_fasta(handle))
+        return len(ctx.store)
+
+    def load_fasta_index():
+        # The index is built by the first run and loaded by the next ones.
+        store = next(rnalib.FastaIndex(paths["fasta"]).iter_stores())
+        return len(store)
+
+    def collect_features():
+        ctx.extractor = rnalib.FeaturesExtract(ctx.store, options)
+        ctx.extractor.collect_features()
+        return len(ctx.store)
+
+    def free_energy():
+        rnalib.calculate_free_energy(ctx.extractor.utr5p, "5pUTR")
+        rnalib.calculate_free_energy(ctx.extractor.utr3p, "3pUTR")
+        return len(ctx.extractor.utr5p)
+
+    def local_score():
+        rnalib.calculate_local_score(ctx.extractor.segments("5pUTR"), TOP_SCORING, options.clip)
+        return len(ctx.extractor.ids)
+
+    def cai():
+        rnalib.calculate_CAI(ctx.extractor.segments("CDS"), None, rnalib.load_codon_index(options.codonTable))
+        return len(ctx.extractor.ids)
+
+    def read_biomart():
+        # As the BioMart responses are parsed (see BiomartFetcher.query).
+        ctx.dfFeat = pd.read_csv(paths["features"], sep="\t", encoding="utf-8")
+        ctx.dfTrans = pd.read_csv(paths["transcripts"], sep="\t", encoding="utf-8")
+        ctx.codingFeat = ctx.dfFeat[ctx.dfFeat["Transcript type"] == "protein_coding"]
+        ctx.codingTrans = ctx.dfTrans[ctx.dfTrans["Transcript type"] == "protein_coding"]
+        return len(ctx.dfTrans)
+
+    def transcript_classification():
+        rnalib.transcript_classification(ctx.dfTrans)
+        return len(ctx.dfTrans)
+
+    def transcript_classification_reference():
+        # The row by row classification transcript_classification replaced (see test/test_transcript_classification.py).
+        referenceSelection.transcript_classification(ctx.dfTrans.iloc[:REFERENCE_TRANSCRIPTS])
+        return min(len(ctx.dfTrans), REFERENCE_TRANSCRIPTS)
+
+    def select_transcripts():
+        rnalib.select_transcripts(ctx.codingTrans, ctx.codingFeat, None)
+        return len(ctx.codingTrans)
+
+    def select_transcripts_expression():
+        rnalib.select_transcripts(ctx.codingTrans, ctx.codingFeat, paths["expression"])
+        return len(ctx.codingTrans)
+
+    def select_transcripts_reference():
+        # The row by row selection select_transcripts replaced (test/test_select_transcripts.py checks they agree), on whole genes.
+        genes = ctx.codingTrans["Gene stable ID"].iloc[:REFERENCE_TRANSCRIPTS].unique()
+        codingTrans = ctx.codingTrans[ctx.codingTrans["Gene stable ID"].isin(genes)]
+        referenceSelection.select_transcripts(codingTrans, ctx.codingFeat, None)
+        return len(codingTrans)
+
+    def fasta2table():
+        # The whole of fasta2table.py, to a table that is thrown away.
+        with open(paths["fasta"]) as handle, open(os.devnull, "w") as out:
+            rnalib.stream_features(rnalib.TranscriptStore.iter_fasta(handle, options.chunkSize), options, out, options.chunkSize)
+        return len(ctx.store)
+
+    return [("load_fasta", load_fasta), ("load_fasta_index", load_fasta_index), ("collect_features", collect_features), ("free_energy", free_energy), ("local_score", local_score), ("CAI", cai),
+            ("fasta2table", fasta2table), ("read_biomart", read_biomart), ("transcript_classification", transcript_classification),
+            ("transcript_classification_reference", transcript_classification_reference),
+            ("select_transcripts", select_transcripts), ("select_transcripts_expression", select_transcripts_expression), ("select_transcripts_reference", select_transcripts_reference)]
+
+
+def run_size(paths, repeats, stageNames=None):
+    """Run the stages of a dataset <repeats> times.
+
+    Return: A dictionary with the timings of each stage (median and min seconds, transcripts and transcripts per second) and the peak RSS, before the stages, after each stage (of the first run) and at the end.
+    The RSS of RNAfold is not included, it runs in its own processes."""
+    stages = bench_stages(paths)
+    startRss = peak_rss()
+    if stageNames:
+        # Add the stages the selected ones need.
+        needed = set()
+        pending = list(stageNames)
+        while pending:
+            name = pending.pop()
+            needed.add(name)
+            pending.extend(STAGE_NEEDS.get(name, []))
+        stages = [(name, func) for name, func in stages if name in needed]
+    times = {name: [] for name, _ in stages}
+    counts = {}
+    rss = {}
+    for r in range(repeats):
+        for name, func in stages:
+            start = time.perf_counter()
+            counts[name] = func()
+            times[name].append(time.perf_counter() - start)
+            rss.setdefault(name, peak_rss())
+        print("Repeat {}/{} done.".format(r + 1, repeats), file=sys.stderr)
+    results = {}
+    for name, _ in stages:
+        median = statistics.median(times[name])
+        results[name] = {"seconds": round(median, 4), "min_seconds": round(min(times[name]), 4), "transcripts": counts[name],
+                         "per_second": round(counts[name] / median, 1) if median else None, "peak_rss_mb": rss[name]}
+    return {"stages": results, "start_rss_mb": startRss, "peak_rss_mb": peak_rss()}
+
+
+def compare(results, baseline):
+    """Print the ratio of the median times of the stages to the ones of a baseline run (above 1 is slower)."""
+    base = {size["transcripts"]: size for size in baseline["sizes"]}
+    print("Against {} ({}):".format(baseline.get("commit"), baseline.get("date")), file=sys.stderr)
+    for size in results["sizes"]:
+        if size["transcripts"] not in base:
+            continue
+        for name, stage in size["stages"].items():
+            old = base[size["transcripts"]]["stages"].get(name)
+            if old and old["seconds"]:
+                print("{:>8} {:<32}{:>9.3f}s {:>9.3f}s  x{:.2f}".format(size["transcripts"], name, old["seconds"], stage["seconds"], stage["seconds"] / old["seconds"]), file=sys.stderr)
+        print("{:>8} {:<32}{:>8.1f}MB {:>8.1f}MB".format(size["transcripts"], "peak RSS", base[size["transcripts"]]["peak_rss_mb"], size["peak_rss_mb"]), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='runBench', description="Benchmark the features' extraction on synthetic transcriptomes and write the results as JSON.", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
+    parser.add_argument("outfile", nargs='?', default='-', type=argparse.FileType('w'), metavar="output_file", help="Path to the output JSON file. (or STDOUT).")
+    parser.add_argument('-n', '--sizes', help="The sizes (number of transcripts) of the synthetic transcriptomes. (Default=1000 10000 100000).", nargs='+', type=int, default=[1000, 10000, 100000], dest="sizes", metavar="Size")
+    parser.add_argument('-r', '--repeats', help="The number of runs of each stage, the median time is reported. (Default=3).", type=int, default=3, dest="repeats", metavar="Repeats")
+    parser.add_argument('-s', '--seed', help="The seed of the synthetic transcriptomes. (Default=0).", type=int, default=0, dest="seed", metavar="Seed")
+    parser.add_argument('-S', '--stages', help="Run only these stages (and the ones they need). (Default=all).", nargs='+', type=str, choices=["load_fasta", "load_fasta_index", "collect_features", "free_energy", "local_score", "CAI", "fasta2table", "read_biomart", "transcript_classification", "transcript_classification_reference", "select_transcripts", "select_transcripts_expression", "select_transcripts_reference"], default=None, dest="stages", metavar="Stage")
+    parser.add_argument('-d', '--data-dir', help="Directory of the synthetic transcriptomes, generated once and reused by the next runs. (Default=<tmp>/rnaFeatures_bench).", type=str, default=os.path.join(tempfile.gettempdir(), "rnaFeatures_bench"), dest="dataDir", metavar="DataDir")
+    parser.add_argument('-c', '--compare', help="A previous JSON output to compare the timings with. (Default=None).", type=argparse.FileType('r'), default=None, dest="compare", metavar="Baseline")
+    parser.add_argument('--real-rnafold', help="Use the RNAfold of the PATH instead of the stub of the benchmark directory. (Default=False).", action="store_true", dest="realRNAfold")
+    parser.add_argument('--single', help=argparse.SUPPRESS, type=int, default=None, dest="single")
+    optArgs = parser.parse_args()
+
+    if not optArgs.realRNAfold:
+        os.environ["PATH"] = BENCH_DIR + os.pathsep + os.environ.get("PATH", "")
+
+    if optArgs.single is not None:
+        # One size in this process, called by the main run so that the peak RSS is the one of that size only.
+        paths = dataset(optArgs.dataDir, optArgs.single, optArgs.seed)
+        result = run_size(paths, optArgs.repeats, optArgs.stages)
+        result["transcripts"] = optArgs.single
+        json.dump(result, optArgs.outfile)
+        sys.exit(0)
+
+    commit, dirty = git_commit()
+    results = {"commit": commit, "dirty": dirty, "date": datetime.datetime.now().isoformat(timespec="seconds"), "library_version": rnalib.__version__,
+               "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform(),
+               "cpus": os.cpu_count(), "rnafold": rnalib.rnafold_version(), "seed": optArgs.seed, "repeats": optArgs.repeats, "sizes": []}
+    for size in optArgs.sizes:
+        # Generate the data first, it is not part of the measures.
+        dataset(optArgs.dataDir, size, optArgs.seed)
+        cmd = [sys.executable, os.path.abspath(__file__), "--single", str(size), "-r", str(optArgs.repeats), "-s", str(optArgs.seed), "-d", optArgs.dataDir]
+        if optArgs.stages:
+            cmd += ["-S"] + optArgs.stages
+        if optArgs.realRNAfold:
+            cmd.append("--real-rnafold")
+        print("Benchmarking {} transcripts.".format(size), file=sys.stderr)
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        results["sizes"].append(json.loads(proc.stdout))
+    json.dump(results, optArgs.outfile, indent=2)
+    optArgs.outfile.write("\n")
+    if optArgs.compare:
+        compare(results, json.load(optArgs.compare))
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""Generate a synthetic transcriptome for the benchmarks: the two BioMart TSVs of geneIDs2fasta.py, a FASTA file of the transcripts with its header and a transcript expression file.
+
+The UTR and CDS lengths follow log-normal distributions close to the ones of the human protein coding transcripts, the same seed gives the same files.
+
+Authors: Costas Bouyioukos, AKE Franz-Arnold and LU Antoine
+mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoine@gmail.com
+2018-19
+@UMR7216 Paris Diderot
+"""
+
+__version__ = "0.1"
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import rnaFeaturesLib as rnalib
+
+# Log-normal (median, sigma) of the lengths in nt, and the GC content of each region (roughly the human ones).
+UTR5_LENGTH = (150, 0.8)
+CDS_LENGTH = (1100, 0.75)
+UTR3_LENGTH = (700, 1.1)
+MAX_UTR_LENGTH = 20000
+REGION_GC = {"5pUTR": 0.60, "CDS": 0.52, "3pUTR": 0.42}
+# The annotations of the transcripts and their frequencies.
+TSL_VALUES = (["tsl1", "tsl2", "tsl3", "tsl5", "tsl1 (assigned to previous version 4)", "tslNA"], [0.35, 0.2, 0.15, 0.1, 0.05, 0.15])
+APPRIS_VALUES = (["principal1", "principal2", "principal4", "alternative1", "alternative2", ""], [0.45, 0.05, 0.05, 0.15, 0.15, 0.15])
+SOURCE_VALUES = (["ensembl_havana", "havana", "ensembl"], [0.6, 0.3, 0.1])
+BIOTYPE_VALUES = (["protein_coding", "retained_intron", "nonsense_mediated_decay"], [0.85, 0.1, 0.05])
+STOP_CODONS = ["TAA", "TAG", "TGA"]
+
+
+def random_sequences(rng, lengths, gc):
+    """Return: A list of random DNA sequences of the given lengths and GC content."""
+    probs = [(1 - gc) / 2, gc / 2, gc / 2, (1 - gc) / 2]
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.choice(4, size=int(lengths.sum()), p=probs)].tobytes().decode("ascii")
+    ends = np.cumsum(lengths)
+    return [bases[e - n:e] for n, e in zip(lengths.tolist(), ends.tolist())]
+
+
+def lognormal_lengths(rng, n, median, sigma, low, high):
+    """Return: An array of n log-normal lengths clipped to [low, high]."""
+    return np.clip(np.rint(rng.lognormal(np.log(median), sigma, n)), low, high).astype(np.int64)
+
+
+def synthetic_transcriptome(nTranscripts, seed=0):
+    """Generate nTranscripts synthetic transcripts, grouped in genes of 1 to 12 transcripts.
+
+    Return: The BioMart features and transcripts data frames (as returned by BiomartFetcher.fetch, with the display names as columns) and the expression data frame (gene, transcript, TPM)."""
+    # RandomState streams are stable across the NumPy versions, the files are the same for every commit.
+    rng = np.random.RandomState(seed)
+    perGene = np.clip(rng.geometric(0.3, nTranscripts), 1, 12)
+    geneOf = np.repeat(np.arange(nTranscripts), perGene)[:nTranscripts]
+    geneIDs = np.array(["ENSG{:011d}".format(g) for g in range(geneOf[-1] + 1)])[geneOf]
+    transIDs = np.array(["ENST{:011d}".format(t) for t in range(nTranscripts)])
+    len5 = lognormal_lengths(rng, nTranscripts, UTR5_LENGTH[0], UTR5_LENGTH[1], 0, MAX_UTR_LENGTH)
+    lenCDS = lognormal_lengths(rng, nTranscripts, CDS_LENGTH[0], CDS_LENGTH[1], 90, 30000) // 3 * 3
+    len3 = lognormal_lengths(rng, nTranscripts, UTR3_LENGTH[0], UTR3_LENGTH[1], 0, MAX_UTR_LENGTH)
+    utr5 = random_sequences(rng, len5, REGION_GC["5pUTR"])
+    cds = random_sequences(rng, lenCDS - 6, REGION_GC["CDS"])
+    utr3 = random_sequences(rng, len3, REGION_GC["3pUTR"])
+    stops = rng.choice(STOP_CODONS, nTranscripts)
+    seqs = ["".join((u5, "ATG", c, s, u3)) for u5, c, s, u3 in zip(utr5, cds, stops, utr3)]
+    # BioMart gives the coding start and end of each coding exon, some transcripts get two of them.
+    cdnaStart = (len5 + 1).astype(str).astype(object)
+    cdnaEnd = (len5 + lenCDS).astype(str).astype(object)
+    split = np.flatnonzero(rng.random_sample(nTranscripts) < 0.05)
+    cdnaStart[split] = ["{};{}".format(s, s + 60) for s in (len5[split] + 1)]
+    cdnaEnd[split] = ["{};{}".format(e - 60, e) for e in (len5 + lenCDS)[split]]
+    biotype = rng.choice(BIOTYPE_VALUES[0], nTranscripts, p=BIOTYPE_VALUES[1])
+    dfFeat = pd.DataFrame({"ensembl_gene_id": geneIDs, "ensembl_transcript_id": transIDs, "external_gene_name": ["SYN{}".format(g) for g in geneOf],
+                           "transcript_length": [len(s) for s in seqs], "transcript_biotype": biotype, "cdna_coding_start": cdnaStart,
+                           "cdna_coding_end": cdnaEnd, "cdna": seqs, "description": ["Synthetic gene {}".format(g) for g in geneOf]})
+    # A few transcripts without coordinates, as BioMart returns for some.
+    dfFeat.loc[rng.random_sample(nTranscripts) < 0.01, ["cdna_coding_start", "cdna_coding_end"]] = np.nan
+    appris = rng.choice(APPRIS_VALUES[0], nTranscripts, p=APPRIS_VALUES[1]).astype(object)
+    appris[appris == ""] = np.nan
+    dfTrans = pd.DataFrame({"ensembl_gene_id": geneIDs, "ensembl_transcript_id": transIDs,
+                            "transcript_tsl": rng.choice(TSL_VALUES[0], nTranscripts, p=TSL_VALUES[1]), "transcript_appris": appris,
+                            "transcript_source": rng.choice(SOURCE_VALUES[0], nTranscripts, p=SOURCE_VALUES[1]),
+                            "transcript_length": dfFeat["transcript_length"], "transcript_biotype": biotype})
+    dfFeat = dfFeat[rnalib.FEATURE_ATTRIBUTES].rename(columns=rnalib.BIOMART_COLUMNS)
+    dfTrans = dfTrans[rnalib.TRANSCRIPT_ATTRIBUTES].rename(columns=rnalib.BIOMART_COLUMNS)
+    dfExpr = pd.DataFrame({"gene": geneIDs, "transcript": transIDs, "TPM": np.round(rng.lognormal(1.0, 2.0, nTranscripts), 6)})
+    return dfFeat, dfTrans, dfExpr
+
+
+def dataset_paths(prefix):
+    """Return: The paths of the files of a synthetic dataset (fasta, features, transcripts and expression)."""
+    return {"fasta": prefix + ".fa", "features": prefix + "_features.tsv", "transcripts": prefix + "_transcripts.tsv", "expression": prefix + "_expr.csv"}
+
+
+def write_dataset(prefix, nTranscripts, seed=0):
+    """Write a synthetic dataset.
+
+    The FASTA holds all the transcripts with coding coordinates (not only the one selected per gene by geneIDs2fasta.py), so that fasta2table.py gets about nTranscripts records.
+    Return: The paths of the files (see dataset_paths)."""
+    paths = dataset_paths(prefix)
+    dfFeat, dfTrans, dfExpr = synthetic_transcriptome(nTranscripts, seed)
+    dfFeat.to_csv(paths["features"], sep="\t", index=False)
+    dfTrans.to_csv(paths["transcripts"], sep="\t", index=False)
+    dfExpr.to_csv(paths["expression"], header=False, index=False)
+    # The same coordinates and header as get_ENSEMBL_data and geneIDs2fasta.py.
+    transcripts = dfFeat.set_index("Transcript stable ID").join(dfTrans.set_index("Transcript stable ID")[["Transcript support level (TSL)", "APPRIS annotation", "Source (transcript)"]])
+    transcripts = transcripts.dropna(subset=["cDNA coding start", "cDNA coding end"])
+    for col, agg in (("cDNA coding start", "min"), ("cDNA coding end", "max")):
+        coords = transcripts[col].astype(str).str.split(";", expand=True).apply(pd.to_numeric)
+        transcripts[col] = getattr(coords, agg)(axis=1).astype(np.int64)
+    transcripts["Transcript support level (TSL)"] = transcripts["Transcript support level (TSL)"].astype(str).str.split().str[0]
+    rnalib.txt2fasta(transcripts, open(paths["fasta"], "w"))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='synthTranscriptome', description="Generate a synthetic transcriptome: <prefix>.fa (FASTA of the transcripts with the geneIDs2fasta.py header), <prefix>_features.tsv and <prefix>_transcripts.tsv (BioMart TSVs of all the transcripts) and <prefix>_expr.csv (transcript expression).", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
+    parser.add_argument("prefix", metavar="output_prefix", help="Prefix of the output files.")
+    parser.add_argument('-n', '--transcripts', help="The number of transcripts (all biotypes) of the BioMart TSVs. (Default=10000).", type=int, default=10000, dest="transcripts", metavar="Transcripts")
+    parser.add_argument('-s', '--seed', help="The seed of the random generator. (Default=0).", type=int, default=0, dest="seed", metavar="Seed")
+    optArgs = parser.parse_args()
+    directory = os.path.dirname(optArgs.prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    for path in write_dataset(optArgs.prefix, optArgs.transcripts, optArgs.seed).values():
+        print(path, file=sys.stderr)
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""Build a local ENSEMBL store from an ENSEMBL release dump, to be used by geneIDs2fasta.py --store.
+
+Authors: Costas Bouyioukos, AKE Franz-Arnold and LU Antoine
+mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoine@gmail.com
+2018-19
+@UMR7216 Paris Diderot
+"""
+
+__version__ = "0.4a"
+
+import argparse
+import rnaFeaturesLib
+
+parser = argparse.ArgumentParser(prog='ensemblDump2store', description="Build a local ENSEMBL store (SQLite file) from the cDNA FASTA of an ENSEMBL release and a BioMart export of its transcript attributes.", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+parser.add_argument('cdnaFasta', metavar="cDNA_fasta", help="Path to the cDNA FASTA file of the ENSEMBL release (e.g. Homo_sapiens.GRCh38.cdna.all.fa).")
+parser.add_argument('attribTsv', metavar="attributes_tsv", help="Path to a BioMart TSV export (with header) of the transcript attributes used by geneIDs2fasta.py, apart from the cDNA sequences.")
+parser.add_argument('store', metavar="store_file", help="Path to the store file (created or completed).")
+parser.add_argument('-d', '--dataset', nargs="?", default='hsapiens_gene_ensembl', metavar="ENSEMBL Dataset Name", type=str, help="The Ensembl Dataset of the dump. (Default='hsapiens_gene_ensembl').")
+parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
+
+# Parse the command line arguments.
+optArgs = parser.parse_args()
+
+# Build the store.
+rnaFeaturesLib.EnsemblStore.build_from_dump(optArgs.store, optArgs.dataset, optArgs.cdnaFasta, optArgs.attribTsv)
@@ -14,46 +14,115 @@ __version__ = "0.4a01"
 import sys
 import argparse
 import datetime
-import pandas as pd
-from Bio import SeqIO
 
 import rnaFeaturesLib as rnalib
 
-parser = argparse.ArgumentParser(prog='fasta2table', description="Calculate features from a transcripts fasta file (ENSEMBL header) and return a transcript features' table", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+# The merge subcommand: merge the tables of the shards of a run (see --shard).
+if len(sys.argv) > 1 and sys.argv[1] == "merge":
+    mergeParser = argparse.ArgumentParser(prog='fasta2table merge', description="Merge the features' tables of the shards of a run (--shard i/N) into the final table, in the order of the input FASTA of the run, as a run without shards.", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+    mergeParser.add_argument("shards", nargs='+', metavar="shard_table", help="Paths to the tables of the shards (any output format).")
+    mergeParser.add_argument('-i', '--input', help="Path to the input FASTA file of the run, the rows are put in its order.", type=str, required=True, dest="input", metavar="InputFile")
+    mergeParser.add_argument('-o', '--outfile', help="Path to output table file. (Default=STDOUT).", type=argparse.FileType('w'), default='-', dest="outfile", metavar="OutputFile")
+    mergeParser.add_argument('-f', '--output-format', help="The format of the merged table. (Default='csv').", type=str, choices=rnalib.FeaturesWriter.FORMATS, default="csv", dest="outputFormat", metavar="OutputFormat")
+    mergeArgs = mergeParser.parse_args(sys.argv[2:])
+    metadata = {"argv": str(sys.argv), "date": datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S")}
+    rnalib.merge_features_tables(mergeArgs.shards, mergeArgs.outfile, mergeArgs.outputFormat, metadata, rnalib.fasta_ids(mergeArgs.input))
+    sys.exit(0)
+
+# The serve subcommand: a long-running server of features' tables with the features options below (see rnaFeaturesLib.FeaturesService).
+serveArgs = None
+if len(sys.argv) > 1 and sys.argv[1] == "serve":
+    serveParser = argparse.ArgumentParser(prog='fasta2table serve', description="Serve features' tables to 'fasta2table.py --server' and 'geneIDs2table.py --server' jobs, keeping the imports, tables, cache and BioMart sessions warm between them. The other options are the features options of fasta2table.py.", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+    serveParser.add_argument("address", metavar="address", help="The address to listen on: unix:<path> (or a path) for a Unix socket, [host:]port for TCP.")
+    serveParser.add_argument('-d', '--dataset', default='hsapiens_gene_ensembl', type=str, dest="dataset", metavar="ENSEMBL Dataset Name", help="The default ENSEMBL dataset of the gene ID jobs. (Default='hsapiens_gene_ensembl').")
+    serveParser.add_argument('-m', '--mart-url', help="URL of the BioMart web service. (Default='{}').".format(rnalib.BIOMART_URL), type=str, default=rnalib.BIOMART_URL, dest="martUrl", metavar="MartURL")
+    serveParser.add_argument('-j', '--concurrency', help="The number of BioMart queries running at the same time. (Default=4).", type=int, default=4, dest="concurrency", metavar="Concurrency")
+    serveParser.add_argument('-s', '--store', help="A local ENSEMBL store (SQLite file) for the gene ID jobs, see geneIDs2table.py. (Default=None).", type=str, default=None, dest="store", metavar="StoreFile")
+    serveParser.add_argument('-b', '--batch-size', help="The number of genes fetched and selected at a time in the gene ID jobs. (Default=1000).", type=int, default=1000, dest="batchSize", metavar="BatchSize")
+    serveArgs, featuresArgv = serveParser.parse_known_args(sys.argv[2:])
+
+parser = argparse.ArgumentParser(prog='fasta2table', description="Calculate features from a transcripts fasta file (ENSEMBL header) and return a transcript features' table. Run 'fasta2table merge -h' for merging the tables of shards.", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
 
 parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
 parser.add_argument("infile", nargs='?', default='-', type=argparse.FileType('r'), metavar="input_file", help="Path to input FASTA file. (or STDIN).")
-parser.add_argument("outfile", nargs='?', default='-', type=argparse.FileType('w'), metavar="output_file", help="Path to output CSV file. (or STDOUT).")
+parser.add_argument("outfile", nargs='?', default='-', type=argparse.FileType('w'), metavar="output_file", help="Path to output table file. (or STDOUT).")
 parser.add_argument('-l', '--length-3pUTR', help="The maximum allowed length of a 3'UTR. (Default=5000).", type=int, default=20000, dest="utr3len", metavar="3'UTRLength")
 parser.add_argument('-u', '--utr-files', nargs=2, help="Return two seperate fasta files containing the 5' and 3' UTRs. (Default=None).", type=str, dest="utrFiles", metavar=("5'UTRFile", "3'UTRFile"))
 parser.add_argument('-c', '--clip', help="The 5'UTR segment size to calulate the TOP mRNA local score. (Default=20).", type=int, default=20, dest="clip", metavar="5'UTRclip")
-# TODO add FIMO MEME motifs. parser.add_argument("motifs_file", help="MEME motifs file", default="", type=str)
+parser.add_argument('-w', '--workers', help="The number of RNAfold processes to run in parallel. With 1 a single multi-threaded RNAfold runs per UTR file. (Default=1).", type=int, default=1, dest="workers", metavar="Workers")
+parser.add_argument('--cache-dir', help="Directory of a persistent cache of the RNAfold, local score and CAI results, reused between runs. (Default=None, no cache).", type=str, default=None, dest="cacheDir", metavar="CacheDir")
+parser.add_argument('--cache-size', help="Maximum size of the cache in MB, the least recently used results are evicted beyond it. (Default=1024).", type=int, default=1024, dest="cacheSize", metavar="CacheSize")
+parser.add_argument('-k', '--chunk-size', help="Process the input by chunks of that many transcripts, each chunk is written to the output as soon as it is done so that memory use is bounded by the chunk size. (Default=None, all the input at once).", type=int, default=None, dest="chunkSize", metavar="ChunkSize")
+parser.add_argument('-t', '--codon-table', help="The codon table for the CAI, either an ENSEMBL dataset name (as the --dataset of geneIDs2fasta.py) or the path to a codon table file. (Default=None, the human table, or for the gene ID jobs of 'serve' the one of their dataset).", type=str, default=None, dest="codonTable", metavar="CodonTable")
+parser.add_argument('--motifs', help="A MEME format file of motifs (e.g. of RNA binding proteins) to scan over the UTRs, the number of hits and the best score of each motif are added to the table. (Default=None).", type=str, default=None, dest="motifs", metavar="MotifsFile")
+parser.add_argument('--motif-pvalue', help="The p-value threshold of a motif hit. (Default=1e-4).", type=float, default=1e-4, dest="motifPvalue", metavar="MotifPvalue")
+parser.add_argument('--motif-regions', help="The UTRs the motifs are scanned over. (Default=3pUTR).", nargs='+', type=str, choices=["5pUTR", "3pUTR"], default=["3pUTR"], dest="motifRegions", metavar="Region")
+parser.add_argument('--fold-window', help="Also fold the 3'UTRs by sliding windows of that many nt with a maximum base pair span (as RNAplfold), the mean and minimum MFE per nt of the windows are added to the table next to 3pUTR_MfeBP. (Default=None, no windowed folding).", type=int, default=None, dest="foldWindow", metavar="Window")
+parser.add_argument('--fold-step', help="The step between the windows of --fold-window. (Default=a third of the window).", type=int, default=None, dest="foldStep", metavar="Step")
+parser.add_argument('--max-bp-span', help="The maximum span in nt of a base pair (RNAfold --maxBPspan) of the windowed folding and of the 3pUTR_spanMFE folding. (Default=100).", type=int, default=rnalib.FOLD_MAX_BP_SPAN, dest="maxBPspan", metavar="Span")
+parser.add_argument('--span-fold-above', help="Fully fold only the 3'UTRs up to that many nt (3pUTR_MFE is NaN above), and fold all of them with the --max-bp-span, in a time linear in their length instead of cubic, into the 3pUTR_spanMFE and 3pUTR_spanMfeBP columns (the 3'UTRs of at most --max-bp-span nt are folded once, for both). (Default=None, all the 3'UTRs are fully folded).", type=int, default=None, dest="spanAbove", metavar="Length")
+parser.add_argument('--features', help="Compute only these features, comma separated stage names or columns (e.g. 'lengths,GC,CAI'), only the stages and external programs they need are run. The stages are: {}. With 'list' the stages are described. (Default=all the features).".format(", ".join(rnalib.FEATURE_STAGES)), type=rnalib.parse_features, default=None, dest="features", metavar="Features")
+parser.add_argument('-f', '--output-format', help="The format of the features' table: a semicolon separated CSV, or a typed columnar Parquet or Arrow IPC file (needs pyarrow), with the command line and date as file metadata. (Default='csv').", type=str, choices=rnalib.FeaturesWriter.FORMATS, default="csv", dest="outputFormat", metavar="OutputFormat")
+parser.add_argument('--record-hash', help="Add a record_hash column to the table, the hash of the data the features of each transcript are computed from, needed to update the table later with --previous-table. (Default=False).", action="store_true", dest="recordHash")
+parser.add_argument('-p', '--previous-table', '--update', help="A previous features' table (with record_hash) to update: only the new or changed transcripts are computed, the removed ones are dropped and the others are taken from it. (Default=None).", type=str, default=None, dest="previousTable", metavar="PreviousTable")
+parser.add_argument('--shard', help="Compute only the shard i out of N (1 to N) of the transcripts, chosen by a hash of their ID, to run a job over several nodes. The tables of the shards are merged with 'fasta2table merge'. (Default=None, all the transcripts).", type=rnalib.parse_shard, default=None, dest="shard", metavar="i/N")
+parser.add_argument('-P', '--processes', help="Run the shards over that many local processes and merge them, the input must be a file. (Default=1).", type=int, default=1, dest="processes", metavar="Processes")
+parser.add_argument('-x', '--index', help="Read the input file through an index of its records, built once and saved next to it (<input_file>.idx.npz): the file is memory mapped and parsed by whole records, needed for --ids and --read-processes. (Default=False).", action="store_true", dest="index")
+parser.add_argument('--ids', help="Compute only the transcripts of the IDs of that file (one per line), read directly from the input file with its index. (Default=None, all the transcripts).", type=str, default=None, dest="ids", metavar="IDsFile")
+parser.add_argument('--read-processes', help="Parse the input file over that many processes, with its index. (Default=1).", type=int, default=1, dest="readProcesses", metavar="ReadProcesses")
+parser.add_argument('--server', help="Send the job to a features server ('fasta2table.py serve') at that address instead of computing it here, the features options are the ones of the server. (Default=None).", type=str, default=None, dest="server", metavar="Address")
+parser.add_argument('--stats', help="Write the statistics of the run to a JSON file: the calls, time and records per second of each stage and of the external programs, and the counters (bytes fetched, cache hits...). (Default=None).", type=str, default=None, dest="stats", metavar="StatsFile")
+parser.add_argument('--profile', help="Profile the run with cProfile, written to that file, and trace its memory allocations with tracemalloc, the summaries are printed to STDERR. (Default=None).", type=str, default=None, dest="profile", metavar="ProfileFile")
 
 # Parse the command line arguments.
-optArgs = parser.parse_args()
-
-# Populate the Seq.Record generator.
-seqRecs = SeqIO.parse(optArgs.infile, "fasta")
-
-# Instantiate the ensebl class.
-ensRecs = rnalib.ENSEMBLSeqs(seqRecs).bioSeqRecs
-
-# Extract the features from ENSEMBL.
-ensFeat = rnalib.FeaturesExtract(ensRecs, optArgs)
-de = ensFeat.collect_features()
-
-# Calculate features by using external programs.
-dc = ensFeat.calculate_features()
-# TODO include all these last steps to an ininalise function in the FeaturesExtract class.
+optArgs = parser.parse_args(featuresArgv if serveArgs else None)
+if optArgs.features == ["list"]:
+    print("\n".join(rnalib.describe_features(optArgs)))
+    sys.exit(0)
+try:
+    rnalib.plan_features(optArgs)
+    rnalib.load_codon_index(rnalib.codon_table(optArgs))
+except ValueError as err:
+    parser.error(str(err))
+if serveArgs:
+    service = rnalib.FeaturesService(optArgs, serveArgs.dataset, serveArgs.martUrl, serveArgs.concurrency, 100, serveArgs.store, serveArgs.batchSize)
+    try:
+        service.serve(serveArgs.address)
+    except FileExistsError as err:
+        serveParser.error(str(err))
+    sys.exit(0)
+if optArgs.server:
+    if optArgs.outputFormat != "csv":
+        parser.error("--server only returns CSV tables.")
+    # A thin client: the server does the work.
+    optArgs.outfile.write(rnalib.request_features(optArgs.server, "fasta", optArgs.infile.read(), {"argv": str(sys.argv)}))
+    sys.exit(0)
+if optArgs.previousTable and optArgs.utrFiles:
+    parser.error("--utr-files cannot be used with --previous-table, the UTRs of the unchanged transcripts are not recomputed.")
+if optArgs.processes > 1 and (optArgs.utrFiles or optArgs.shard or optArgs.infile is sys.stdin):
+    parser.error("--processes needs an input file and cannot be used with --utr-files or --shard.")
+# The IDs and the parsing processes need the index.
+optArgs.index = optArgs.index or bool(optArgs.ids) or optArgs.readProcesses > 1
+if optArgs.index and optArgs.infile is sys.stdin:
+    parser.error("--index, --ids and --read-processes need an input file.")
 
-# Concatenate the results
-dd = pd.concat([de, dc], axis=1, sort=False)
+# The command line arguments and the date go to the table trailer (CSV) or metadata.
+metadata = {"argv": str(sys.argv), "date": datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S")}
+# Timers and counters of the run, only if asked for.
+stats = rnalib.enable_stats() if optArgs.stats else None
 
-# Re-arrange data frame columns.
-dd = dd[['ensembl_gene_id', 'gene_name', 'coding_len', 'GC', '5pUTR_len', '5pUTR_GC', '5pUTR_MFE', '5pUTR_MfeBP', '3pUTR_len', '3pUTR_GC', '3pUTR_MFE', '3pUTR_MfeBP', 'TOP_localScore', 'CAI', 'Kozak_Sequence', 'Kozak_Context']]
+with rnalib.profiling(optArgs.profile):
+    if optArgs.processes > 1:
+        # Local shards, merged at the end.
+        rnalib.stream_features_sharded(optArgs.infile.name, optArgs, optArgs.outfile, optArgs.processes, optArgs.chunkSize, metadata)
+    else:
+        # The transcripts are read lazily chunk by chunk, each chunk straight into a compact transcript store.
+        if optArgs.index:
+            transcripts = rnalib.indexed_stores(optArgs.infile.name, optArgs, optArgs.chunkSize)
+        else:
+            transcripts = rnalib.TranscriptStore.iter_fasta(optArgs.infile, optArgs.chunkSize)
+        # Extract the features (collected and calculated by external programs) and write them to the output table, one chunk at a time.
+        rnalib.stream_features(transcripts, optArgs, optArgs.outfile, optArgs.chunkSize, metadata)
 
-# Sort and print to csv file.
-dd.sort_values(by=['ensembl_gene_id', 'coding_len'])
-dd.to_csv(optArgs.outfile, sep=";")
-# Print the command line arguments in the csv file.
-optArgs.outfile.write('# {}\n# {}\n'.format(str(sys.argv), datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S")))
+if stats:
+    stats.write(optArgs.stats, metadata)
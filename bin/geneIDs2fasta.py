@@ -11,6 +11,7 @@ mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoin
 
 __version__ = "0.4a"
 
+import sys
 import argparse
 import rnaFeaturesLib
 
@@ -18,8 +19,19 @@ parser = argparse.ArgumentParser(prog='geneIDs2Fasta', description='Fetch transc
 parser.add_argument('infile', nargs='?', default='-', type=argparse.FileType('r'), metavar="input_file", help='Path to the Ensembl Gene_ID list file. (or STDIN).')
 parser.add_argument("outfile", nargs='?', default='-', type=argparse.FileType('w'), metavar='output_file', help="Path to output FASTA file. (or STDOUT).")
 parser.add_argument('-d', '--dataset', nargs="?", default='hsapiens_gene_ensembl', metavar="ENSEMBL Dataset Name", type=str, help="Choise of the Ensembl Dataset, taken from the web API of ENSEMBL. (Default='hsapiens_gene_ensembl').")
-parser.add_argument('-e', '--expressed-transcripts', help="An expressed transcripts file. It can contain an arbitrary number of columns but the first MUST be the gene name, the second the transcript ID and the third the transcription level estimate of the transcript. (Default=None).", type=argparse.FileType('r'), default=None, dest="exprTrans", metavar="EXPTRANSFile")
+parser.add_argument('-e', '--expressed-transcripts', action='append', help="An expressed transcripts file, gzipped or not, repeat the option for more than one (e.g. one per sample), the transcripts of each gene are selected by their expression level instead of the ENSEMBL classification. They can contain an arbitrary number of columns, by default the first MUST be the gene name, the second the transcript ID and the third the transcription level estimate of the transcript (see --expr-columns). (Default=None).", type=str, default=None, dest="exprTrans", metavar="EXPTRANSFile")
+parser.add_argument('--expr-columns', help="The comma separated gene ID, transcript ID and expression level columns of the expressed transcripts files, as 1-based positions or as names of the header (e.g. 'gene_id,Name,TPM'). More than one expression column is read as more than one sample. Two columns (or '-' as the gene column) are the transcript ID and expression columns of files without gene column, as salmon's quant.sf ('Name,TPM') or kallisto's abundance.tsv ('target_id,tpm'): the genes of the transcripts are taken from ENSEMBL. (Default='1,2,3').", type=str, default="1,2,3", dest="exprColumns", metavar="Columns")
+parser.add_argument('--expr-sep', help="The delimiter of the expressed transcripts files ('tab' for a tab). (Default=a tab if the first line has one, a comma otherwise).", type=str, default=None, dest="exprSep", metavar="Delimiter")
+parser.add_argument('--expr-header', help="The expressed transcripts files start with a header line. (Default=False).", action="store_true", dest="exprHeader")
+parser.add_argument('--expr-threshold', help="The minimum expression level of the selected transcripts. (Default=1).", type=float, default=1.0, dest="exprThreshold", metavar="Threshold")
+parser.add_argument('--expr-aggregate', help="How the expression levels of the samples (files or expression columns) are combined per transcript. (Default='mean').", type=str, choices=["mean", "median"], default="mean", dest="exprAggregate", metavar="Aggregate")
+parser.add_argument('-m', '--mart-url', help="URL of the BioMart web service. (Default='{}').".format(rnaFeaturesLib.BIOMART_URL), type=str, default=rnaFeaturesLib.BIOMART_URL, dest="martUrl", metavar="MartURL")
+parser.add_argument('-j', '--concurrency', help="The number of BioMart queries running at the same time. (Default=4).", type=int, default=4, dest="concurrency", metavar="Concurrency")
+parser.add_argument('-k', '--chunk-size', help="The (initial) number of gene IDs per BioMart query, reduced automatically if queries fail. (Default=100).", type=int, default=100, dest="chunkSize", metavar="ChunkSize")
+parser.add_argument('-s', '--store', help="A local ENSEMBL store (SQLite file, created if needed). Genes are looked up in the store first, only the missing ones are fetched from BioMart and then added to the store. (Default=None).", type=str, default=None, dest="store", metavar="StoreFile")
 parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
+parser.add_argument('--stats', help="Write the statistics of the run to a JSON file: the calls, time and records per second of each stage and of the external programs, and the counters (bytes fetched, cache hits...). (Default=None).", type=str, default=None, dest="stats", metavar="StatsFile")
+parser.add_argument('--profile', help="Profile the run with cProfile, written to that file, and trace its memory allocations with tracemalloc, the summaries are printed to STDERR. (Default=None).", type=str, default=None, dest="profile", metavar="ProfileFile")
 
 # Parse the command line arguments.
 optArgs = parser.parse_args()
@@ -27,10 +39,22 @@ optArgs = parser.parse_args()
 # Quickly take the genes of interest from the file.
 listID = optArgs.infile.read().splitlines()
 
-#print(rnaFeaturesLib.parse_transcripts_expression(optArgs.exprTrans))
 
-# Connect to ENSEBL and select sequences and data.
-transcripts = rnaFeaturesLib.get_ENSEMBL_data(listID, optArgs.dataset, optArgs.exprTrans)
+# Open the local store.
+store = rnaFeaturesLib.EnsemblStore(optArgs.store) if optArgs.store else None
 
-# Print transcript sequences and data to a FASTA file.
-rnaFeaturesLib.txt2fasta(transcripts, optArgs.outfile)
+# Timers and counters of the run, only if asked for.
+stats = rnaFeaturesLib.enable_stats() if optArgs.stats else None
+
+with rnaFeaturesLib.profiling(optArgs.profile):
+    # Read the expression levels of the genes, if any.
+    expression = rnaFeaturesLib.expression_options(optArgs, listID)
+
+    # Connect to ENSEBL and select sequences and data.
+    transcripts = rnaFeaturesLib.get_ENSEMBL_data(listID, optArgs.dataset, expression, optArgs.martUrl, optArgs.concurrency, optArgs.chunkSize, store)
+
+    # Print transcript sequences and data to a FASTA file.
+    rnaFeaturesLib.txt2fasta(transcripts, optArgs.outfile)
+
+if stats:
+    stats.write(optArgs.stats, {"argv": str(sys.argv)})
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""From a list of ENSEMBL Gene_IDs get the features' table in one run, without the intermediate fasta file.
+
+Authors: Costas Bouyioukos, AKE Franz-Arnold and LU Antoine
+mail: costas.bouyioukso@univ-paris-diderot.fr aerod7710@gmail.com lu.zhao.antoine@gmail.com
+2018-19
+@UMR7216 Paris Diderot
+"""
+
+__version__ = "0.4a01"
+
+import sys
+import argparse
+import datetime
+
+import rnaFeaturesLib as rnalib
+
+parser = argparse.ArgumentParser(prog='geneIDs2table', description="Fetch transcript features from ENSEMBL for each gene ID in a list and return a transcript features' table (as geneIDs2fasta.py followed by fasta2table.py).", epilog="Authors: Costas Bouyioukos, Franz-Arnold Ake and Antoine Lu, 2018-19, Paris UMR7216.")
+
+parser.add_argument('-v', '--version', action='version', version='%(prog)s  v. {version}'.format(version=__version__))
+parser.add_argument('infile', nargs='?', default='-', type=argparse.FileType('r'), metavar="input_file", help='Path to the Ensembl Gene_ID list file. (or STDIN).')
+parser.add_argument("outfile", nargs='?', default='-', type=argparse.FileType('w'), metavar="output_file", help="Path to output table file. (or STDOUT).")
+# ENSEMBL options (as geneIDs2fasta.py).
+parser.add_argument('-d', '--dataset', nargs="?", default='hsapiens_gene_ensembl', metavar="ENSEMBL Dataset Name", type=str, help="Choise of the Ensembl Dataset, taken from the web API of ENSEMBL. (Default='hsapiens_gene_ensembl').")
+parser.add_argument('-e', '--expressed-transcripts', action='append', help="An expressed transcripts file, gzipped or not, repeat the option for more than one (e.g. one per sample), the transcripts of each gene are selected by their expression level instead of the ENSEMBL classification. They can contain an arbitrary number of columns, by default the first MUST be the gene name, the second the transcript ID and the third the transcription level estimate of the transcript (see --expr-columns). (Default=None).", type=str, default=None, dest="exprTrans", metavar="EXPTRANSFile")
+parser.add_argument('--expr-columns', help="The comma separated gene ID, transcript ID and expression level columns of the expressed transcripts files, as 1-based positions or as names of the header (e.g. 'gene_id,Name,TPM'). More than one expression column is read as more than one sample. Two columns (or '-' as the gene column) are the transcript ID and expression columns of files without gene column, as salmon's quant.sf ('Name,TPM') or kallisto's abundance.tsv ('target_id,tpm'): the genes of the transcripts are taken from ENSEMBL. (Default='1,2,3').", type=str, default="1,2,3", dest="exprColumns", metavar="Columns")
+parser.add_argument('--expr-sep', help="The delimiter of the expressed transcripts files ('tab' for a tab). (Default=a tab if the first line has one, a comma otherwise).", type=str, default=None, dest="exprSep", metavar="Delimiter")
+parser.add_argument('--expr-header', help="The expressed transcripts files start with a header line. (Default=False).", action="store_true", dest="exprHeader")
+parser.add_argument('--expr-threshold', help="The minimum expression level of the selected transcripts. (Default=1).", type=float, default=1.0, dest="exprThreshold", metavar="Threshold")
+parser.add_argument('--expr-aggregate', help="How the expression levels of the samples (files or expression columns) are combined per transcript. (Default='mean').", type=str, choices=["mean", "median"], default="mean", dest="exprAggregate", metavar="Aggregate")
+parser.add_argument('-m', '--mart-url', help="URL of the BioMart web service. (Default='{}').".format(rnalib.BIOMART_URL), type=str, default=rnalib.BIOMART_URL, dest="martUrl", metavar="MartURL")
+parser.add_argument('-j', '--concurrency', help="The number of BioMart queries running at the same time. (Default=4).", type=int, default=4, dest="concurrency", metavar="Concurrency")
+parser.add_argument('-k', '--chunk-size', help="The (initial) number of gene IDs per BioMart query, reduced automatically if queries fail. (Default=100).", type=int, default=100, dest="chunkSize", metavar="ChunkSize")
+parser.add_argument('-s', '--store', help="A local ENSEMBL store (SQLite file, created if needed). Genes are looked up in the store first, only the missing ones are fetched from BioMart and then added to the store. (Default=None).", type=str, default=None, dest="store", metavar="StoreFile")
+parser.add_argument('-b', '--batch-size', help="The number of genes fetched and selected at a time, the features of a batch are extracted while the next batches are fetched. (Default=1000).", type=int, default=1000, dest="batchSize", metavar="BatchSize")
+parser.add_argument('-a', '--fasta', help="Also write the selected transcripts to a FASTA file (as geneIDs2fasta.py). (Default=None).", type=argparse.FileType('w'), default=None, dest="fasta", metavar="FASTAFile")
+# Features options (as fasta2table.py).
+parser.add_argument('-l', '--length-3pUTR', help="The maximum allowed length of a 3'UTR. (Default=5000).", type=int, default=20000, dest="utr3len", metavar="3'UTRLength")
+parser.add_argument('-u', '--utr-files', nargs=2, help="Return two seperate fasta files containing the 5' and 3' UTRs. (Default=None).", type=str, dest="utrFiles", metavar=("5'UTRFile", "3'UTRFile"))
+parser.add_argument('-c', '--clip', help="The 5'UTR segment size to calulate the TOP mRNA local score. (Default=20).", type=int, default=20, dest="clip", metavar="5'UTRclip")
+parser.add_argument('-w', '--workers', help="The number of RNAfold processes to run in parallel. With 1 a single multi-threaded RNAfold runs per UTR file. (Default=1).", type=int, default=1, dest="workers", metavar="Workers")
+parser.add_argument('--cache-dir', help="Directory of a persistent cache of the RNAfold, local score and CAI results, reused between runs. (Default=None, no cache).", type=str, default=None, dest="cacheDir", metavar="CacheDir")
+parser.add_argument('--cache-size', help="Maximum size of the cache in MB, the least recently used results are evicted beyond it. (Default=1024).", type=int, default=1024, dest="cacheSize", metavar="CacheSize")
+parser.add_argument('-t', '--codon-table', help="The codon table for the CAI, either an ENSEMBL dataset name (as the --dataset) or the path to a codon table file. (Default=None, the one of the --dataset).", type=str, default=None, dest="codonTable", metavar="CodonTable")
+parser.add_argument('--motifs', help="A MEME format file of motifs (e.g. of RNA binding proteins) to scan over the UTRs, the number of hits and the best score of each motif are added to the table. (Default=None).", type=str, default=None, dest="motifs", metavar="MotifsFile")
+parser.add_argument('--motif-pvalue', help="The p-value threshold of a motif hit. (Default=1e-4).", type=float, default=1e-4, dest="motifPvalue", metavar="MotifPvalue")
+parser.add_argument('--motif-regions', help="The UTRs the motifs are scanned over. (Default=3pUTR).", nargs='+', type=str, choices=["5pUTR", "3pUTR"], default=["3pUTR"], dest="motifRegions", metavar="Region")
+parser.add_argument('--fold-window', help="Also fold the 3'UTRs by sliding windows of that many nt with a maximum base pair span (as RNAplfold), the mean and minimum MFE per nt of the windows are added to the table next to 3pUTR_MfeBP. (Default=None, no windowed folding).", type=int, default=None, dest="foldWindow", metavar="Window")
+parser.add_argument('--fold-step', help="The step between the windows of --fold-window. (Default=a third of the window).", type=int, default=None, dest="foldStep", metavar="Step")
+parser.add_argument('--max-bp-span', help="The maximum span in nt of a base pair (RNAfold --maxBPspan) of the windowed folding and of the 3pUTR_spanMFE folding. (Default=100).", type=int, default=rnalib.FOLD_MAX_BP_SPAN, dest="maxBPspan", metavar="Span")
+parser.add_argument('--span-fold-above', help="Fully fold only the 3'UTRs up to that many nt (3pUTR_MFE is NaN above), and fold all of them with the --max-bp-span, in a time linear in their length instead of cubic, into the 3pUTR_spanMFE and 3pUTR_spanMfeBP columns. (Default=None, all the 3'UTRs are fully folded).", type=int, default=None, dest="spanAbove", metavar="Length")
+parser.add_argument('--features', help="Compute only these features, comma separated stage names or columns (e.g. 'lengths,GC,CAI'), only the stages and external programs they need are run. The stages are: {}. With 'list' the stages are described. (Default=all the features).".format(", ".join(rnalib.FEATURE_STAGES)), type=rnalib.parse_features, default=None, dest="features", metavar="Features")
+parser.add_argument('-f', '--output-format', help="The format of the features' table: a semicolon separated CSV, or a typed columnar Parquet or Arrow IPC file (needs pyarrow), with the command line and date as file metadata. (Default='csv').", type=str, choices=rnalib.FeaturesWriter.FORMATS, default="csv", dest="outputFormat", metavar="OutputFormat")
+
+parser.add_argument('--record-hash', help="Add a record_hash column to the table, the hash of the data the features of each transcript are computed from, needed to update the table later with --previous-table. (Default=False).", action="store_true", dest="recordHash")
+parser.add_argument('-p', '--previous-table', '--update', help="A previous features' table (with record_hash) to update: only the new or changed transcripts are computed, the removed ones are dropped and the others are taken from it. (Default=None).", type=str, default=None, dest="previousTable", metavar="PreviousTable")
+parser.add_argument('--server', help="Send the job to a features server ('fasta2table.py serve') at that address instead of computing it here, the features and ENSEMBL options (but the dataset) are the ones of the server. (Default=None).", type=str, default=None, dest="server", metavar="Address")
+parser.add_argument('--stats', help="Write the statistics of the run to a JSON file: the calls, time and records per second of each stage and of the external programs, and the counters (bytes fetched, cache hits...). (Default=None).", type=str, default=None, dest="stats", metavar="StatsFile")
+parser.add_argument('--profile', help="Profile the run with cProfile, written to that file, and trace its memory allocations with tracemalloc, the summaries are printed to STDERR. (Default=None).", type=str, default=None, dest="profile", metavar="ProfileFile")
+# Parse the command line arguments.
+optArgs = parser.parse_args()
+if optArgs.features == ["list"]:
+    print("\n".join(rnalib.describe_features(optArgs)))
+    sys.exit(0)
+# The CAI of the genes of a dataset is computed with the codon table of that dataset by default.
+optArgs.codonTable = rnalib.codon_table(optArgs, optArgs.dataset)
+try:
+    rnalib.plan_features(optArgs)
+    rnalib.load_codon_index(optArgs.codonTable)
+except ValueError as err:
+    parser.error(str(err))
+if optArgs.previousTable and optArgs.utrFiles:
+    parser.error("--utr-files cannot be used with --previous-table, the UTRs of the unchanged transcripts are not recomputed.")
+
+# Quickly take the genes of interest from the file.
+listID = optArgs.infile.read().splitlines()
+
+if optArgs.server:
+    if optArgs.exprTrans or optArgs.fasta or optArgs.outputFormat != "csv":
+        parser.error("--server cannot be used with --expressed-transcripts or --fasta, and only returns CSV tables.")
+    # A thin client: the server does the work.
+    optArgs.outfile.write(rnalib.request_features(optArgs.server, "genes", "\n".join(listID), {"dataset": optArgs.dataset, "argv": str(sys.argv)}))
+    sys.exit(0)
+
+# Open the local store.
+store = rnalib.EnsemblStore(optArgs.store) if optArgs.store else None
+
+# Fetch, select and extract the features batch by batch, the table is written as the batches are done.
+# The command line arguments and the date go to the table trailer (CSV) or metadata.
+metadata = {"argv": str(sys.argv), "date": datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S")}
+# Timers and counters of the run, only if asked for.
+stats = rnalib.enable_stats() if optArgs.stats else None
+with rnalib.profiling(optArgs.profile):
+    # The expression levels of the genes, read once for all the batches.
+    expression = rnalib.expression_options(optArgs, listID)
+    rnalib.pipeline_features(listID, optArgs.dataset, optArgs, optArgs.outfile, expression, optArgs.martUrl, optArgs.concurrency, optArgs.chunkSize, store, optArgs.batchSize, optArgs.fasta, metadata)
+if stats:
+    stats.write(optArgs.stats, metadata)
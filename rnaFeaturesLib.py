@@ -10,215 +10,1976 @@ import sys
 import io
 import re
 import math
+import heapq
+import json
+import time
+import hashlib
+import gzip
+import zlib
+import mmap
+import stat
 import tempfile
-import shlex
-import shutil
+import sqlite3
+import threading
+import queue
+import functools
+import itertools
 import subprocess
+import socket
+import signal
+import socketserver
+import http.client
+import http.server
+import urllib.parse
+import contextlib
+import resource
+import cProfile
+import pstats
+import tracemalloc
 from collections import namedtuple
-import pandas as pd
-from biomart import BiomartServer
-from Bio import SeqIO
-from Bio.SeqUtils import GC
-from Bio.SeqUtils import CodonUsage
-
-import local_score
-
+from types import SimpleNamespace
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import importlib
+import importlib.util
+import numpy as np
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+
+class LazyModule(object):
+    """Stand-in for a module imported on the first access to one of its attributes.
+
+    The heavy dependencies (pandas, requests, Biopython, pyarrow) are only imported by the code paths that use them, so that the scripts (and their clients of a features server) start fast."""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def load(self):
+        """Return: The module, imported now if it was not yet."""
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __repr__(self):
+        return "<lazy module {}{}>".format(self._name, "" if self._module is None else " (imported)")
+
+
+pd = LazyModule("pandas")
+requests = LazyModule("requests")
+SeqIO = LazyModule("Bio.SeqIO")
+FastaIO = LazyModule("Bio.SeqIO.FastaIO")
+SeqUtils = LazyModule("Bio.SeqUtils")
+# Optional, only needed for the Parquet and Arrow output formats.
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+
+
+def have_pyarrow():
+    """Return: True if pyarrow is installed (without importing it)."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+# The columns of the features' table, in their output order.
+FEATURES_COLUMNS = ['ensembl_gene_id', 'gene_name', 'coding_len', 'GC', '5pUTR_len', '5pUTR_GC', '5pUTR_MFE', '5pUTR_MfeBP', '3pUTR_len', '3pUTR_GC', '3pUTR_MFE', '3pUTR_MfeBP', 'TOP_localScore', 'CAI', 'Kozak_Sequence', 'Kozak_Context']
+# The types of the columns of the features' table (the index is the transcript ID), the GC columns are written with 2 decimals in CSV.
+# The optional record_hash column is the hash of the transcript data the features are computed from (see TranscriptStore.record_hashes).
+FEATURES_DTYPES = {'ensembl_transcript_id': 'string', 'ensembl_gene_id': 'string', 'gene_name': 'string', 'coding_len': 'int64', 'GC': 'float64', '5pUTR_len': 'int64', '5pUTR_GC': 'float64', '5pUTR_MFE': 'float64', '5pUTR_MfeBP': 'float64', '3pUTR_len': 'int64', '3pUTR_GC': 'float64', '3pUTR_MFE': 'float64', '3pUTR_MfeBP': 'float64', 'TOP_localScore': 'int64', 'CAI': 'float64', 'Kozak_Sequence': 'string', 'Kozak_Context': 'string', 'record_hash': 'string'}
+GC_COLUMNS = ['GC', '5pUTR_GC', '3pUTR_GC']
+
+# The BioMart web service of ENSEMBL.
+BIOMART_URL = "http://www.ensembl.org/biomart/martservice"
+
+# The two lists of BioMart attributes fetched per gene (features and sequences, transcript classification) and the display names BioMart gives them as TSV header.
+FEATURE_ATTRIBUTES = ['ensembl_gene_id', 'ensembl_transcript_id', 'external_gene_name', 'transcript_length', 'transcript_biotype', 'cdna_coding_start', 'cdna_coding_end', 'cdna', 'description']
+TRANSCRIPT_ATTRIBUTES = ['ensembl_gene_id', 'ensembl_transcript_id', 'transcript_tsl', 'transcript_appris', 'transcript_source', 'transcript_length', 'transcript_biotype']
+BIOMART_COLUMNS = {'ensembl_gene_id': 'Gene stable ID', 'ensembl_transcript_id': 'Transcript stable ID', 'external_gene_name': 'Gene name', 'transcript_length': 'Transcript length (including UTRs and CDS)', 'transcript_biotype': 'Transcript type', 'cdna_coding_start': 'cDNA coding start', 'cdna_coding_end': 'cDNA coding end', 'cdna': 'cDNA sequences', 'description': 'Gene description', 'transcript_tsl': 'Transcript support level (TSL)', 'transcript_appris': 'APPRIS annotation', 'transcript_source': 'Source (transcript)'}
+
+# The ranks of the transcript sources and the sort prefixes of the APPRIS annotations in the ENSEMBL classification.
+HAVANA_RANKS = {"ensembl_havana": 0, "ensembl": 1, "havana": 2}
+APPRIS_PREFIXES = {"principal": "a", "alternative": "b"}
+
+# The letter-probability matrix of a MEME motif (width x ACGT/U) and the background frequencies of its file.
+Motif = namedtuple('Motif', "name, probs, background, nsites")
+# A stage of the features' table (see register_feature): its columns and inputs (lists, or functions of the options), the external programs it runs, its relative cost per transcript, the function computing it and the function of the options giving the parameters its results depend on.
+FeatureStage = namedtuple('FeatureStage', "name, columns, inputs, tools, cost, compute, params")
+# The inputs a feature stage can need: the header fields, the whole sequence, and the sequences of the regions given to the external programs.
+FEATURE_INPUTS = ("header", "sequence", "5pUTR", "3pUTR", "CDS")
+# The registered feature stages by name, in the order of registration.
+FEATURE_STAGES = {}
+# The integer scores of a motif range from 0 to about this value (as FIMO, for exact p-values).
+MOTIF_SCORE_RANGE = 1000
+# The letters per k-mer of the lookup tables of the motif scanner (tables of 5**k scores).
+MOTIF_KMER = 6
+# The lines per chunk of the transcript expression files.
+EXPRESSION_CHUNK = 500000
+# The version suffix of the transcript IDs of the quantification tables (ENST00000456328.2), the stable IDs of ENSEMBL have none.
+ID_VERSION = re.compile(r"\.\d+$")
+# The suffix of the record index of a FASTA file (see FastaIndex), and the bytes scanned at a time to build it.
+FASTA_INDEX_SUFFIX = ".idx.npz"
+FASTA_INDEX_BLOCK = 2**26
+# The default window and maximum base pair span (in nt) of the windowed and span limited folding of the 3'UTRs (as RNAplfold -W 150 -L 100).
+FOLD_WINDOW = 150
+FOLD_MAX_BP_SPAN = 100
+# The features of the FASTA headers of geneIDs2fasta.py kept in a TranscriptStore.
+FASTA_HEADER_KEYS = ("GeneID", "GeneName", "cDNA_start", "cDNA_end", "TSL", "APPRIS", "Source")
 
 
 # CLASSES Interface.
 class ENSEMBLSeqs(object):
     """Class to represent RNA related sequence features from ENSEMBL.
 
-    Needs a Bio.Seq.Record generator object to initialise."""
+    Needs a Bio.Seq.Record generator object to initialise.
+    With expand=False the generator is not expanded, the records are read by chunks with iter_chunks."""
 
-    def __init__(self, bioSeqRecsGen):
+    def __init__(self, bioSeqRecsGen, expand=True):
         self.gen = bioSeqRecsGen
-        self.bioSeqRecs = self.get_bio_seqrec()
+        self.bioSeqRecs = self.get_bio_seqrec() if expand else None
 
     def get_bio_seqrec(self):
         """Expands the Bio.Seq.Rec generator to a list of Bio.Record objects.
 
         Also puts some SeqIO.record member variables in place, namely the id, the gene name, the description and the features."""
-
-        def _construct_bio_seq(recs, rec):
-            """Auxiiary function to construct a Bio.Seq object."""
-            # Extract the gene name.
-            rec.name = rec.description.split("|")[2].split(":")[1]
-            descr = rec.description.split("|")[-1]
-            # Extract all the features as a dictionary (apart from the last one which was the description.).
-            feat = dict(item.split(":") for item in rec.description.split("|")[1:-1])
-            rec.features = feat  # TODO for the moment all the features are stored as a dictionary and not as proper SeqFeature objects. (perhaps we can stick with that and there is no need to change it.)
-            rec.description = descr
-            recs.append(rec)
-
-        recs = []
-        for rec in self.gen:
-            _construct_bio_seq(recs, rec)
-        return recs
+        return [self._construct_bio_seq(rec) for rec in self.gen]
+
+    def iter_chunks(self, chunkSize):
+        """Read the Bio.Seq.Rec generator lazily and yield lists of at most chunkSize Bio.Record objects."""
+        while True:
+            chunk = [self._construct_bio_seq(rec) for rec in itertools.islice(self.gen, chunkSize)]
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def _construct_bio_seq(rec):
+        """Auxiiary function to construct a Bio.Seq object."""
+        # Extract the gene name.
+        rec.name = rec.description.split("|")[2].split(":")[1]
+        descr = rec.description.split("|")[-1]
+        # Extract all the features as a dictionary (apart from the last one which was the description.).
+        feat = dict(item.split(":") for item in rec.description.split("|")[1:-1])
+        rec.features = feat  # TODO for the moment all the features are stored as a dictionary and not as proper SeqFeature objects. (perhaps we can stick with that and there is no need to change it.)
+        rec.description = descr
+        return rec
+
+
+class TranscriptStore(object):
+    """Compact store of transcripts, in place of a list of SeqIO records with their features dictionaries.
+
+    The sequences are concatenated in one uint8 buffer (the i-th sequence is buf[offsets[i]:offsets[i+1]]) and the header fields are typed NumPy columns.
+    The IDs and names are object arrays of Python strings (a fixed width NumPy string column takes 4 bytes per character of its longest value for every row),
+    the annotations (TSL, APPRIS, source), which have few distinct values, are stored as codes in an array of categories (see pd.factorize).
+    The UTR, CDS and Kozak sequences are views of the buffer (no copies), see region and segments."""
+    REGIONS = ("5pUTR", "3pUTR", "CDS", "Kozak", "KozakContext")
+
+    def __init__(self, buf, offsets, ids, geneIDs, geneNames, cdnaStart, cdnaEnd, tsl=None, appris=None, source=None):
+        self.buf = buf
+        self.offsets = offsets
+        self.ids = string_column(ids)
+        self.geneIDs = string_column(geneIDs)
+        self.geneNames = string_column(geneNames)
+        self.cdnaStart = np.asarray(cdnaStart, dtype=np.int64)
+        self.cdnaEnd = np.asarray(cdnaEnd, dtype=np.int64)
+        empty = [""] * len(self.ids)
+        self.annotations = {}
+        for name, values in (("tsl", tsl), ("appris", appris), ("source", source)):
+            codes, categories = pd.factorize(string_column(empty if values is None else values))
+            self.annotations[name] = (codes, np.asarray(categories, dtype=object))
+        self._windows = {}
+
+    @property
+    def tsl(self):
+        return self.annotation("tsl")
+
+    @property
+    def appris(self):
+        return self.annotation("appris")
+
+    @property
+    def source(self):
+        return self.annotation("source")
+
+    def annotation(self, name):
+        """Return: The values of an annotation column (tsl, appris or source) as an object array."""
+        codes, categories = self.annotations[name]
+        return categories[codes]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_records(cls, bioSeqRecs):
+        """Build the store from a list of SeqIO records (as the ones of ENSEMBLSeqs)."""
+        buf, offsets = pack_sequences([str(rec.seq) for rec in bioSeqRecs])
+        feats = [rec.features for rec in bioSeqRecs]
+        return cls(buf, offsets, [rec.id for rec in bioSeqRecs], [f["GeneID"] for f in feats], [rec.name for rec in bioSeqRecs],
+                   [int(f["cDNA_start"]) for f in feats], [int(f["cDNA_end"]) for f in feats],
+                   [f.get("TSL", "") for f in feats], [f.get("APPRIS", "") for f in feats], [f.get("Source", "") for f in feats])
+
+    @classmethod
+    def from_transcripts(cls, transcripts):
+        """Build the store from the data frame of the selected transcripts (as returned by get_ENSEMBL_data)."""
+        buf, offsets = pack_sequences([str(seq) for seq in transcripts["cDNA sequences"]])
+        return cls(buf, offsets, [str(i) for i in transcripts.index], transcripts["Gene stable ID"].astype(str), transcripts["Gene name"].astype(str),
+                   transcripts["cDNA coding start"].to_numpy(dtype=np.int64), transcripts["cDNA coding end"].to_numpy(dtype=np.int64),
+                   transcripts["Transcript support level (TSL)"].astype(str), transcripts["APPRIS annotation"].astype(str), transcripts["Source (transcript)"].astype(str))
+
+    @classmethod
+    def iter_fasta(cls, handle, chunkSize=None):
+        """Read a FASTA file with the headers of geneIDs2fasta.py lazily and yield stores of at most chunkSize transcripts (all of them if None).
+
+        The records are parsed straight into the buffer and the columns, without SeqIO records."""
+        records = ((title, seq.encode("ascii")) for title, seq in FastaIO.SimpleFastaParser(handle))
+        while True:
+            start = time.perf_counter()
+            store = cls.from_fasta_records(itertools.islice(records, chunkSize))
+            if not len(store):
+                return
+            if STATS is not None:
+                STATS.add_time("read_fasta", time.perf_counter() - start, len(store))
+            yield store
+
+    @classmethod
+    def from_fasta_records(cls, records):
+        """Build the store from (header, sequence bytes) FASTA records with the headers of geneIDs2fasta.py, parsed straight into the buffer and the columns."""
+        titles = []
+        buf = bytearray()
+        offsets = [0]
+        for title, seq in records:
+            titles.append(title)
+            buf += seq
+            offsets.append(len(buf))
+        return cls.from_fasta(titles, np.frombuffer(buf, dtype=np.uint8), np.array(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_fasta(cls, titles, buf, offsets):
+        """Build the store from the headers of geneIDs2fasta.py FASTA records and their packed sequences (see pack_sequences)."""
+        columns = parse_fasta_headers(titles)
+        return cls(buf, offsets, columns["id"], columns["GeneID"], columns["GeneName"], np.array(columns["cDNA_start"], dtype=np.int64),
+                   np.array(columns["cDNA_end"], dtype=np.int64), columns["TSL"], columns["APPRIS"], columns["Source"])
+
+    @classmethod
+    def concat(cls, stores):
+        """Return: One store with the transcripts of all the stores, in order."""
+        stores = list(stores)
+        offsets = [np.zeros(1, dtype=np.int64)]
+        end = 0
+        for store in stores:
+            offsets.append(store.offsets[1:] + end)
+            end += int(store.offsets[-1])
+        return cls(np.concatenate([store.buf for store in stores]) if stores else np.zeros(0, dtype=np.uint8), np.concatenate(offsets),
+                   *(np.concatenate([getattr(store, attr) for store in stores]) if stores else [] for attr in ("ids", "geneIDs", "geneNames", "cdnaStart", "cdnaEnd", "tsl", "appris", "source")))
+
+    def take(self, indices):
+        """Return: A new store with the transcripts at the given positions (the sequences are copied)."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        ends = self.offsets[indices + 1]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        buf = np.concatenate([self.buf[start:end] for start, end in zip(starts, ends)]) if len(indices) else self.buf[:0]
+        return TranscriptStore(buf, offsets, self.ids[indices], self.geneIDs[indices], self.geneNames[indices], self.cdnaStart[indices], self.cdnaEnd[indices],
+                               self.tsl[indices], self.appris[indices], self.source[indices])
+
+    def record_hashes(self, params=""):
+        """Hash the data the features of each transcript are computed from: the sequence, the gene ID and name, the cDNA coding start and end and the params string.
+
+        Return: An array of hexadecimal hashes."""
+        hashes = []
+        for i in range(len(self)):
+            h = hashlib.sha1(self.sequence(i))
+            h.update("|{}|{}|{}|{}|{}".format(self.geneIDs[i], self.geneNames[i], self.cdnaStart[i], self.cdnaEnd[i], params).encode())
+            hashes.append(h.hexdigest()[:16])
+        return np.array(hashes, dtype=str)
+
+    def shard(self, index, count):
+        """Return: A new store with the transcripts of the shard <index> out of <count> (1 to count), chosen by a stable hash (CRC32) of their ID."""
+        inShard = np.array([zlib.crc32(recID.encode()) % count == index - 1 for recID in self.ids.tolist()], dtype=bool)
+        return self.take(np.flatnonzero(inShard))
+
+    def windows(self, s=10, c=20):
+        """Return: The "<region>_start"/"<region>_end" arrays of the regions of all the transcripts (see feature_windows), computed once."""
+        if (s, c) not in self._windows:
+            self._windows[(s, c)] = feature_windows(np.diff(self.offsets), self.cdnaStart, self.cdnaEnd, s, c)
+        return self._windows[(s, c)]
+
+    def sequence(self, i):
+        """Return: A view of the sequence of the i-th transcript."""
+        return self.buf[self.offsets[i]:self.offsets[i + 1]]
+
+    def segments(self, region, indices=None, s=10, c=20):
+        """Return: The (buf, starts, ends) segments of a region (one of REGIONS) of the transcripts (the ones at indices if given), for the kernels reading the buffer (see as_segments)."""
+        windows = self.windows(s, c)
+        starts = self.offsets[:-1] + windows[region + "_start"]
+        ends = self.offsets[:-1] + windows[region + "_end"]
+        if indices is not None:
+            starts, ends = starts[indices], ends[indices]
+        return self.buf, starts, ends
+
+    def region(self, i, region, s=10, c=20):
+        """Return: A view of a region (one of REGIONS) of the i-th transcript, as uint8 array."""
+        windows = self.windows(s, c)
+        start = self.offsets[i]
+        return self.buf[start + windows[region + "_start"][i]:start + windows[region + "_end"][i]]
+
+    def utr5(self, i):
+        return self.region(i, "5pUTR")
+
+    def utr3(self, i):
+        return self.region(i, "3pUTR")
+
+    def cds(self, i):
+        return self.region(i, "CDS")
+
+    def kozak(self, i, s=10, c=20):
+        return self.region(i, "Kozak", s, c)
+
+    def kozak_context(self, i, s=10, c=20):
+        return self.region(i, "KozakContext", s, c)
+
+    @staticmethod
+    def text(view):
+        """Return: The string of a sequence view."""
+        return view.tobytes().decode("ascii")
+
+
+class FastaIndex(object):
+    """Record index of a FASTA file with the headers of geneIDs2fasta.py, for reading it by chunks in parallel or by transcript ID.
+
+    The file is memory mapped and the start of each record is found once, the offsets and the transcript IDs are saved next to it (<path>.idx.npz) and reused while the file is unchanged.
+    The IDs are an object array of Python strings, saved as their newline separated bytes.
+    The records are parsed straight into TranscriptStores (see TranscriptStore.from_fasta_records), by ranges of whole records that worker processes can parse on their own."""
+
+    def __init__(self, path, indexPath=None):
+        self.path = path
+        self.indexPath = indexPath or path + FASTA_INDEX_SUFFIX
+        fileStat = os.stat(path)
+        self.key = np.array([fileStat.st_size, fileStat.st_mtime_ns], dtype=np.int64)
+        if not self.load():
+            with stats_stage("index_fasta"):
+                self.build()
+            self.save()
+        self._positions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        """Load the saved index, if it is the one of the current file.
+
+        Return: True if it was loaded."""
+        try:
+            with np.load(self.indexPath, allow_pickle=False) as saved:
+                if not np.array_equal(saved["key"], self.key):
+                    return False
+                if saved["ids"].dtype != np.uint8:
+                    # An index of an older version, with the IDs as a NumPy string array.
+                    return False
+                self.starts = saved["starts"]
+                self.ids = string_column(saved["ids"].tobytes().decode("ascii", "replace").split("\n") if len(self.starts) > 1 else [])
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def build(self):
+        """Find the start of the records (a ">" at the start of a line) block by block and read their transcript IDs."""
+        size = int(self.key[0])
+        starts = []
+        with open(self.path, "rb") as fh, (mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else contextlib.nullcontext(b"")) as mm:
+            for pos in range(0, size, FASTA_INDEX_BLOCK):
+                # One byte before the block, to tell if a ">" starts a line.
+                first = max(pos - 1, 0)
+                block = np.frombuffer(mm[first:pos + FASTA_INDEX_BLOCK], dtype=np.uint8)
+                hits = np.flatnonzero(block == ord(">")) + first
+                lineStart = (hits == 0) | (block[np.maximum(hits - first - 1, 0)] == ord("\n"))
+                starts.append(hits[lineStart & (hits >= pos)])
+            self.starts = np.concatenate(starts + [np.array([size])]).astype(np.int64)
+            ids = []
+            for start in self.starts[:-1].tolist():
+                end = mm.find(b"\n", start)
+                # The transcript ID, as parse_fasta_header.
+                name = mm[start + 1:end if end >= 0 else size].split(b"|", 1)[0].split()
+                ids.append(name[0].decode("ascii", "replace") if name else "")
+        self.ids = string_column(ids)
+
+    def save(self):
+        """Save the index next to the file, or only warn if it cannot be written."""
+        try:
+            with open(self.indexPath, "wb") as fh:
+                np.savez(fh, key=self.key, starts=self.starts, ids=np.frombuffer("\n".join(self.ids.tolist()).encode("ascii", "replace"), dtype=np.uint8))
+        except OSError as err:
+            print("The FASTA index cannot be saved ({}), it is rebuilt at each run.".format(err), file=sys.stderr)
+
+    def positions(self, ids):
+        """Return: The positions of the records of the transcript IDs, in the order of the file. The IDs not in the file are reported and skipped."""
+        if self._positions is None:
+            self._positions = {recID: i for i, recID in enumerate(self.ids.tolist())}
+        ids = list(dict.fromkeys(ids))
+        found = [self._positions[recID] for recID in ids if recID in self._positions]
+        if len(found) < len(ids):
+            print("{} transcript IDs are not in {}.".format(len(ids) - len(found), self.path), file=sys.stderr)
+        return np.sort(np.array(found, dtype=np.int64))
+
+    def shard_positions(self, index, count):
+        """Return: The positions of the records of the shard <index> out of <count> (as TranscriptStore.shard)."""
+        return np.flatnonzero([zlib.crc32(recID.encode()) % count == index - 1 for recID in self.ids.tolist()])
+
+    def iter_stores(self, chunkSize=None, positions=None, processes=1):
+        """Parse the records (all of them, or the ones at positions) and yield TranscriptStores of at most chunkSize transcripts (all of them if None).
+
+        With processes > 1 the chunks are parsed by that many worker processes, a few chunks ahead of the consumer, and yielded in order.
+        Without chunkSize the records are split between the processes and the parts are joined in one store."""
+        if positions is None:
+            positions = np.arange(len(self), dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return
+        if chunkSize:
+            parts = [positions[i:i + chunkSize] for i in range(0, len(positions), chunkSize)]
+        else:
+            parts = np.array_split(positions, min(processes, len(positions)))
+        # The byte ranges of each part, runs of consecutive records are read at once.
+        ranges = [record_ranges(self.starts, part) for part in parts]
+        if processes <= 1:
+            stores = (parse_fasta_ranges(self.path, r) for r in ranges)
+        else:
+            stores = self._parallel(ranges, processes)
+        if chunkSize:
+            yield from stores
+        else:
+            yield TranscriptStore.concat(stores)
+
+    def _parallel(self, ranges, processes):
+        """Parse the byte ranges in worker processes, at most 2 * processes of them at a time, and yield the stores in order."""
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = []
+            for r in ranges:
+                pending.append(pool.submit(parse_fasta_ranges, self.path, r, True))
+                if len(pending) >= 2 * processes:
+                    yield self._result(pending.pop(0))
+            for fut in pending:
+                yield self._result(fut)
+
+    @staticmethod
+    def _result(fut):
+        """Return: The store of a worker, its parsing time is added to STATS."""
+        with stats_stage("wait_for_fasta"):
+            store, seconds = fut.result()
+        if STATS is not None:
+            STATS.add_time("read_fasta", seconds, len(store))
+        return store
 
 
 class FeaturesExtract(object):
     """Claas to extract features."""
 
-    def __init__(self, bioSeqRecs, options):
-        """Initialise with a list of SeqIO records."""
+    def __init__(self, bioSeqRecs, options, cache=None, previous=None):
+        """Initialise with a list of SeqIO records or a TranscriptStore (see from_transcripts to initialise with a data frame).
+
+        An already open ResultsCache can be shared between instances, otherwise one is opened if options.cacheDir is set.
+        previous: A features' table with record_hash (see read_previous_table), the rows of the unchanged transcripts are taken from it and only the new or changed transcripts are computed."""
         self.bioSeqRecs = bioSeqRecs
-        # Temporary files of the UTRs
-        self.tf5p = tempfile.NamedTemporaryFile(mode="a", delete=False)
-        self.tf3p = tempfile.NamedTemporaryFile(mode="a", delete=False)
-        self.tfCoding = tempfile.NamedTemporaryFile(mode="a", delete=False)
-        self.utr3len = options.utr3len
+        self.options = options
+        # The (id, sequence) tuples of the UTRs and the coding sequences, given to the external programs and scorers in memory. They are set (with what cleanup and __del__ need) before anything can fail.
+        self.cleaned = False
         self.utrFiles = options.utrFiles
+        self.utr5p = []
+        self.utr3p = []
+        self.coding = []
+        # The transcripts as a buffer and typed columns.
+        self.store = bioSeqRecs if isinstance(bioSeqRecs, TranscriptStore) else TranscriptStore.from_records(bioSeqRecs)
+        # The stages of the requested features (see plan_features) and the inputs they need, the UTR files need the UTRs.
+        self.stages, _ = plan_features(options)
+        self.inputs = set(itertools.chain.from_iterable(stage_inputs(stage, options) for stage in self.stages))
+        if options.utrFiles:
+            self.inputs.update(("5pUTR", "3pUTR"))
+        self.columns = features_columns(options, previous)
+        # The results shared by the stages, computed once (see shared).
+        self.sharedResults = {}
+        self.sharedLock = threading.Lock()
+        self.recordHash = None
+        self.reused = None
+        self.order = self.store.ids
+        if 'record_hash' in self.columns:
+            self.recordHash = pd.Series(self.store.record_hashes(features_params(options)), index=self.store.ids)
+        if previous is not None:
+            unchanged = previous['record_hash'].reindex(self.store.ids).values == self.recordHash.values
+            missing = [col for col in self.columns if col not in previous.columns]
+            if missing:
+                # The previous table was written with other features (e.g. --features, --motifs or --fold-window), none of its rows is complete.
+                print("The previous table has no {} column(s), all the transcripts are computed.".format(", ".join(missing)), file=sys.stderr)
+                unchanged[:] = False
+            self.reused = previous.loc[self.store.ids[unchanged]].reindex(columns=self.columns)
+            self.store = self.store.take(np.flatnonzero(~unchanged))
+            print("{} transcripts unchanged, {} to compute.".format(len(self.reused), len(self.store)), file=sys.stderr)
+        # The kept transcripts (their IDs, positions in the store and batch_features).
+        self.ids = []
+        self.keep = None
+        self.bf = None
+        self.utr3len = options.utr3len
         self.clip = options.clip
+        self.workers = getattr(options, "workers", 1)
+        # Persistent cache of the external computations (None if not asked for).
+        self.cache = cache
+        if cache is None and getattr(options, "cacheDir", None):
+            self.cache = ResultsCache(options.cacheDir, getattr(options, "cacheSize", 1024) * 2**20)
+
+    @classmethod
+    def from_transcripts(cls, transcripts, options, cache=None, previous=None):
+        """Initialise with the data frame of the selected transcripts (as returned by get_ENSEMBL_data) instead of SeqIO records.
+
+        The columns are taken as they are, without writing and parsing a FASTA file."""
+        return cls(TranscriptStore.from_transcripts(transcripts), options, cache, previous)
 
     def collect_features(self):
-        """Collect the features that do not need external computations.
+        """Select the transcripts (3'UTR shorter than utr3len), extract the inputs of the planned stages and compute the stages that cost nothing (see register_feature).
 
-        Return: Pandas data frame with the ENSEMBL features.
+        Return: Pandas data frame with the columns of these stages.
         """
-        # Initialise a pabdas data frame.
-        pdf = pd.DataFrame(columns=['ensembl_gene_id', 'gene_name', 'coding_len', 'GC', '5pUTR_len', '5pUTR_GC', '3pUTR_len', '3pUTR_GC', 'Kozak_Sequence', 'Kozak_Context'])
-        for rec in self.bioSeqRecs:
-            # Fetch UTRs, lenghts and GCs
-            res3 = get_3utr(rec, self.tf3p, self.utr3len)
-            # Conditon for 3pUTR length.
-            if res3:
-                transcrGc = GC(rec.seq)
-                utr3len, utr3gc = res3
-                utr5len, utr5gc = get_5utr(rec, self.tf5p)
-                # Get Kozaks
-                seqKozak, contKozak = get_kozak(rec)
-                # Length of coding region.
-                codeLen = int(rec.features["cDNA_end"]) - int(rec.features["cDNA_start"])
-                get_coding(rec, self.tfCoding)
-                # Add to pandas data frame.
-                pdfe = [rec.features["GeneID"], rec.name, codeLen, "{0:.2f}".format(transcrGc), utr5len, "{0:.2f}".format(utr5gc), utr3len, "{0:.2f}".format(utr3gc), seqKozak, contKozak]
-                pdf.loc[rec.id] = pdfe
-            else:
-                continue
-        self.tf5p.close()
-        self.tf3p.close()
-        self.tfCoding.close()
-        return pdf
+        # Compute the lengths, GCs and Kozak windows of the whole batch at once.
+        store = self.store
+        self.bf = bf = batch_features(store.buf, store.offsets, store.cdnaStart, store.cdnaEnd, windows=store.windows())
+        # Conditon for 3pUTR length.
+        self.keep = keep = np.flatnonzero(bf["3pUTR_len"] < self.utr3len)
+        self.ids = store.ids[keep].tolist()
+        for recID, i in zip(self.ids, keep):
+            # Collect the UTRs (N if empty) and the coding sequence, only the ones the stages need.
+            if "3pUTR" in self.inputs:
+                self.utr3p.append((recID, store.text(store.utr3(i)) or "N"))
+            if "5pUTR" in self.inputs:
+                self.utr5p.append((recID, store.text(store.utr5(i)) or "N"))
+            if "CDS" in self.inputs:
+                self.coding.append((recID, store.text(store.cds(i))))
+        return self.run_stages([stage for stage in self.stages if stage.cost == 0])
+
+    def segments(self, region):
+        """Return: The (ids, (buf, starts, ends)) of a region of the kept transcripts, the sequences as segments of the buffer for the kernels reading it (see sequence_segments)."""
+        return self.ids, self.store.segments(region, self.keep)
 
     def calculate_features(self):
         """Method to perfom feature calculation.
         Invokes external software to make calculations that separates it from the previous method.
 
+        The planned stages that cost something run at the same time, the costliest first, and with more than one worker the RNAfold batches of all of them share one pool of workers.
         Return: Pandas data frame with the calculated features."""
-        # Calculates 5pUTR folding etc.
-        fe5p = calculate_free_energy(self.tf5p.name, "5pUTR")
-        fe3p = calculate_free_energy(self.tf3p.name, "3pUTR")
-        # Calculate local score
-        scoring = {'A': -1, 'C': 1, 'G': -1, 'T': 1, "N": 0}  # Specify a local score in such a way that will endorse TOP mRNAs.
-        # Compute teh local score for TOP mRNAs.
-        ls5p = calculate_local_score(self.tf5p.name, scoring, self.clip)
-        # Calculate CAI
-        caiCod = calculate_CAI(self.tfCoding.name)
-        # TODO Calculate bind motifs
-        # motifs = predictBinding()
-        # Merge data frames and return.
-        return pd.concat([fe5p, fe3p, ls5p, caiCod], axis=1, sort=False)
+        stages = sorted((stage for stage in self.stages if stage.cost > 0), key=lambda stage: -stage.cost)
+        if any("RNAfold" in stage.tools for stage in stages):
+            # Run RNAfold --version once, before the stages race for it.
+            rnafold_version()
+        if self.workers <= 1:
+            # One multi-threaded RNAfold per stage (see fold_sequences).
+            return self.run_stages(stages)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return self.run_stages(stages, pool)
+
+    def shared(self, key, compute):
+        """Return: The result of compute(), computed once per key by the first stage asking for it, the stages asking while it runs wait for it."""
+        with self.sharedLock:
+            future = self.sharedResults.get(key)
+            first = future is None
+            if first:
+                future = self.sharedResults[key] = Future()
+        if first:
+            try:
+                future.set_result(compute())
+            except BaseException as err:
+                future.set_exception(err)
+        return future.result()
+
+    def run_stages(self, stages, pool=None):
+        """Run feature stages, at the same time if there are more than one.
+
+        Return: Pandas data frame with the columns of the stages, indexed by the kept transcripts."""
+        if len(stages) > 1:
+            with ThreadPoolExecutor(max_workers=len(stages)) as jobs:
+                futures = [jobs.submit(stage.compute, self, pool) for stage in stages]
+                frames = [fut.result() for fut in futures]
+        else:
+            frames = [stage.compute(self, pool) for stage in stages]
+        if not frames:
+            return pd.DataFrame(index=self.ids)
+        return pd.concat(frames, axis=1, sort=False)
+
+    def extract(self):
+        """Collect and calculate all the features.
+
+        Return: Pandas data frame with the features' table columns (see features_columns)."""
+        if len(self.store):
+            with stats_stage("collect_features", len(self.store)):
+                de = self.collect_features()
+            with stats_stage("calculate_features", len(self.store)):
+                dc = self.calculate_features()
+            # Concatenate the results and re-arrange the columns.
+            dd = pd.concat([de, dc], axis=1, sort=False)
+        else:
+            # Nothing to compute (all the transcripts are unchanged).
+            dd = pd.DataFrame(columns=self.columns)
+        if self.recordHash is not None:
+            dd['record_hash'] = self.recordHash.reindex(dd.index).values
+        if self.reused is not None:
+            # Merge the unchanged rows, in the order of the input. An empty part would turn the integer columns into floats.
+            dd = pd.concat([frame for frame in (dd[self.columns], self.reused) if len(frame)] or [dd[self.columns]], axis=0)
+            dd = dd.loc[pd.Index(self.order).intersection(dd.index, sort=False)]
+        return dd[self.columns]
+
+    def cleanup(self, appendUtrs=False):
+        """Write the UTRs to the --utr-files (a tee of the sequences given to RNAfold) and release the sequences.
+
+        The UTR files are overwritten, or appended to if appendUtrs is set."""
+        if self.cleaned:
+            return
+        self.cleaned = True
+        if self.utrFiles:
+            for utrs, suffix, utrFile in zip((self.utr5p, self.utr3p), ("_5PUTR", "_3PUTR"), self.utrFiles):
+                with open(utrFile, "a" if appendUtrs else "w") as uf:
+                    uf.writelines(">{}{}\n{}\n".format(idt, suffix, seq) for idt, seq in utrs)
+        self.utr5p = self.utr3p = self.coding = []
 
     def __del__(self):
-        """Cleanup the temp files"""
-        if self.utrFiles:
-            shutil.move(self.tf5p.name, self.utrFiles[0])
-            shutil.move(self.tf3p.name, self.utrFiles[1])
+        """Write the UTR files if it is not done yet."""
+        self.cleanup()
+
+
+class ResultsCache(object):
+    """Persistent content addressed cache of per sequence results, stored in an SQLite file.
+
+    Each result is keyed by the hash of the sequence together with the tool, its version and its parameters.
+    The least recently used entries are evicted when the cache grows larger than <maxSize> bytes."""
+
+    def __init__(self, cacheDir, maxSize=2**30):
+        """Open (or create) the cache database in the cacheDir directory."""
+        os.makedirs(cacheDir, exist_ok=True)
+        self.path = os.path.join(cacheDir, "rnaFeaturesCache.sqlite")
+        self.maxSize = maxSize
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # Write-ahead log without a sync per commit: the lookups of a small job cost microseconds instead of a disk sync, a crash can only lose the last results.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, size INTEGER, atime REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_atime ON results (atime)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def make_key(tool, params, seq):
+        """Return the hash key of a sequence for a tool and its parameters (including the tool version)."""
+        h = hashlib.sha256()
+        h.update("{}\0{}\0".format(tool, json.dumps(params, sort_keys=True)).encode())
+        h.update(seq if isinstance(seq, bytes) else str(seq).encode())
+        return h.hexdigest()
+
+    def get_many(self, tool, params, seqs):
+        """Look up the results of a tool for a list of sequences.
+
+        Return: A list of results in the input order, None for the cache misses."""
+        keys = [self.make_key(tool, params, seq) for seq in seqs]
+        found = {}
+        with self.lock:
+            for chunk in chunks(keys, 500):
+                qmarks = ",".join("?" * len(chunk))
+                found.update(self.db.execute("SELECT key, value FROM results WHERE key IN ({})".format(qmarks), chunk).fetchall())
+                self.db.execute("UPDATE results SET atime = ? WHERE key IN ({})".format(qmarks), [time.time()] + chunk)
+            self.db.commit()
+        values = [json.loads(found[key]) if key in found else None for key in keys]
+        nHits = len(found)
+        self.hits[tool] = self.hits.get(tool, 0) + nHits
+        self.misses[tool] = self.misses.get(tool, 0) + len(keys) - nHits
+        return values
+
+    def put_many(self, tool, params, seqs, values):
+        """Store the results of a tool for a list of sequences and evict the oldest entries if needed."""
+        now = time.time()
+        rows = []
+        for seq, value in zip(seqs, values):
+            key = self.make_key(tool, params, seq)
+            value = json.dumps(value)
+            rows.append((key, value, len(key) + len(value), now))
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in its maximum size (the caller holds the lock).
+
+        The size is read from the database, in the write transaction of the caller: the processes sharing the cache directory (-P) all add to it."""
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if self.size <= self.maxSize:
+            return
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY atime"):
+            stale.append((key,))
+            self.size -= size
+            if self.size <= self.maxSize:
+                break
+        self.db.executemany("DELETE FROM results WHERE key = ?", stale)
+
+    def report(self):
+        """Print the hit/miss counters of each tool to STDERR."""
+        for tool in sorted(set(self.hits) | set(self.misses)):
+            print("Cache {}: {} hits, {} misses.".format(tool, self.hits.get(tool, 0), self.misses.get(tool, 0)), file=sys.stderr)
+
+
+class BiomartFetcher(object):
+    """Concurrent fetcher of BioMart queries over one pooled HTTP session.
+
+    The gene IDs are split in chunks and the queries of the chunks run on a pool of <concurrency> threads that reuse the session connections.
+    A failed query is retried with exponential backoff. A chunk that keeps failing is split in two (BioMart tends to time out on large queries), and the size of the next chunks is halved too, down to minChunk IDs; it grows back on successes."""
+
+    def __init__(self, dataset, url=BIOMART_URL, concurrency=4, chunkSize=100, minChunk=10, retries=3, backoff=1.0, timeout=300, virtualSchema="default"):
+        self.dataset = dataset
+        self.url = url
+        self.concurrency = concurrency
+        self.maxChunk = chunkSize
+        self.chunkSize = chunkSize
+        self.minChunk = min(minChunk, chunkSize)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.virtualSchema = virtualSchema
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __str__(self):
+        return "BioMart {} at {}".format(self.dataset, self.url)
+
+    def query(self, ids, attributes):
+        """Run one BioMart query of a list of attributes for a list of gene IDs.
+
+        Return: Pandas data frame of the TSV response (with the attributes display names as columns)."""
+        root = Element("Query", virtualSchemaName=self.virtualSchema, formatter="TSV", header="1", uniqueRows="1", datasetConfigVersion="0.6")
+        dataset = SubElement(root, "Dataset", name=self.dataset, interface="default")
+        SubElement(dataset, "Filter", name="ensembl_gene_id", value=",".join(ids))
+        for attribute in attributes:
+            SubElement(dataset, "Attribute", name=attribute)
+        with stats_stage("biomart_query", len(ids)):
+            resp = self.session.get(self.url, params={"query": tostring(root)}, timeout=self.timeout)
+            resp.raise_for_status()
+            stats_count("biomart_bytes", len(resp.content))
+            # BioMart reports the query errors in the body of a 200 response.
+            if resp.text.startswith("Query ERROR") or "<html" in resp.text[:200].lower():
+                raise RuntimeError("BioMart query failed: {}".format(resp.text[:200].strip()))
+            return pd.read_csv(io.StringIO(resp.text), sep='\t', encoding='utf-8')
+
+    def fetch_chunk(self, ids, attributes):
+        """Query a chunk of gene IDs with retries and backoff, splitting it in two if it keeps failing.
+
+        Return: Pandas data frame of the response."""
+        for attempt in range(self.retries):
+            try:
+                data = self.query(ids, attributes)
+                with self.lock:
+                    self.chunkSize = min(self.maxChunk, self.chunkSize + max(1, self.chunkSize // 4))
+                return data
+            except (requests.RequestException, RuntimeError) as err:
+                stats_count("biomart_failed_queries")
+                print("BioMart query of {} genes failed ({}), attempt {}/{}.".format(len(ids), str(err).split(" for url:")[0], attempt + 1, self.retries), file=sys.stderr)
+                time.sleep(self.backoff * 2 ** attempt)
+        if len(ids) <= self.minChunk:
+            raise RuntimeError("BioMart query of genes {}... failed after {} attempts.".format(ids[0], self.retries))
+        with self.lock:
+            self.chunkSize = max(self.minChunk, min(self.chunkSize, len(ids)) // 2)
+        half = len(ids) // 2
+        return pd.concat([self.fetch_chunk(ids[:half], attributes), self.fetch_chunk(ids[half:], attributes)], axis=0, sort=False)
+
+    def fetch(self, listID, attributeLists):
+        """Fetch several lists of attributes for a list of gene IDs, the queries of all the chunks and attribute lists run concurrently.
+
+        Return: A list of Pandas data frames, one per attribute list, in the order of the gene IDs."""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = set()
+            futures = {}
+            start = 0
+            nChunk = 0
+            while start < len(listID) or pending:
+                # Carve the next chunks lazily, with the current chunk size.
+                while start < len(listID) and len(pending) < 2 * self.concurrency:
+                    chunk = listID[start:start + self.chunkSize]
+                    start += len(chunk)
+                    for k, attributes in enumerate(attributeLists):
+                        fut = pool.submit(self.fetch_chunk, chunk, attributes)
+                        futures[fut] = (k, nChunk)
+                        pending.add(fut)
+                    nChunk += 1
+                done = next(as_completed(pending))
+                pending.remove(done)
+                results[futures.pop(done)] = done.result()
+                print('Fetching... {}/{} genes'.format(start, len(listID)), file=sys.stderr)
+        frames = []
+        for k in range(len(attributeLists)):
+            chunkFrames = [results[(k, n)] for n in range(nChunk)]
+            frames.append(pd.concat(chunkFrames, axis=0, sort=False) if chunkFrames else pd.DataFrame())
+        return frames
+
+
+class EnsemblStore(object):
+    """Local store of the ENSEMBL transcripts data, an SQLite file indexed by gene ID.
+
+    It holds the BioMart features and transcript classification tables of a dataset (with the BIOMART_COLUMNS display names), as well as the set of the gene IDs already resolved, including the ones without transcripts.
+    It is filled from past BioMart responses (add) or built once from an ENSEMBL release dump (build_from_dump)."""
+
+    def __init__(self, path):
+        """Open (or create) the store file."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS genes (gene_id TEXT PRIMARY KEY)")
+        for table, attributes in (("features", FEATURE_ATTRIBUTES), ("transcripts", TRANSCRIPT_ATTRIBUTES)):
+            columns = ", ".join('"{}" TEXT'.format(BIOMART_COLUMNS[a]) for a in attributes)
+            self.db.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns))
+            self.db.execute('CREATE INDEX IF NOT EXISTS {0}_gene ON {0} ("Gene stable ID")'.format(table))
+        self.db.commit()
+
+    def check_dataset(self, dataset):
+        """Record the ENSEMBL dataset of an empty store, or check that it is the one of the store."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'dataset'").fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO meta VALUES ('dataset', ?)", (dataset,))
+        elif row[0] != dataset:
+            raise ValueError("The store {} holds the dataset {}, not {}.".format(self.path, row[0], dataset))
+
+    def lookup(self, listID, dataset):
+        """Look up a list of gene IDs.
+
+        Return: The features and the transcripts data frames of the genes found and the list of the missing gene IDs."""
+        frames = {"features": [], "transcripts": []}
+        for table in frames:
+            frames[table].append(pd.read_sql_query("SELECT * FROM {} LIMIT 0".format(table), self.db))
+        known = set()
+        with self.lock:
+            self.check_dataset(dataset)
+            for chunk in chunks(list(listID), 500):
+                qmarks = ",".join("?" * len(chunk))
+                known.update(g for g, in self.db.execute("SELECT gene_id FROM genes WHERE gene_id IN ({})".format(qmarks), chunk))
+                for table in frames:
+                    frames[table].append(pd.read_sql_query('SELECT * FROM {} WHERE "Gene stable ID" IN ({})'.format(table, qmarks), self.db, params=chunk))
+        # Give the columns the same types as a BioMart TSV response, without the rows stored twice (as BioMart uniqueRows).
+        dfs = [pd.concat(frames[table], ignore_index=True).drop_duplicates(ignore_index=True).apply(to_numeric_column) for table in ("features", "transcripts")]
+        missing = [g for g in listID if g not in known]
+        return dfs[0], dfs[1], missing
+
+    def add(self, listID, dfFeat, dfTrans, keep=()):
+        """Add the BioMart features and transcripts data frames of a list of gene IDs.
+
+        The rows the store already has for these genes are replaced, so that adding genes again does not duplicate them, but for the genes of <keep> whose rows are completed (see build_from_dump)."""
+        keep = set(keep)
+        replaced = [g for g in listID if g not in keep]
+        with self.lock:
+            for chunk in chunks(replaced, 500):
+                for table in ("features", "transcripts"):
+                    self.db.execute('DELETE FROM {} WHERE "Gene stable ID" IN ({})'.format(table, ",".join("?" * len(chunk))), chunk)
+            for table, df, attributes in (("features", dfFeat, FEATURE_ATTRIBUTES), ("transcripts", dfTrans, TRANSCRIPT_ATTRIBUTES)):
+                columns = [BIOMART_COLUMNS[a] for a in attributes]
+                rows = df[columns].astype(object).where(df[columns].notnull(), None).values.tolist()
+                rows = [[None if v is None else str(v) for v in row] for row in rows]
+                self.db.executemany("INSERT INTO {} VALUES ({})".format(table, ",".join("?" * len(columns))), rows)
+            self.db.executemany("INSERT OR IGNORE INTO genes VALUES (?)", [(g,) for g in listID])
+            self.db.commit()
+
+    @classmethod
+    def build_from_dump(cls, path, dataset, cdnaFasta, attribTsv, chunkSize=50000):
+        """Build a store from an ENSEMBL release dump.
+
+        cdnaFasta: The cDNA FASTA of the release (Homo_sapiens.GRCh38.cdna.all.fa and the like), the sequences are matched by transcript ID (without version).
+        attribTsv: A BioMart TSV export of the transcripts of the dataset, with a header of display names, that has all the columns of FEATURE_ATTRIBUTES and TRANSCRIPT_ATTRIBUTES apart from the cDNA sequences.
+        Return: The EnsemblStore."""
+        store = cls(path)
+        store.check_dataset(dataset)
+        seqCol = BIOMART_COLUMNS['cdna']
+        # Stage the sequences in the store file, then add the annotation by chunks.
+        store.db.execute("CREATE TEMP TABLE cdna (transcript_id TEXT PRIMARY KEY, seq TEXT)")
+        store.db.executemany("INSERT OR REPLACE INTO cdna VALUES (?, ?)", ((rec.id.split(".")[0], str(rec.seq)) for rec in SeqIO.parse(cdnaFasta, "fasta")))
+        genes = set()
+        for df in pd.read_csv(attribTsv, sep="\t", chunksize=chunkSize):
+            for col in ('Gene stable ID', 'Transcript stable ID'):
+                df[col] = df[col].astype(str).str.split(".").str[0]
+            ids = df['Transcript stable ID'].tolist()
+            seqs = {}
+            for chunk in chunks(ids, 500):
+                seqs.update(store.db.execute("SELECT transcript_id, seq FROM cdna WHERE transcript_id IN ({})".format(",".join("?" * len(chunk))), chunk))
+            df[seqCol] = [seqs.get(t) for t in ids]
+            chunkGenes = df['Gene stable ID'].unique().tolist()
+            # The genes of a previous store are replaced, the ones split over two chunks are completed.
+            store.add(chunkGenes, df.drop_duplicates(subset=[BIOMART_COLUMNS[a] for a in FEATURE_ATTRIBUTES]), df.drop_duplicates(subset=[BIOMART_COLUMNS[a] for a in TRANSCRIPT_ATTRIBUTES]), keep=genes)
+            genes.update(chunkGenes)
+        store.db.execute("DROP TABLE cdna")
+        store.db.commit()
+        print("Store {} built with {} genes.".format(path, len(genes)), file=sys.stderr)
+        return store
+
+
+class FeaturesWriter(object):
+    """Write the features' table chunk by chunk, as a semicolon separated CSV or as a typed columnar table (Parquet or Arrow IPC file).
+
+    The metadata (e.g. the command line and the date) are written as a '#' comment trailer in CSV and as the file metadata otherwise.
+    """
+    FORMATS = ("csv", "parquet", "arrow")
+
+    def __init__(self, outfile, fmt="csv", metadata=None, columns=FEATURES_COLUMNS):
+        if fmt not in self.FORMATS:
+            raise ValueError("Unknown output format {}, it must be one of {}.".format(fmt, ", ".join(self.FORMATS)))
+        if fmt != "csv" and not have_pyarrow():
+            raise ImportError("The {} output format needs pyarrow (pip install pyarrow).".format(fmt))
+        self.outfile = outfile
+        self.fmt = fmt
+        self.metadata = metadata or {}
+        self.columns = columns
+        self.nChunks = 0
+        self.writer = None
+        if fmt != "csv":
+            self.schema = features_schema(self.metadata, columns)
+            # Binary formats go to the underlying byte stream of a text file (e.g. STDOUT).
+            sink = getattr(outfile, "buffer", outfile)
+            if fmt == "parquet":
+                self.writer = pq.ParquetWriter(sink, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(sink, self.schema)
+
+    def write(self, dd):
+        """Append a chunk of the features' table (a data frame with the columns indexed by transcript)."""
+        if self.fmt == "csv":
+            dd = dd.copy()
+            for col in GC_COLUMNS:
+                if col in dd:
+                    dd[col] = ["{0:.2f}".format(gc) for gc in dd[col]]
+            dd.to_csv(self.outfile, sep=";", header=(self.nChunks == 0))
+        else:
+            dd = dd.rename_axis('ensembl_transcript_id')
+            self.writer.write_table(pa.Table.from_pandas(dd, schema=self.schema, preserve_index=True))
+        self.outfile.flush()
+        self.nChunks += 1
+
+    def close(self):
+        """Finish the file, with only the header (or the schema) if no chunk was written."""
+        if self.fmt == "csv":
+            if self.nChunks == 0:
+                pd.DataFrame(columns=self.columns).to_csv(self.outfile, sep=";")
+            for value in self.metadata.values():
+                self.outfile.write("# {}\n".format(value))
+        else:
+            self.writer.close()
+        self.outfile.flush()
+
+
+class MotifScanner(object):
+    """In-process scanner of position weight matrices (PWMs) over many sequences, as FIMO of the MEME suite does.
+
+    The log-odds scores of each motif are scaled to integers (MOTIF_SCORE_RANGE for the whole score range of the motif) and the p-value threshold is turned into a score threshold once, from the exact distribution of the scores over the background (see motif_score_pvalues).
+    The sequences are encoded as base-5 k-mer codes (the 5th letter is anything but A, C, G, T/U) once per block of sequences, and every motif is scored at every position with one lookup per k columns of the motif in precomputed tables of its k-mer scores.
+    Windows with other letters than A, C, G, T/U never score a hit. Only the given strand is scanned (the transcripts are mRNAs)."""
+
+    def __init__(self, motifs, pvalue=1e-4, pseudocount=0.1, k=MOTIF_KMER):
+        """Precompute the lookup tables and the score thresholds of a list of Motif (see read_meme_motifs)."""
+        self.names = [m.name for m in motifs]
+        self.pvalue = pvalue
+        self.k = k
+        self.tables = []
+        self.thresholds = []
+        self.scales = []
+        self.offsets = []
+        # The digits of every k-mer code, the first letter is the most significant digit.
+        digits = (np.arange(5**k)[:, None] // 5**np.arange(k - 1, -1, -1)) % 5
+        for motif in motifs:
+            logOdds = motif_log_odds(motif, pseudocount)
+            colMin = logOdds.min(axis=1)
+            span = (logOdds.max(axis=1) - colMin).sum()
+            scale = MOTIF_SCORE_RANGE / span if span > 0 else 1.0
+            # The integer scores are shifted so that every column scores from 0, a window scores from 0 to the span.
+            intScores = np.rint((logOdds - colMin[:, None]) * scale).astype(np.int64)
+            pvals = motif_score_pvalues(intScores, motif.background)
+            below = np.flatnonzero(pvals < pvalue)
+            self.thresholds.append(int(below[0]) if len(below) else len(pvals))
+            self.scales.append(scale)
+            self.offsets.append(colMin.sum())
+            # Any k-mer with another letter scores low enough that no window with it reaches 0.
+            invalid = -(int(intScores.max(axis=1).sum()) + 1)
+            nChunks = -(-len(intScores) // k)
+            dtype = np.int16 if -invalid * nChunks < 2**15 else np.int32
+            tables = []
+            for j in range(nChunks):
+                cols = intScores[j * k:(j + 1) * k]
+                chunkDigits = digits[:, :len(cols)]
+                table = np.zeros(5**k, dtype=np.int64)
+                for i, col in enumerate(cols):
+                    table += np.append(col, 0)[chunkDigits[:, i]]
+                table[(chunkDigits == 4).any(axis=1)] = invalid
+                tables.append(table.astype(dtype))
+            self.tables.append(tables)
+
+    def scan(self, seqs, blockSize=2**20):
+        """Scan all the motifs over a list of sequences, by blocks of about blockSize nucleotides.
+
+        Return: The number of hits (p-value below the threshold) and the best log-odds score (in bits, NaN if the sequence has no valid window) of each sequence (rows) and motif (columns), as two NumPy arrays."""
+        hits = np.zeros((len(seqs), len(self.names)), dtype=np.int64)
+        best = np.full((len(seqs), len(self.names)), np.nan)
+        k = self.k
+        maxSpan = max((len(tables) * k for tables in self.tables), default=k)
+        powers = 5 ** np.arange(k - 1, -1, -1)
+        first = 0
+        while first < len(seqs):
+            # The block of sequences, joined by an N so that no window crosses two sequences.
+            last = first + 1
+            size = len(seqs[first]) + 1
+            while last < len(seqs) and size + len(seqs[last]) + 1 <= blockSize:
+                size += len(seqs[last]) + 1
+                last += 1
+            block = seqs[first:last]
+            lens = np.array([len(seq) + 1 for seq in block], dtype=np.int64)
+            segStarts = np.zeros(len(block), dtype=np.int64)
+            np.cumsum(lens[:-1], out=segStarts[1:])
+            n = int(lens.sum())
+            text = "N".join(block) + "N" * (maxSpan + k)
+            codes = NUC_CODES[np.frombuffer(text.encode("ascii"), dtype=np.uint8)]
+            kmers = np.zeros(len(codes) - k + 1, dtype=np.intp)
+            for i, power in enumerate(powers):
+                kmers += codes[i:len(codes) - k + 1 + i] * power
+            for m, tables in enumerate(self.tables):
+                scores = tables[0].take(kmers[:n])
+                for j in range(1, len(tables)):
+                    scores += tables[j].take(kmers[j * k:j * k + n])
+                hitPos = np.flatnonzero(scores >= self.thresholds[m])
+                hits[first:last, m] = np.bincount(np.searchsorted(segStarts, hitPos, side="right") - 1, minlength=len(block))
+                top = np.maximum.reduceat(scores, segStarts)
+                best[first:last, m] = np.where(top >= 0, np.round(top / self.scales[m] + self.offsets[m], 3), np.nan)
+            first = last
+        return hits, best
+
+
+class RunStats(object):
+    """Timers and counters of the stages of a run (see enable_stats), reported as JSON by --stats.
+
+    Each stage accumulates its number of calls, its wall time and the number of records it processed. Stages can nest (the time of an inner stage is also counted in the outer one) and run in several threads at once (their times then overlap)."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, name, seconds, records=0, calls=1):
+        """Add the time and the records of calls of a stage."""
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0])
+            stage[0] += calls
+            stage[1] += seconds
+            stage[2] += records
+
+    @contextlib.contextmanager
+    def stage(self, name, records=0):
+        """Context manager timing one call of a stage that processes <records> records."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, records)
+
+    def count(self, name, value=1):
+        """Add value to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, report):
+        """Add the stages and counters of the report of another run (e.g. of another process)."""
+        for name, stage in report["stages"].items():
+            self.add_time(name, stage["seconds"], stage["records"], stage["calls"])
+        for name, value in report["counters"].items():
+            self.count(name, value)
+
+    def report(self, metadata=None):
+        """Return: A dictionary with the metadata, the wall time and peak RSS (in MB) of the run, the stages (calls, seconds, records and records per second) and the counters."""
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report = dict(metadata or {})
+        report["wall_seconds"] = round(time.perf_counter() - self.start, 4)
+        # Linux reports kB, macOS bytes.
+        report["peak_rss_mb"] = round(rss / 2**20 if sys.platform == "darwin" else rss / 2**10, 1)
+        with self.lock:
+            report["stages"] = {name: {"calls": calls, "seconds": round(seconds, 4), "records": records, "records_per_second": round(records / seconds, 1) if seconds and records else None}
+                                for name, (calls, seconds, records) in self.stages.items()}
+            report["counters"] = dict(self.counters)
+        return report
+
+    def write(self, path, metadata=None):
+        """Write the report to a JSON file."""
+        with open(path, "w") as fh:
+            json.dump(self.report(metadata), fh, indent=2)
+            fh.write("\n")
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket (the requests are handled one at a time, as by http.server.HTTPServer)."""
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # The clients of a Unix socket have no address, the handlers expect one.
+        return request, ("local", 0)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP client connection to a Unix socket."""
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socketPath = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+def remove_stale_socket(path):
+    """Remove the Unix socket at path if no server listens on it any more (the socket of a server that was killed), to listen on it again.
+
+    Raise: FileExistsError if the path is not a socket or a server answers on it."""
+    if not os.path.lexists(path):
+        return
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise FileExistsError("{} exists and is not a socket.".format(path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)
+        return
+    finally:
+        sock.close()
+    raise FileExistsError("A server is already listening on {}.".format(path))
+
+
+class FeaturesService(object):
+    """A long-running features server, that keeps its state warm between the jobs: the imported modules, the codon table, the motif scanner, the results cache, the local ENSEMBL store and the BioMart sessions.
+
+    It answers HTTP requests, on a TCP port or a Unix socket (see parse_address):
+    POST /fasta with a FASTA file of geneIDs2fasta.py as body, or POST /genes?dataset=<dataset> with a list of gene IDs (one per line) as body, returns the features' table as CSV (as fasta2table.py and geneIDs2table.py with the options of the server).
+    GET /status returns the version, the uptime and the number of jobs done as JSON.
+    The requests are handled one at a time, each one can still fold over options.workers RNAfold processes."""
+
+    def __init__(self, options, dataset="hsapiens_gene_ensembl", martUrl=BIOMART_URL, concurrency=4, chunkSize=100, store=None, batchSize=1000):
+        self.options = options
+        self.options.outputFormat = "csv"
+        self.dataset = dataset
+        self.martUrl = martUrl
+        self.concurrency = concurrency
+        self.chunkSize = chunkSize
+        self.store = EnsemblStore(store) if store else None
+        self.batchSize = batchSize
+        self.cache = ResultsCache(options.cacheDir, getattr(options, "cacheSize", 1024) * 2**20) if getattr(options, "cacheDir", None) else None
+        self.fetchers = {}
+        self.start = time.time()
+        self.jobs = 0
+        # Do the imports and load the tables once, before the first job.
+        for module in (pd, requests, FastaIO, SeqUtils):
+            module.load()
+        load_codon_index(codon_table(options, dataset))
+        if getattr(options, "motifs", None):
+            load_motif_scanner(options.motifs, getattr(options, "motifPvalue", 1e-4))
+
+    def fetcher(self, dataset):
+        """Return: The BiomartFetcher of a dataset (its HTTP session is kept open between the jobs)."""
+        if dataset not in self.fetchers:
+            self.fetchers[dataset] = BiomartFetcher(dataset, self.martUrl, self.concurrency, self.chunkSize)
+        return self.fetchers[dataset]
+
+    def fasta_table(self, fasta, metadata=None):
+        """Return: The features' table (CSV) of the transcripts of a FASTA text."""
+        out = io.StringIO()
+        stores = TranscriptStore.iter_fasta(io.StringIO(fasta), getattr(self.options, "chunkSize", None))
+        stream_features(stores, self.options, out, metadata=metadata, cache=self.cache)
+        return out.getvalue()
+
+    def genes_table(self, listID, dataset=None, metadata=None):
+        """Return: The features' table (CSV) of the selected transcripts of a list of gene IDs."""
+        dataset = dataset or self.dataset
+        # Without a codon table of the server, the CAI of the genes is the one of their dataset.
+        options = self.options if getattr(self.options, "codonTable", None) else SimpleNamespace(**dict(vars(self.options), codonTable=dataset))
+        out = io.StringIO()
+        pipeline_features(listID, dataset, options, out, None, self.martUrl, self.concurrency, self.chunkSize, self.store, self.batchSize,
+                          metadata=metadata, cache=self.cache, fetcher=self.fetcher(dataset))
+        return out.getvalue()
+
+    def status(self):
+        """Return: The status of the server."""
+        return {"version": __version__, "uptime_seconds": round(time.time() - self.start, 1), "jobs": self.jobs, "datasets": sorted(self.fetchers)}
+
+    def handle(self, method, path, body):
+        """Answer a request.
+
+        Return: The HTTP status, the content type and the body of the response."""
+        url = urllib.parse.urlsplit(path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        metadata = {"argv": query["argv"], "date": time.strftime("%d/%m/%Y at %H:%M:%S")} if "argv" in query else None
+        if method == "GET" and url.path == "/status":
+            return 200, "application/json", json.dumps(self.status())
+        if method == "POST" and url.path in ("/fasta", "/genes"):
+            try:
+                text = body.decode("utf-8")
+            except UnicodeDecodeError as err:
+                return 400, "text/plain", "The body of {} must be UTF-8 text: {}\n".format(url.path, err)
+        if method == "POST" and url.path == "/fasta":
+            table = self.fasta_table(text, metadata)
+        elif method == "POST" and url.path == "/genes":
+            table = self.genes_table(text.split(), query.get("dataset"), metadata)
+        else:
+            return 404, "text/plain", "Unknown request {} {}, see FeaturesService.\n".format(method, url.path)
+        self.jobs += 1
+        return 200, "text/csv", table
+
+    def serve(self, address):
+        """Serve the requests at the address (see parse_address) until interrupted."""
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def answer(self, method):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    status, contentType, text = service.handle(method, self.path, body)
+                except Exception as err:
+                    print("{} {} failed: {!r}".format(method, self.path, err), file=sys.stderr)
+                    status, contentType, text = 500, "text/plain", "{}: {}\n".format(type(err).__name__, err)
+                data = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.answer("GET")
+
+            def do_POST(self):
+                self.answer("POST")
+
+            def log_message(self, fmt, *args):
+                print("{} {}".format(time.strftime("%H:%M:%S"), fmt % args), file=sys.stderr)
+
+        kind, where = parse_address(address)
+        if kind == "unix":
+            remove_stale_socket(where)
+            server = UnixHTTPServer(where, Handler)
         else:
-            os.remove(self.tf5p.name)
-            os.remove(self.tf3p.name)
+            server = http.server.HTTPServer(where, Handler)
+        print("Serving features on {}.".format(address), file=sys.stderr)
+        # Stop cleanly (removing the socket) when terminated too.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if kind == "unix" and os.path.exists(where):
+                os.remove(where)
 
 
+# The statistics of the run, None when they are not collected (the default). The stages check it once per call, which costs next to nothing when it is None.
+STATS = None
+NO_STAGE = contextlib.nullcontext()
+
 
 # FUNCTIONS
-def get_ENSEMBL_data(listID, dataset, transcr_expr_file=None):
+def enable_stats():
+    """Start collecting the statistics of the run in a new RunStats (the module STATS).
+
+    Return: The RunStats."""
+    global STATS
+    STATS = RunStats()
+    return STATS
+
+
+def stats_stage(name, records=0):
+    """Return: A context manager timing a call of a stage in STATS (see RunStats.stage), or doing nothing if the statistics are not collected."""
+    if STATS is None:
+        return NO_STAGE
+    return STATS.stage(name, records)
+
+
+def stats_count(name, value=1):
+    """Add value to a counter of STATS, if the statistics are collected."""
+    if STATS is not None:
+        STATS.count(name, value)
+
+
+@contextlib.contextmanager
+def profiling(path, top=25):
+    """Context manager profiling the code it runs with cProfile and tracing its memory allocations with tracemalloc, it does nothing if path is None.
+
+    The cProfile statistics are written to path (to be read with pstats or snakeviz), the functions with the largest cumulative times, the peak of the traced memory and the lines holding the most memory at the end are printed to STDERR.
+    Only the calling thread is profiled, the work done in the thread pools (RNAfold, BioMart) shows as waits; their times are in the --stats report."""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
+        print("Peak of the traced memory: {:.1f} MB. Largest allocations left:".format(peak / 2**20), file=sys.stderr)
+        for statistic in snapshot.statistics("lineno")[:10]:
+            print(statistic, file=sys.stderr)
+
+
+def stream_features(ensSeqs, options, outfile, chunkSize=None, metadata=None, cache=None):
+    """Extract the features of an ENSEMBLSeqs (not expanded) chunk by chunk and append each chunk to the outfile as soon as it is done.
+
+    ensSeqs can also be an iterable of TranscriptStore chunks (e.g. TranscriptStore.iter_fasta), then chunkSize is not used.
+    Only one chunk of records is held in memory at a time. With chunkSize=None the whole input is one chunk.
+    The format of the table is options.outputFormat (CSV by default), see FeaturesWriter for the metadata.
+    With options.previousTable only the new or changed transcripts are computed, the others are taken from the previous table (see FeaturesExtract).
+    With options.shard = (index, count) only the transcripts of that shard are computed (see TranscriptStore.shard and merge_features_tables).
+    cache: An already open ResultsCache (e.g. of a FeaturesService), otherwise one is opened if options.cacheDir is set.
+    Return: The number of rows written."""
+    if cache is None and getattr(options, "cacheDir", None):
+        cache = ResultsCache(options.cacheDir, getattr(options, "cacheSize", 1024) * 2**20)
+    previous = read_previous_table(options.previousTable) if getattr(options, "previousTable", None) else None
+    chunks = ensSeqs.iter_chunks(chunkSize) if isinstance(ensSeqs, ENSEMBLSeqs) else ensSeqs
+    if getattr(options, "shard", None):
+        # Only the transcripts of the shard are computed.
+        chunks = (chunk if isinstance(chunk, TranscriptStore) else TranscriptStore.from_records(chunk) for chunk in chunks)
+        chunks = (chunk.shard(*options.shard) for chunk in chunks)
+    extractors = (FeaturesExtract(chunk, options, cache, previous) for chunk in chunks)
+    nRows = write_features(extractors, outfile, getattr(options, "outputFormat", "csv"), metadata, features_columns(options, previous))
+    if cache:
+        cache.report()
+    return nRows
+
+
+def parse_shard(spec):
+    """Parse a shard specification "i/N" (the i-th shard out of N, from 1 to N).
+
+    Return: The (i, N) tuple."""
+    index, count = (int(x) for x in spec.split("/"))
+    if not 1 <= index <= count:
+        raise ValueError("The shard must be i/N with 1 <= i <= N, not {}.".format(spec))
+    return index, count
+
+
+def sort_features(dd):
+    """Sort a features' table by gene and coding length (and transcript ID for ties), the ones of these columns it has.
+
+    Return: The sorted table."""
+    by = [col for col in ('ensembl_gene_id', 'coding_len') if col in dd.columns] + ['ensembl_transcript_id']
+    dd = dd.rename_axis('ensembl_transcript_id').sort_values(by=by, kind="mergesort")
+    return dd.rename_axis(None)
+
+
+def order_features(dd, order):
+    """Put the rows of a features' table in the order of the transcript IDs of order (the order of the input FASTA), the order of the table of a run without shards.
+
+    The transcripts not in order follow, sorted with sort_features.
+    Return: The ordered table."""
+    # The first position of each transcript, the ones not in order are NaN.
+    rank = pd.Series(np.arange(len(order)), index=order)
+    rank = rank[~rank.index.duplicated()].reindex(dd.index)
+    known = rank.notnull().values
+    return pd.concat([dd[known].iloc[np.argsort(rank.values[known], kind="stable")], sort_features(dd[~known])])
+
+
+def merge_features_tables(paths, outfile, fmt="csv", metadata=None, order=None):
+    """Merge the features' tables of the shards of a run (see stream_features) into the final table.
+
+    The tables can be in any output format. A transcript found in more than one table is kept once.
+    order: The transcript IDs of the input of the run (see fasta_ids), the rows are put in their order as in the table of a run without shards (see order_features). Without it the rows are sorted with sort_features.
+    Return: The number of rows written."""
+    with stats_stage("read_shard_tables", len(paths)):
+        tables = [read_features_table(path) for path in paths]
+    dd = pd.concat(tables, axis=0, sort=False)
+    nDup = int(dd.index.duplicated().sum())
+    if nDup:
+        print("{} transcripts found in more than one table are kept once.".format(nDup), file=sys.stderr)
+        dd = dd[~dd.index.duplicated()]
+    # The optional columns (windowed folding, motifs and record_hash) are kept only if all the tables have them, in the order of the first table.
+    columns = [col for col in tables[0].columns if col != 'record_hash'] + ['record_hash']
+    columns = [col for col in columns if all(col in table.columns for table in tables)]
+    writer = FeaturesWriter(outfile, fmt, metadata, columns)
+    with stats_stage("write_table", len(dd)):
+        writer.write(sort_features(dd[columns]) if order is None else order_features(dd[columns], order))
+    writer.close()
+    print("{} tables merged, {} transcripts.".format(len(tables), len(dd)), file=sys.stderr)
+    return len(dd)
+
+
+def run_shard(path, options, shard, shardPath, chunkSize=None, stats=False):
+    """Compute the features of one shard of a FASTA file into the file shardPath (the body of a stream_features_sharded process).
+
+    stats: Collect the statistics of the shard (see enable_stats).
+    Return: The number of rows written and the report of the statistics (or None)."""
+    global STATS
+    STATS = RunStats() if stats else None
+    options = SimpleNamespace(**vars(options))
+    options.shard = shard
+    if getattr(options, "index", False):
+        # Only the records of the shard are parsed, in this process.
+        options.readProcesses = 1
+        with open(shardPath, "w") as out:
+            nRows = stream_features(indexed_stores(path, options, chunkSize), options, out)
+    else:
+        with open(path) as fh, open(shardPath, "w") as out:
+            nRows = stream_features(TranscriptStore.iter_fasta(fh, chunkSize), options, out)
+    return nRows, STATS.report() if stats else None
+
+
+def indexed_stores(path, options, chunkSize=None):
+    """Read a FASTA file through its record index (see FastaIndex) and yield TranscriptStores of at most chunkSize transcripts.
+
+    Only the transcripts of the IDs of the file options.ids (one per line) and of options.shard are read, by options.readProcesses worker processes.
+    Return: The generator of the stores."""
+    index = FastaIndex(path)
+    positions = None
+    if getattr(options, "ids", None):
+        with open(options.ids) as fh:
+            positions = index.positions(fh.read().split())
+    if getattr(options, "shard", None):
+        shardPositions = index.shard_positions(*options.shard)
+        positions = shardPositions if positions is None else np.intersect1d(positions, shardPositions)
+    return index.iter_stores(chunkSize, positions, getattr(options, "readProcesses", 1))
+
+
+def fasta_ids(path):
+    """Return: The list of the transcript IDs of the records of a FASTA file, in the order of the file (as parse_fasta_header)."""
+    with open(path) as fh:
+        return [parse_fasta_header(line[1:].rstrip("\n"))["id"] for line in fh if line.startswith(">")]
+
+
+def stream_features_sharded(path, options, outfile, processes, chunkSize=None, metadata=None):
+    """Compute the features of a FASTA file over <processes> local processes, each one computing a shard of the transcripts, and merge the shards (see merge_features_tables).
+
+    The rows are in the order of the file, as with a single process.
+
+    The shards are written to temporary files in the output format. The statistics of the processes are added to STATS (if collected).
+    Return: The number of rows written."""
+    # The open files of the options cannot go to the processes.
+    options = SimpleNamespace(**{k: v for k, v in vars(options).items() if not isinstance(v, io.IOBase)})
+    with tempfile.TemporaryDirectory() as tmpDir, ProcessPoolExecutor(max_workers=processes) as pool:
+        shardPaths = [os.path.join(tmpDir, "shard{}".format(i)) for i in range(1, processes + 1)]
+        futures = [pool.submit(run_shard, path, options, (i, processes), shardPath, chunkSize, STATS is not None) for i, shardPath in enumerate(shardPaths, 1)]
+        for fut in futures:
+            report = fut.result()[1]
+            if report is not None:
+                STATS.merge(report)
+        order = FastaIndex(path).ids.tolist() if getattr(options, "index", False) else fasta_ids(path)
+        return merge_features_tables(shardPaths, outfile, getattr(options, "outputFormat", "csv"), metadata, order)
+
+
+def parse_address(address):
+    """Parse the address of a features server: "unix:<path>" (or a path with a "/") for a Unix socket, "<host>:<port>" or "<port>" (on localhost) for TCP.
+
+    Return: ("unix", path) or ("tcp", (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if "/" in address:
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def request_features(address, endpoint, body, params=None, timeout=None):
+    """Send a job to a features server (see FeaturesService) and wait for its answer.
+
+    endpoint: "fasta" or "genes", body: The FASTA or the gene IDs text.
+    Return: The features' table as CSV text."""
+    kind, where = parse_address(address)
+    conn = UnixHTTPConnection(where, timeout) if kind == "unix" else http.client.HTTPConnection(where[0], where[1], timeout=timeout)
+    try:
+        conn.request("POST", "/{}?{}".format(endpoint, urllib.parse.urlencode(params or {})), body=body.encode("utf-8"), headers={"Content-Type": "text/plain; charset=utf-8"})
+        response = conn.getresponse()
+        text = response.read().decode("utf-8")
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError("The features server at {} failed: {}".format(address, text.strip()))
+    return text
+
+
+def write_features(extractors, outfile, fmt="csv", metadata=None, columns=FEATURES_COLUMNS):
+    """Extract the features of each FeaturesExtract of an iterable and append them to the outfile (see FeaturesWriter) as soon as they are done.
+
+    The UTR files of the extractors are concatenated in their order.
+    Return: The number of rows written."""
+    writer = FeaturesWriter(outfile, fmt, metadata, columns)
+    nRows = 0
+    for i, ensFeat in enumerate(extractors):
+        dd = ensFeat.extract()
+        ensFeat.cleanup(appendUtrs=i > 0)
+        with stats_stage("write_table", len(dd)):
+            writer.write(dd)
+        nRows += len(dd)
+        print("...{} transcripts done.".format(nRows), file=sys.stderr)
+    writer.close()
+    return nRows
+
+
+def pipeline_features(listID, dataset, options, outfile, transcr_expr_file=None, martUrl=BIOMART_URL, concurrency=4, chunkSize=100, store=None, batchSize=1000, fastaOut=None, metadata=None, cache=None, fetcher=None):
+    """Fetch the ENSEMBL data of a list of gene IDs, select their transcripts and extract their features in one process, without the intermediate FASTA file.
+
+    The genes are processed by batches of batchSize in two overlapping stages: a producer thread fetches the data and selects the transcripts of the next batches (see get_ENSEMBL_data) while the features of the current batch are extracted and written (see write_features).
+    At most two selected batches wait in the queue between the stages.
+    fastaOut: An open file to also write the selected transcripts as FASTA (as geneIDs2fasta.py), or None.
+    cache, fetcher: An already open ResultsCache and BiomartFetcher (e.g. of a FeaturesService), otherwise they are opened for the run.
+    Return: The number of rows written."""
+    if cache is None and getattr(options, "cacheDir", None):
+        cache = ResultsCache(options.cacheDir, getattr(options, "cacheSize", 1024) * 2**20)
+    previous = read_previous_table(options.previousTable) if getattr(options, "previousTable", None) else None
+    # The expression file is read once, for all the batches (once per batch without a gene column, see expression_options).
+    if transcr_expr_file is not None and not isinstance(transcr_expr_file, dict) and not callable(transcr_expr_file):
+        transcr_expr_file = parse_transcripts_expression(transcr_expr_file, set(listID))
+    fetcher = fetcher or BiomartFetcher(dataset, martUrl, concurrency, chunkSize)
+    batches = queue.Queue(maxsize=2)
+
+    def produce():
+        try:
+            for batch in chunks(listID, batchSize):
+                batches.put(get_ENSEMBL_data(batch, dataset, transcr_expr_file, store=store, fetcher=fetcher))
+        except BaseException as err:
+            batches.put(err)
+        else:
+            batches.put(None)
+
+    def consume():
+        while True:
+            # The time the features wait for the fetching.
+            with stats_stage("wait_for_batch"):
+                transcripts = batches.get()
+            if isinstance(transcripts, BaseException):
+                raise transcripts
+            if transcripts is None:
+                return
+            if fastaOut is not None:
+                txt2fasta(transcripts, fastaOut, close=False)
+            if len(transcripts):
+                yield FeaturesExtract.from_transcripts(transcripts, options, cache, previous)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    nRows = write_features(consume(), outfile, getattr(options, "outputFormat", "csv"), metadata, features_columns(options, previous))
+    producer.join()
+    if fastaOut is not None:
+        fastaOut.close()
+    if cache:
+        cache.report()
+    return nRows
+
+
+def features_schema(metadata=None, columns=FEATURES_COLUMNS):
+    """Return: The pyarrow schema of the features' table with the given columns (types of feature_dtype), with the metadata as strings."""
+    types = {'string': pa.string(), 'int64': pa.int64(), 'float64': pa.float64()}
+    fields = [pa.field(col, types[feature_dtype(col)]) for col in ['ensembl_transcript_id'] + list(columns)]
+    return pa.schema(fields, metadata={str(k): str(v) for k, v in (metadata or {}).items()})
+
+
+def feature_dtype(col):
+    """Return: The type of a column of the features' table, from FEATURES_DTYPES or for the motif columns (see motif_columns) from their suffix."""
+    if col in FEATURES_DTYPES:
+        return FEATURES_DTYPES[col]
+    return 'int64' if col.endswith("_hits") else 'float64'
+
+
+def features_columns(options, previous=None):
+    """Return: The columns of the features' table, FEATURES_COLUMNS, the span limited folding columns with options.spanAbove, the windowed folding columns with options.foldWindow, the motif columns with options.motifs and record_hash with options.recordHash or a previous table.
+
+    Only the columns of options.features are kept (see plan_features), the columns of the other registered stages come after the ones above."""
+    columns = FEATURES_COLUMNS + motif_columns(options)
+    # The span limited and the windowed folding columns go next to the 3'UTR MFE.
+    at = columns.index('3pUTR_MfeBP') + 1
+    if getattr(options, "foldWindow", None):
+        columns = columns[:at] + ['3pUTR_winMfeBP_mean', '3pUTR_winMfeBP_min'] + columns[at:]
+    if getattr(options, "spanAbove", None) is not None:
+        columns = columns[:at] + ['3pUTR_spanMFE', '3pUTR_spanMfeBP'] + columns[at:]
+    _, selected = plan_features(options)
+    columns = [col for col in columns if col in selected] + [col for col in selected if col not in columns]
+    if getattr(options, "recordHash", False) or previous is not None:
+        return columns + ['record_hash']
+    return columns
+
+
+def features_params(options):
+    """Return: The string of the parameters the features depend on, hashed with each transcript: the 3'UTR length limit and the name and parameters of each planned stage (see register_feature)."""
+    stages, _ = plan_features(options)
+    return "utr3len:{}".format(options.utr3len) + "".join("|{}:{}".format(stage.name, stage_params(stage, options)) for stage in stages)
+
+
+def register_feature(name, columns, inputs=(), tools=(), cost=0, params=None):
+    """Decorator registering a function as a stage of the features' table (a FeatureStage), it can then be asked for with --features.
+
+    columns, inputs: The columns the stage computes and the inputs it needs (from FEATURE_INPUTS), lists or functions of the options (a stage without columns is not run).
+    tools: The external programs the stage runs.
+    cost: The relative cost of the stage per transcript, the stages of cost 0 run while the inputs are collected and the others at the same time, the costliest first.
+    params: A function of the options returning the string of what the results of the stage depend on besides the transcript (options, tool versions, data files), hashed in the record_hash of the transcripts (see features_params).
+    The function is called with the FeaturesExtract (with the options, the kept transcripts and the inputs) and the pool of RNAfold workers, it returns a data frame of the columns indexed by the kept transcripts.
+    Registering a name again replaces the stage."""
+    def register(compute):
+        fixedInputs = inputs if callable(inputs) else tuple(inputs)
+        unknown = set([] if callable(inputs) else fixedInputs) - set(FEATURE_INPUTS)
+        if unknown:
+            raise ValueError("Unknown inputs {} of the feature {}, they must be in {}.".format(", ".join(sorted(unknown)), name, ", ".join(FEATURE_INPUTS)))
+        FEATURE_STAGES[name] = FeatureStage(name, columns, fixedInputs, tuple(tools), cost, compute, params)
+        return compute
+    return register
+
+
+def stage_columns(stage, options):
+    """Return: The list of the columns of a feature stage with the options."""
+    return list(stage.columns(options) if callable(stage.columns) else stage.columns)
+
+
+def stage_inputs(stage, options):
+    """Return: The list of the inputs of a feature stage with the options."""
+    return list(stage.inputs(options) if callable(stage.inputs) else stage.inputs)
+
+
+def stage_params(stage, options):
+    """Return: The parameters string of a feature stage with the options ("" without params)."""
+    return stage.params(options) if stage.params else ""
+
+
+def parse_features(spec):
+    """Parse a comma separated list of features (stage names or columns, see plan_features).
+
+    Return: The list of the names."""
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    if not names:
+        raise ValueError("No feature in {}.".format(spec))
+    return names
+
+
+def plan_features(options):
+    """Plan the stages of the features' table from options.features, a list of stage names and columns (all the registered stages by default).
+
+    A stage name asks for all its columns, a column for its stage only. The stages without columns with the options (e.g. motifs without options.motifs) are left out by default, and an error if asked for.
+    Return: The list of the stages to run, in the order of registration, and the list of the columns asked for."""
+    columns = {name: stage_columns(stage, options) for name, stage in FEATURE_STAGES.items()}
+    wanted = getattr(options, "features", None) or [name for name in FEATURE_STAGES if columns[name]]
+    planned = set()
+    selected = []
+    for item in wanted:
+        if item in FEATURE_STAGES:
+            if not columns[item]:
+                raise ValueError("The feature {} needs its options (e.g. --motifs or --fold-window).".format(item))
+            planned.add(item)
+            selected.extend(col for col in columns[item] if col not in selected)
+            continue
+        owner = next((name for name, cols in columns.items() if item in cols), None)
+        if owner is None:
+            raise ValueError("Unknown feature {}, the features are {} (or any of their columns).".format(item, ", ".join(FEATURE_STAGES)))
+        planned.add(owner)
+        if item not in selected:
+            selected.append(item)
+    return [stage for name, stage in FEATURE_STAGES.items() if name in planned], selected
+
+
+def describe_features(options):
+    """Return: The lines describing the registered feature stages (their columns with the options, inputs, external programs and cost)."""
+    lines = []
+    for stage in FEATURE_STAGES.values():
+        lines.append("{}\tcolumns: {}\tinputs: {}\ttools: {}\tcost: {}".format(stage.name, ",".join(stage_columns(stage, options)) or "(needs options)", ",".join(stage_inputs(stage, options)),
+                                                                              ",".join(stage.tools) or "-", stage.cost))
+    return lines
+
+
+@register_feature("gene", ['ensembl_gene_id', 'gene_name'], inputs=["header"])
+def gene_feature(fx, pool=None):
+    """Return: The gene ID and name of the transcripts."""
+    return pd.DataFrame({'ensembl_gene_id': fx.store.geneIDs[fx.keep].tolist(), 'gene_name': fx.store.geneNames[fx.keep].tolist()}, index=fx.ids)
+
+
+@register_feature("lengths", ['coding_len', '5pUTR_len', '3pUTR_len'], inputs=["header"])
+def lengths_feature(fx, pool=None):
+    """Return: The lengths of the coding sequence and the UTRs."""
+    return pd.DataFrame({'coding_len': (fx.store.cdnaEnd - fx.store.cdnaStart)[fx.keep], '5pUTR_len': fx.bf['5pUTR_len'][fx.keep], '3pUTR_len': fx.bf['3pUTR_len'][fx.keep]}, index=fx.ids)
+
+
+@register_feature("GC", GC_COLUMNS, inputs=["sequence"])
+def gc_feature(fx, pool=None):
+    """Return: The GC content of the transcript and the UTRs."""
+    return pd.DataFrame({col: fx.bf[col][fx.keep] for col in GC_COLUMNS}, index=fx.ids)
+
+
+@register_feature("Kozak", ['Kozak_Sequence', 'Kozak_Context'], inputs=["header", "sequence"])
+def kozak_feature(fx, pool=None):
+    """Return: The Kozak sequence and context of the start codon."""
+    store = fx.store
+    return pd.DataFrame({'Kozak_Sequence': [store.text(store.kozak(i)) for i in fx.keep], 'Kozak_Context': [store.text(store.kozak_context(i)) for i in fx.keep]}, index=fx.ids)
+
+
+@register_feature("MFE_5pUTR", ['5pUTR_MFE', '5pUTR_MfeBP'], inputs=["5pUTR"], tools=["RNAfold"], cost=10, params=lambda options: "RNAfold:{}".format(rnafold_version()))
+def mfe5p_feature(fx, pool=None):
+    """Return: The MFE of the 5'UTRs (see calculate_free_energy)."""
+    return calculate_free_energy(fx.utr5p, "5pUTR", fx.workers, pool, fx.cache)
+
+
+@register_feature("MFE_3pUTR", ['3pUTR_MFE', '3pUTR_MfeBP'], inputs=["3pUTR"], tools=["RNAfold"], cost=100,
+                  params=lambda options: "RNAfold:{}|spanAbove:{}".format(rnafold_version(), getattr(options, "spanAbove", None)))
+def mfe3p_feature(fx, pool=None):
+    """Return: The MFE of the 3'UTRs, NaN above options.spanAbove (see calculate_free_energy), shared with spanMFE_3pUTR."""
+    return fx.shared("MFE_3pUTR", lambda: calculate_free_energy(fx.utr3p, "3pUTR", fx.workers, pool, fx.cache, maxLength=getattr(fx.options, "spanAbove", None)))
+
+
+@register_feature("spanMFE_3pUTR", lambda options: ['3pUTR_spanMFE', '3pUTR_spanMfeBP'] if getattr(options, "spanAbove", None) is not None else [], inputs=["3pUTR"], tools=["RNAfold"], cost=20,
+                  params=lambda options: "RNAfold:{}|maxBPspan:{}".format(rnafold_version(), getattr(options, "maxBPspan", FOLD_MAX_BP_SPAN)))
+def span_mfe3p_feature(fx, pool=None):
+    """Return: The MFE of all the 3'UTRs folded with the maximum base pair span of options.maxBPspan, with options.spanAbove (see calculate_free_energy).
+
+    The span cannot change the folding of the 3'UTRs of at most maxBPspan nt: the ones MFE_3pUTR folds (up to spanAbove) are not folded again, their MFE is taken from it."""
+    span = getattr(fx.options, "maxBPspan", FOLD_MAX_BP_SPAN)
+    reused = min(span, fx.options.spanAbove) if any(stage.name == "MFE_3pUTR" for stage in fx.stages) else 0
+    longer = [(idt, seq) for idt, seq in fx.utr3p if len(seq) > reused]
+    spanMfe = calculate_free_energy(longer, "3pUTR", fx.workers, pool, fx.cache, span, prefix="span")
+    if len(longer) == len(fx.utr3p):
+        return spanMfe
+    full = fx.shared("MFE_3pUTR", lambda: calculate_free_energy(fx.utr3p, "3pUTR", fx.workers, pool, fx.cache, maxLength=fx.options.spanAbove))
+    short = np.array([len(seq) <= reused for _, seq in fx.utr3p], dtype=bool)
+    spanMfe = spanMfe.reindex([idt for idt, _ in fx.utr3p])
+    spanMfe.loc[short, ['3pUTR_spanMFE', '3pUTR_spanMfeBP']] = full.loc[short, ['3pUTR_MFE', '3pUTR_MfeBP']].values
+    return spanMfe
+
+
+@register_feature("windowMFE_3pUTR", lambda options: ['3pUTR_winMfeBP_mean', '3pUTR_winMfeBP_min'] if getattr(options, "foldWindow", None) else [], inputs=["3pUTR"], tools=["RNAfold"], cost=50,
+                  params=lambda options: "RNAfold:{}|maxBPspan:{}|foldWindow:{}|foldStep:{}".format(rnafold_version(), getattr(options, "maxBPspan", FOLD_MAX_BP_SPAN), *fold_window(options)))
+def window_mfe3p_feature(fx, pool=None):
+    """Return: The windowed MFE of the 3'UTRs with options.foldWindow (see calculate_window_free_energy)."""
+    window, step = fold_window(fx.options)
+    return calculate_window_free_energy(fx.utr3p, "3pUTR", window, step, getattr(fx.options, "maxBPspan", FOLD_MAX_BP_SPAN), fx.workers, pool, fx.cache)
+
+
+def fold_window(options):
+    """Return: The window and the step in nt of the windowed folding of the options (a third of the window by default)."""
+    window = getattr(options, "foldWindow", None)
+    return window, getattr(options, "foldStep", None) or (window or 0) // 3 or 1
+
+
+@register_feature("TOP_localScore", ['TOP_localScore'], inputs=["sequence"], cost=1, params=lambda options: "clip:{}".format(options.clip))
+def local_score_feature(fx, pool=None):
+    """Return: The local score of the 5'UTR start, with a scoring that endorses the TOP mRNAs."""
+    scoring = {'A': -1, 'C': 1, 'G': -1, 'T': 1, "N": 0}
+    return calculate_local_score(fx.segments("5pUTR"), scoring, fx.clip, fx.cache)
+
+
+@register_feature("CAI", ['CAI'], inputs=["sequence"], cost=1, params=lambda options: "codonIndex:{}".format(codon_index_hash(load_codon_index(codon_table(options)))))
+def cai_feature(fx, pool=None):
+    """Return: The CAI of the coding sequences with the codon table of the options."""
+    nPartial = int(((fx.bf["CDS_end"] - fx.bf["CDS_start"])[fx.keep] % 3 != 0).sum())
+    if nPartial:
+        print("{} coding sequences not a multiple of 3!".format(nPartial), file=sys.stderr)
+    return calculate_CAI(fx.segments("CDS"), fx.cache, load_codon_index(codon_table(fx.options)))
+
+
+@register_feature("motifs", lambda options: motif_columns(options), inputs=lambda options: getattr(options, "motifRegions", ["3pUTR"]), cost=5, params=lambda options: motifs_params(options))
+def motifs_feature(fx, pool=None):
+    """Return: The hits and best scores of the motifs of options.motifs over the UTRs of options.motifRegions (see predict_binding)."""
+    utrs = {"5pUTR": fx.utr5p, "3pUTR": fx.utr3p}
+    motifs = load_motif_scanner(fx.options.motifs, getattr(fx.options, "motifPvalue", 1e-4))
+    return pd.concat([predict_binding(utrs[region], motifs, region, cache=fx.cache) for region in getattr(fx.options, "motifRegions", ["3pUTR"])], axis=1, sort=False)
+
+
+def motifs_params(options):
+    """Return: The parameters string of the motifs stage: the hash of the motifs file, the p-value and the regions."""
+    with open(options.motifs, "rb") as fh:
+        motifsHash = hashlib.sha1(fh.read()).hexdigest()
+    return "motifs:{}|motifPvalue:{}|motifRegions:{}".format(motifsHash, getattr(options, "motifPvalue", 1e-4), ",".join(getattr(options, "motifRegions", ["3pUTR"])))
+
+
+def read_previous_table(path):
+    """Read a previous features' table (any output format) for an update, it must have the record_hash column.
+
+    Return: The table, indexed by transcript."""
+    with stats_stage("read_previous_table"):
+        previous = read_features_table(path)
+    if 'record_hash' not in previous.columns:
+        raise ValueError("The previous table {} has no record_hash column, it must be written with --record-hash (or be itself an update).".format(path))
+    print("{} transcripts in the previous table.".format(len(previous)), file=sys.stderr)
+    return previous[~previous.index.duplicated()]
+
+
+def read_features_table(path, columns=None, memory_map=True):
+    """Read a features' table written by fasta2table.py in any of the output formats (detected from the file).
+
+    The Parquet and Arrow files are memory mapped and only the given columns are read (all if None).
+    Return: A data frame indexed by transcript, with the file metadata (or the CSV comment trailer) in its attrs."""
+    with open(path, "rb") as fh:
+        magic = fh.read(6)
+    if columns is not None and magic[:4] in (b"PAR1", b"ARRO"):
+        # The transcript IDs are always read, as the index.
+        columns = ['ensembl_transcript_id'] + [col for col in columns if col != 'ensembl_transcript_id']
+    if magic[:4] == b"PAR1":
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    elif magic == b"ARROW1":
+        source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        # The CSV is parsed back to the values it was written from (strings stay strings, floats round trip).
+        strings = {col: str for col, dtype in FEATURES_DTYPES.items() if dtype == 'string'}
+        df = pd.read_csv(path, sep=";", index_col=0, comment="#", dtype=strings, keep_default_na=False, na_values=[""], float_precision="round_trip")
+        with open(path) as fh:
+            df.attrs = {"trailer": [line[2:].rstrip("\n") for line in fh if line.startswith("# ")]}
+        return df if columns is None else df[columns]
+    df = table.to_pandas()
+    if 'ensembl_transcript_id' in df.columns:
+        df = df.set_index('ensembl_transcript_id')
+    df.attrs = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items() if k != b"pandas"}
+    return df
+
+
+def to_numeric_column(col):
+    """Convert a column of strings (and None) to numbers if they all are, as pandas.read_csv does.
+
+    Return: The converted column, or the column with NaN for None if it is not numeric."""
+    try:
+        return pd.to_numeric(col)
+    except (ValueError, TypeError):
+        return col.where(col.notnull(), np.nan)
+
+
+def get_ENSEMBL_data(listID, dataset, transcr_expr_file=None, martUrl=BIOMART_URL, concurrency=4, chunkSize=100, store=None, fetcher=None):
     """Function to connect to ENSEBL and retrieve data.
 
     The functions follows two modes of working:
     1) Transcript selection scheme acording to ENSEMBL/HAVANA, TSL and APPRIS. (Default)
     2) Transcript selection by the best expressed transcript if ther is an externaly provided file.
+    The BioMart queries run concurrently by chunks of gene IDs (see BiomartFetcher).
+    With an EnsemblStore the genes are looked up locally and only the missing ones are fetched (and then added to the store).
+    An already open BiomartFetcher can be shared between calls, otherwise one is opened with martUrl, concurrency and chunkSize.
 
     Return: Pandas data frame of the transcripts and their ENSEMBL features.
     """
     print("Connection to ENSEMBL server.", file=sys.stderr)
-    server = BiomartServer("http://www.ensembl.org/biomart/")
-    dt = server.datasets[dataset]
-    print("Retrieve the dataset...", file=sys.stderr)
-    listAttrib = ['ensembl_gene_id', 'ensembl_transcript_id', 'external_gene_name', 'transcript_length', 'transcript_biotype', 'cdna_coding_start', 'cdna_coding_end', 'cdna', 'description']
-    listAttrib2 = ['ensembl_gene_id', 'ensembl_transcript_id', 'transcript_tsl', 'transcript_appris', 'transcript_source', 'transcript_length', 'transcript_biotype']
-    print("Fetch data from: {}".format(str(server)), file=sys.stderr)
-    # Collect data from the ENSEMBL datasets.
-    dfFeat = pd.DataFrame()
-    dfTrans = pd.DataFrame()
-    for chunk in chunks(listID, 100):
-        print('Fetching...', file=sys.stderr)
-        res1 = dt.search({'filters': {'ensembl_gene_id': chunk}, 'attributes': listAttrib}, header=1)
-        res2 = dt.search({'filters': {'ensembl_gene_id': chunk}, 'attributes': listAttrib2}, header=1)
-        # Reading stream to a pandas data frame.
-        dataf = pd.read_csv(io.StringIO(res1.text), sep='\t', encoding='utf-8')
-        datat = pd.read_csv(io.StringIO(res2.text), sep='\t', encoding='utf-8')
-        # Cleanup data frame lines that do not correspond to protein coding genes.
-        dataf = dataf[dataf['Transcript type'] == 'protein_coding']
-        datat = datat[datat['Transcript type'] == 'protein_coding']
-        # Concatenate data frames.
-        dfFeat = pd.concat([dfFeat, dataf], axis=0, sort=False)
-        dfTrans = pd.concat([dfTrans, datat], axis=0, sort=False)
+    if fetcher is None:
+        fetcher = BiomartFetcher(dataset, martUrl, concurrency, chunkSize)
+    # Collect data from the ENSEMBL datasets, from the local store first if there is one.
+    if store is not None:
+        with stats_stage("store_lookup", len(listID)):
+            dfFeat, dfTrans, missing = store.lookup(listID, dataset)
+        print("{} genes found in the local store, {} to fetch.".format(len(listID) - len(missing), len(missing)), file=sys.stderr)
+    else:
+        dfFeat, dfTrans, missing = None, None, listID
+    if missing:
+        print("Fetch data from: {}".format(str(fetcher)), file=sys.stderr)
+        # The two attribute lists are fetched at the same time.
+        with stats_stage("biomart_fetch", len(missing)):
+            netFeat, netTrans = fetcher.fetch(missing, [FEATURE_ATTRIBUTES, TRANSCRIPT_ATTRIBUTES])
+        if store is not None:
+            store.add(missing, netFeat, netTrans)
+        dfFeat = pd.concat([dfFeat, netFeat], axis=0, sort=False)
+        dfTrans = pd.concat([dfTrans, netTrans], axis=0, sort=False)
+    if store is not None:
+        # Put the stored and fetched genes back in the order of the list.
+        order = {g: i for i, g in enumerate(listID)}
+        dfFeat = dfFeat.iloc[np.argsort(dfFeat['Gene stable ID'].map(order).values, kind="stable")]
+        dfTrans = dfTrans.iloc[np.argsort(dfTrans['Gene stable ID'].map(order).values, kind="stable")]
+    # Cleanup data frame lines that do not correspond to protein coding genes.
+    dfFeat = dfFeat[dfFeat['Transcript type'] == 'protein_coding']
+    dfTrans = dfTrans[dfTrans['Transcript type'] == 'protein_coding']
     print("...fetch done!", file=sys.stderr)
     # Function to select transcripts.
-    transcripts = select_transcripts(dfTrans, dfFeat, transcr_expr_file)
+    with stats_stage("select_transcripts", len(dfTrans)):
+        transcripts = select_transcripts(dfTrans, dfFeat, transcr_expr_file)
     # Set the size of the UTRs and the CDS by using the information of the coding exon.
-    for index, row in transcripts.iterrows():
-        # For 5'UTR end take the smallest coordinate in the coding exons.
-        coding_start = min([int(x) for x in row["cDNA coding start"].split(";")])
-        coding_end = max([int(x) for x in row["cDNA coding end"].split(";")])
-        # REPLACE the right CDS start and end
-        transcripts.at[index, "cDNA coding start"] = coding_start
-        transcripts.at[index, "cDNA coding end"] = coding_end
-        # Clean up the TSL value.
-        tsl = row["Transcript support level (TSL)"].split()[0]
-        transcripts.at[index, "Transcript support level (TSL)"] = tsl
+    # For 5'UTR end take the smallest coordinate in the coding exons, for the 3'UTR start the largest.
+    for col, agg in (("cDNA coding start", "min"), ("cDNA coding end", "max")):
+        coords = transcripts[col].astype(str).str.split(";", expand=True).apply(pd.to_numeric)
+        transcripts[col] = getattr(coords, agg)(axis=1).astype(np.int64)
+    # Clean up the TSL value.
+    transcripts["Transcript support level (TSL)"] = transcripts["Transcript support level (TSL)"].astype(str).str.split().str[0]
     return transcripts
 
 
 def select_transcripts(dfTrans, dfFeat, transcr_expr_file):
     """Selects the transcripts according to the ENSEMBL classification, or according to a expression levels file.
 
+    For each gene the best ranked transcript without missing data is selected, by a join of the ranking to the merged ENSEMBL data and a groupby on the genes.
+    transcr_expr_file can also be an already parsed expression file (see parse_transcripts_expression), or the reader of expression files without a gene column (see expression_options).
     Return a data frame with the transcripts info.
     """
     # Perform the transcript selection with the two ways
     if transcr_expr_file is None:
-        trans_sorted = transcript_classification(dfTrans)
+        ranking = rank_transcripts(dfTrans)
     else:
         genes = set(dfTrans["Gene stable ID"])
-        trans_sorted = parse_transcripts_expression(transcr_expr_file, genes)
-    # Initialise the return data frame.
-    transcripts = pd.DataFrame()
-    # Set the index to the transcript ID
-    dfFeat.set_index('Transcript stable ID', inplace=True)
-    dfTrans.set_index('Transcript stable ID', inplace=True)
-    # Concatenate the two data frames by setting the index to the inner product.
-    dfENSEMBL = pd.concat([dfFeat, dfTrans], axis=1, join='inner')
-    # dfENSEMBL.reset_index(inplace=True)
-    dfENSEMBL = dfENSEMBL.T.drop_duplicates().T
-    # Here is the actual population of the final transcripts data frame.
-    for gene in trans_sorted:
-        for trans in trans_sorted[gene]:
-            row = dfENSEMBL.loc[trans.trans_id]
-            if row.isnull().any():
-                print(row)
-                continue
-            else:
-                row = pd.DataFrame(row).T
-                row.reset_index(inplace=True)
-                transcripts = transcripts.append(row, ignore_index=True)  # Strange way to concatenate a data frame.
-                break
-    transcripts.set_index('index', inplace=True)
+        if isinstance(transcr_expr_file, dict):
+            trans_sorted = {gene: trans for gene, trans in transcr_expr_file.items() if gene in genes}
+        elif callable(transcr_expr_file):
+            # The genes of the transcripts are the ones of the transcripts table.
+            trans_sorted = transcr_expr_file(transcriptGenes=dict(zip(dfTrans["Transcript stable ID"], dfTrans["Gene stable ID"])))
+        else:
+            trans_sorted = parse_transcripts_expression(transcr_expr_file, genes)
+        # The ranking as a data frame: the order of the gene and the rank of the transcript in the gene.
+        ranking = pd.DataFrame([(g, r, trans.trans_id) for g, gene in enumerate(trans_sorted) for r, trans in enumerate(trans_sorted[gene])], columns=['gene_order', 'rank', 'Transcript stable ID'])
+    # Join the two data frames on the transcript ID (inner product), the columns present in both are kept once.
+    dfFeat = dfFeat.set_index('Transcript stable ID')
+    dfTrans = dfTrans.set_index('Transcript stable ID')
+    dfENSEMBL = dfFeat.join(dfTrans[dfTrans.columns.difference(dfFeat.columns, sort=False)], how='inner')
+    # Transcripts with missing data are not selected.
+    complete = dfENSEMBL.notnull().all(axis=1)
+    ranking = ranking[ranking['Transcript stable ID'].map(complete).fillna(False).astype(bool)]
+    nIncomplete = int((~complete).sum())
+    if nIncomplete:
+        print("{} transcripts with missing data are skipped.".format(nIncomplete), file=sys.stderr)
+    # Here is the actual selection, the best ranked complete transcript of each gene.
+    best = ranking.sort_values(['gene_order', 'rank']).groupby('gene_order', sort=True).head(1)
+    transcripts = dfENSEMBL.loc[best['Transcript stable ID']]
     # Remove the transcript type column.
-    transcripts.drop('Transcript type', axis=1, inplace=True)
+    transcripts = transcripts.drop('Transcript type', axis=1)
     return transcripts
 
 
+def classification_keys(ensemblTable):
+    """Parse the ENSEMBL transcript classifications into the sort keys of the Havana-APPRIS-TSL-length criteria.
+
+    ensemblTable: A pandas dataframe with the ENSEMBL transcript classifications, with the columns gene, transcript, TSL, APPRIS, source and length (in this order).
+    Return: A data frame with one row per transcript (positional index) and the havana, appris, tsl and length keys, the lowest key is the best.
+    """
+    # The annotations take few distinct values, they are parsed once per value.
+    tslCodes, tslValues = pd.factorize(ensemblTable.iloc[:, 2].astype(str))
+    apprisCodes, apprisValues = pd.factorize(ensemblTable.iloc[:, 3].astype(str))
+    # Deal with the transcript source (Inf if unknown).
+    h = ensemblTable.iloc[:, 4].map(HAVANA_RANKS).astype(float).fillna(math.inf)
+    # Deal with the APPRIS characterisation, principal before alternative and then the number (as a string).
+    mm = pd.Series(apprisValues).str.extract(r"^([a-z]+)([0-9]+)")
+    a = (mm[0].map(APPRIS_PREFIXES).fillna("") + mm[1]).fillna("z").values[apprisCodes]
+    # Take the TSL order (Inf if NA)
+    t = pd.Series(tslValues).str.extract(r"^[a-z]{3}([0-9]+)")[0].astype(float).fillna(math.inf).values[tslCodes]
+    # reverse Length
+    rl = -pd.to_numeric(ensemblTable.iloc[:, 5]).astype(np.int64)
+    return pd.DataFrame({'havana': h.values, 'appris': a, 'tsl': t, 'length': rl.values})
+
+
+def rank_transcripts(ensemblTable, keys=None):
+    """Rank the transcripts of each gene by the ENSEMBL classification based on the Havana-APPRIS-TSL (with this order) criteria, the longest transcript first on ties.
+
+    All the genes are ordered with one stable multi-key sort, the genes keep the order of their first appearance in the table and tied transcripts their order in the table.
+    keys: The sort keys of the table from classification_keys, computed if None.
+    Return: A data frame with the order of the gene, the rank of the transcript in the gene and the transcript ID, sorted by gene and rank. The index is the position of the transcript in ensemblTable.
+    """
+    if keys is None:
+        keys = classification_keys(ensemblTable)
+    geneOrder = pd.factorize(ensemblTable.iloc[:, 0])[0]
+    # The APPRIS keys are strings, sort them by their rank among the unique keys.
+    apprisRank = np.unique(keys['appris'].values.astype(str), return_inverse=True)[1]
+    order = np.lexsort((keys['length'].values, keys['tsl'].values, apprisRank, keys['havana'].values, geneOrder))
+    ranking = pd.DataFrame({'gene_order': geneOrder[order], 'Transcript stable ID': ensemblTable.iloc[:, 1].values[order]}, index=order)
+    ranking.insert(1, 'rank', ranking.groupby('gene_order').cumcount().values)
+    return ranking
+
+
 def transcript_classification(ensemblTable):
     """Return a dictionary of transcripts per gene, sorted by the ENSEMBL classification based on the Havana-APPRIS-TSL (with this order) criteria.
 
@@ -229,78 +1990,290 @@ def transcript_classification(ensemblTable):
     # Declare the namedtuple.
     Transcript = namedtuple('Transcript', "trans_id, havana, appris, tsl, length, sort")
     genes_transcripts = {}
-    havanaDict = {"ensembl_havana": 0, "ensembl": 1, "havana": 2}
-    for i in range(len(ensemblTable)):
-        # Collect the attributes
-        g_id = ensemblTable.iloc[i, 0]
-        tr_id = ensemblTable.iloc[i, 1]
-        tsl = ensemblTable.iloc[i, 2]
-        appris = ensemblTable.iloc[i, 3]
-        havana = ensemblTable.iloc[i, 4]
-        tr_len = ensemblTable.iloc[i, 5]
-        # Generate the sorting tuple.
-        # Deal with the transcript source.
-        if havana in havanaDict:
-            h = havanaDict[havana]
-        else:
-            h = math.inf
-        # Deal with the APPRIS characterisation.
-        mm = re.match(r"^([a-z]+)([0-9]+)", str(appris))
-        if mm:
-            a = ""
-            if mm.group(1) == "principal":
-                a = a + "a"
-            elif mm.group(1) == "alternative":
-                a = a + "b"
-            a = a + mm.group(2)
-        else:
-            a = "z"
-        # Take the TSL order (Inf if NA)
-        tt = re.match(r"^[a-z]{3}([0-9]+)", str(tsl))
-        if tt:
-            t = int(tt.group(1))
-        else:
-            t = math.inf
-        # reverse Length
-        rl = -int(tr_len)
-        # Form the sorting tuple.
-        sort_tuple = (h, a, t, rl)
-        # Form the namedtuple
-        tr_namedtuple = Transcript(tr_id, havana, appris, tsl, tr_len, sort_tuple)
-        genes_transcripts.setdefault(g_id, [])
-        genes_transcripts[g_id].append(tr_namedtuple)
-    # Sort each list of nametuples in the dict.
-    for gene, transcript_list in genes_transcripts.items():
-        trListSorted = sorted(transcript_list, key=lambda t: t.sort)
-        genes_transcripts[gene] = trListSorted
+    keys = classification_keys(ensemblTable)
+    ranking = rank_transcripts(ensemblTable, keys)
+    # Take the table and the keys in the ranking order, the transcripts are appended already sorted.
+    table = ensemblTable.iloc[ranking.index]
+    keys = keys.iloc[ranking.index]
+    sortTuples = zip(keys['havana'], keys['appris'], keys['tsl'], keys['length'])
+    for g_id, tr_id, tsl, appris, havana, tr_len, sort_tuple in zip(*(table.iloc[:, k] for k in range(6)), sortTuples):
+        genes_transcripts.setdefault(g_id, []).append(Transcript(tr_id, havana, appris, tsl, tr_len, sort_tuple))
     return genes_transcripts
 
 
 def parse_transcripts_expression(transExprFile, genes):
     """Parse a transcript expression file and sorts each transcript per gene by its expression level.
 
+    The file is a CSV without header: the gene ID, the transcript ID and the expression level (TPM), the transcripts below 1 TPM are left out (see read_transcripts_expression for the other formats).
     return: A dicitonary of key=geneID : value:[sorted list of transcripts]
     """
+    return read_transcripts_expression(transExprFile, genes, sep=",")
+
+
+def expression_columns(columns, header):
+    """Return: The 0-based positions of the expression file columns, given as positions or (with a header) as names, None (no gene column) is kept."""
+    positions = []
+    for col in columns:
+        if col is None:
+            positions.append(None)
+        elif isinstance(col, (int, np.integer)):
+            positions.append(int(col))
+        elif col in header:
+            positions.append(header.index(col))
+        else:
+            raise ValueError("Column {!r} not in the expression file header {}.".format(col, header))
+    return positions
+
+
+def read_transcripts_expression(paths, genes, columns=(0, 1, 2), sep=None, header=False, threshold=1.0, aggregate="mean", chunkSize=EXPRESSION_CHUNK, transcriptGenes=None):
+    """Read transcript expression files (e.g. the quantification tables of salmon, kallisto or RSEM) and sort the transcripts of each gene by their expression level.
+
+    paths: A path or open file, or a list of them (e.g. one per sample). The gzipped files are read transparently.
+    columns: The gene ID, transcript ID and expression columns, as 0-based positions or as names of the header. More than one expression column is read as more than one sample.
+             The gene column can be None, for the tables without one (salmon's quant.sf, kallisto's abundance.tsv): the gene of each transcript is then the one of transcriptGenes.
+    transcriptGenes: A mapping of the transcript IDs to their gene IDs (e.g. from the BioMart transcripts table), the version suffix of the IDs of the file is left out to look them up.
+    sep: The delimiter of the columns, or None to take a tab if the first line has one and a comma otherwise.
+    The files are read by chunks of chunkSize lines and only the rows of the genes (or of their transcripts) are kept, the memory used does not depend on the size of the files.
+    The expression of each transcript is the mean or median (aggregate) of its samples, the transcripts below threshold are left out.
+    Return: A dictionary of key=geneID : value:[transcripts sorted by decreasing expression], with the genes in their order in the (first) file.
+    """
+    if isinstance(paths, (str, os.PathLike)) or hasattr(paths, "read"):
+        paths = [paths]
+    genes = set(genes)
+    if columns[0] is None and transcriptGenes is None:
+        raise ValueError("The genes of the transcripts (transcriptGenes) are needed without a gene column.")
+    samples = []
+    with stats_stage("read_expression"):
+        for path in paths:
+            fileSep, names, compression = sep, [], None
+            if not hasattr(path, "read"):
+                # Look at the first line for the delimiter and the header.
+                with open(path, "rb") as fh:
+                    compression = "gzip" if fh.read(2) == b"\x1f\x8b" else None
+                with (gzip.open(path, "rt") if compression else open(path)) as fh:
+                    firstLine = fh.readline().rstrip("\r\n")
+                fileSep = fileSep or ("\t" if "\t" in firstLine else ",")
+                names = firstLine.split(fileSep) if header else []
+            elif header:
+                names = path.readline().rstrip("\r\n").split(fileSep or ",")
+            positions = expression_columns(columns, names)
+            geneCol, transCol, exprCols = positions[0], positions[1], positions[2:]
+            usecols = [col for col in positions if col is not None]
+            reader = pd.read_csv(path, sep=fileSep or ",", header=None, skiprows=1 if header and not hasattr(path, "read") else 0, usecols=usecols,
+                                 dtype={col: str for col in (geneCol, transCol) if col is not None}, compression=compression, chunksize=chunkSize)
+            for chunk in reader:
+                stats_count("expression_rows", len(chunk))
+                if geneCol is None:
+                    trans = chunk[transCol].str.replace(ID_VERSION, "", regex=True)
+                    gene = trans.map(transcriptGenes)
+                else:
+                    trans, gene = chunk[transCol], chunk[geneCol]
+                # Keep the genes early, before the columns are converted.
+                keep = gene.isin(genes).values
+                for col in exprCols:
+                    samples.append(pd.DataFrame({"gene": gene.values[keep], "transcript": trans.values[keep],
+                                                 "expr": pd.to_numeric(chunk[col].values[keep], errors="coerce")}))
     Transcript = namedtuple('Transcript', "trans_id, expr_level")
+    if not samples:
+        return {}
+    # The mean or median over the samples of each transcript, in the order of the first file.
+    expr = pd.concat(samples, ignore_index=True).groupby(["gene", "transcript"], sort=False)["expr"].agg(aggregate).reset_index()
+    expr = expr[expr["expr"] >= threshold]
+    # Sort by gene (in order of their first transcript above threshold) and by decreasing expression, the ties keep the file order.
+    geneOrder = pd.factorize(expr["gene"])[0]
+    expr = expr.iloc[np.lexsort((-expr["expr"].values, geneOrder))]
     genes_transcripts = {}
-    # Iterate over the file and collect all the transcripts per gene that have more than 1 TPM expression.
-    with transExprFile as ef:
-        #ef.readline()  # Iff The first line is either header or comments.
-        for line in ef:
-            fields = line.split(",")
-            geneName = fields[0]
-            transName = fields[1]
-            trExpr = float(fields[2])
-            if geneName in genes and trExpr >= 1:  # The limit of TPM.
-                tr_namedtuple = Transcript(transName, trExpr)
-                genes_transcripts.setdefault(geneName, [])
-                genes_transcripts[geneName].append(tr_namedtuple)
-    for gene, transList in genes_transcripts.items():
-        transListSorted = sorted(transList, reverse=True, key=lambda t: t.expr_level)
-        genes_transcripts[gene] = transListSorted
+    for gene, trans, level in zip(expr["gene"].tolist(), expr["transcript"].tolist(), expr["expr"].tolist()):
+        genes_transcripts.setdefault(gene, []).append(Transcript(trans, level))
     return genes_transcripts
 
 
+def expression_options(options, genes):
+    """Read the expression files of the command line options (-e and the --expr-* ones) for the genes.
+
+    The columns are given as comma separated 1-based positions or names (which need --expr-header).
+    Two columns, or '-' as the gene column, are the transcript and expression columns of a file without gene column (e.g. 'Name,TPM' for salmon):
+    the genes of the transcripts are only known from the BioMart transcripts table, the files are read by select_transcripts, for each batch of genes.
+    Return: The parsed expression (see read_transcripts_expression), its reader without gene column, or None without expression files.
+    """
+    paths = getattr(options, "exprTrans", None)
+    if not paths:
+        return None
+    columns = [int(col) - 1 if col.isdigit() else None if col == "-" else col for col in getattr(options, "exprColumns", "1,2,3").split(",")]
+    if len(columns) == 2:
+        columns = [None] + columns
+    sep = getattr(options, "exprSep", None)
+    sep = {"tab": "\t", "\\t": "\t", "comma": ","}.get(sep, sep)
+    reader = functools.partial(read_transcripts_expression, paths, genes, columns, sep, getattr(options, "exprHeader", False), getattr(options, "exprThreshold", 1.0),
+                               getattr(options, "exprAggregate", "mean"))
+    return reader if columns[0] is None else reader()
+
+
+# Bytes counted as G+C (as in Bio.SeqUtils.GC, including the ambiguous S).
+GC_BYTES = np.zeros(256, dtype=bool)
+GC_BYTES[np.frombuffer(b"GCgcSs", dtype=np.uint8)] = True
+
+
+def parse_fasta_header(title):
+    """Parse the header of a geneIDs2fasta.py FASTA record, as ENSEMBLSeqs does.
+
+    Return: A dictionary with the transcript "id" and the features of the header (GeneID, GeneName, cDNA_start, ...)."""
+    fields = title.split("|")
+    feat = dict(item.split(":", 1) for item in fields[1:-1])
+    feat["id"] = fields[0].split()[0] if fields[0].split() else ""
+    return feat
+
+
+def record_ranges(starts, positions):
+    """Return: The (start, end) byte ranges of the records at the (sorted) positions, a run of consecutive records being one range."""
+    if not len(positions):
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    firsts = positions[np.concatenate(([0], breaks))]
+    lasts = positions[np.concatenate((breaks - 1, [len(positions) - 1]))]
+    return list(zip(starts[firsts].tolist(), starts[lasts + 1].tolist()))
+
+
+def parse_fasta_ranges(path, ranges, timed=False):
+    """Parse the whole records of byte ranges of a FASTA file (see FastaIndex) into a TranscriptStore, from a memory map of the file.
+
+    timed: Also return the parsing time in seconds (for the worker processes), otherwise it goes to STATS.
+    Return: The store (and the time)."""
+    start = time.perf_counter()
+    titles, seqs, lengths = [], [], [np.zeros(1, dtype=np.int64)]
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for rangeStart, rangeEnd in ranges:
+            blockTitles, seq, seqLengths = parse_fasta_block(np.frombuffer(mm, dtype=np.uint8, count=rangeEnd - rangeStart, offset=rangeStart))
+            titles.extend(blockTitles)
+            seqs.append(seq)
+            lengths.append(seqLengths)
+    store = TranscriptStore.from_fasta(titles, np.concatenate(seqs) if seqs else np.zeros(0, dtype=np.uint8), np.cumsum(np.concatenate(lengths)))
+    seconds = time.perf_counter() - start
+    if timed:
+        return store, seconds
+    if STATS is not None:
+        STATS.add_time("read_fasta", seconds, len(store))
+    return store
+
+
+def parse_fasta_block(data):
+    """Parse whole FASTA records (a uint8 array starting at a ">") with array operations: the header lines, line ends and spaces are masked out of the sequences.
+
+    Return: The headers (strings), the packed sequences (a copy) and the length of each sequence."""
+    # The line ends, carriage returns and spaces (not in the sequences, as SimpleFastaParser) in one pass.
+    blanks = np.flatnonzero(data <= ord(" "))
+    blanks = blanks[data[blanks] != ord("\t")]
+    newlines = blanks[data[blanks] == ord("\n")]
+    nextLine = newlines[newlines + 1 < len(data)] + 1
+    recStarts = np.concatenate(([0] if len(data) and data[0] == ord(">") else [], nextLine[data[nextLine] == ord(">")])).astype(np.int64)
+    # The header ends at the first new line after the ">" (or at the end of the data).
+    headerEnds = np.append(newlines, len(data))[np.searchsorted(newlines, recStarts)]
+    recEnds = np.append(recStarts[1:], len(data))
+    # The sequence lengths are the bytes after the header less the blanks.
+    nBlanks = np.searchsorted(blanks, recEnds) - np.searchsorted(blanks, headerEnds)
+    lengths = recEnds - headerEnds - nBlanks
+    # The positions of the header bytes (aranges over the headers).
+    headerLens = headerEnds - recStarts
+    headerPos = np.arange(int(headerLens.sum()), dtype=np.int64) + np.repeat(recStarts - np.concatenate(([0], np.cumsum(headerLens)[:-1])), headerLens)
+    keep = np.ones(len(data), dtype=bool)
+    keep[blanks] = False
+    keep[headerPos] = False
+    titles = [data[start + 1:end].tobytes().decode("ascii").rstrip() for start, end in zip(recStarts.tolist(), headerEnds.tolist())]
+    return titles, data[keep], lengths
+
+
+def parse_fasta_headers(titles):
+    """Parse the headers of geneIDs2fasta.py FASTA records into columns, as parse_fasta_header does for one.
+
+    Each feature is found in all the headers by one regular expression, the headers are parsed one by one only if a feature is not once in each of them.
+    Return: A dictionary of lists, the transcript "id" and the features of FASTA_HEADER_KEYS ("" where missing)."""
+    text = "\n".join(titles)
+    columns = {"id": re.findall(r"(?m)^[ \t]*([^|\s]*)", text) if titles else []}
+    for key in FASTA_HEADER_KEYS:
+        values = re.findall(r"\|{}:([^|\n]*)(?=\|)".format(re.escape(key)), text)
+        if values and len(values) != len(titles):
+            feats = [parse_fasta_header(title) for title in titles]
+            return {key: [feat.get(key, "") for feat in feats] for key in ("id",) + FASTA_HEADER_KEYS}
+        columns[key] = values or [""] * len(titles)
+    return columns
+
+
+def string_column(values):
+    """Return: The values as a 1-D object array of Python strings."""
+    column = np.empty(len(values), dtype=object)
+    column[:] = [str(value) for value in values]
+    return column
+
+
+def pack_sequences(seqs):
+    """Pack a list of sequences (strings) into one contiguous uint8 buffer.
+
+    Return: The buffer and the offsets array of the sequences (the i-th sequence is buf[offsets[i]:offsets[i+1]])."""
+    buf = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum([len(seq) for seq in seqs], out=offsets[1:])
+    return buf, offsets
+
+
+def slice_bounds(start, stop, length):
+    """Vectorised Python slicing: turn seq[start:stop] into absolute (start, stop) positions, clipped as Python does.
+
+    Return: The start and stop arrays."""
+    start = np.where(start < 0, np.maximum(start + length, 0), np.minimum(start, length))
+    stop = np.where(stop < 0, np.maximum(stop + length, 0), np.minimum(stop, length))
+    return start, np.maximum(stop, start)
+
+
+def gc_cumsum(buf):
+    """Return the cumulative count of G+C in a packed buffer (prefixed by 0)."""
+    gcCum = np.zeros(len(buf) + 1, dtype=np.int32 if len(buf) < 2**31 else np.int64)
+    np.cumsum(GC_BYTES[buf], out=gcCum[1:])
+    return gcCum
+
+
+def segment_gc(gcCum, starts, ends):
+    """GC percentage of the buffer segments buf[starts[i]:ends[i]] (0 for an empty segment), as Bio.SeqUtils.GC does.
+
+    gcCum is the gc_cumsum of the buffer."""
+    lens = ends - starts
+    gc = (gcCum[ends] - gcCum[starts]) * 100.0
+    return np.divide(gc, lens, out=np.zeros(len(lens)), where=lens > 0)
+
+
+def feature_windows(length, cdnaStart, cdnaEnd, s=10, c=20):
+    """The UTR, CDS and Kozak windows of a batch of sequences, the same as the ones of get_5utr, get_3utr, get_coding and get_kozak.
+
+    Return: A dictionary of the "<region>_start"/"<region>_end" arrays, as positions relative to each sequence."""
+    windows = {"5pUTR": (0, cdnaStart - 1),
+               "3pUTR": (cdnaEnd, length),
+               "CDS": (cdnaStart - 1, cdnaEnd),
+               "Kozak": (np.maximum(cdnaStart - 1 - s, 0), cdnaStart + 2 + s),
+               "KozakContext": (np.maximum(cdnaStart - 1 - s - c, 0), cdnaStart + 2 + s + c)}
+    bounds = {}
+    for region, (start, stop) in windows.items():
+        start, stop = slice_bounds(np.broadcast_to(start, length.shape), stop, length)
+        bounds[region + "_start"] = start
+        bounds[region + "_end"] = stop
+    return bounds
+
+
+def batch_features(buf, offsets, cdnaStart, cdnaEnd, s=10, c=20, windows=None):
+    """Compute the sequence features of a batch of packed sequences (see pack_sequences) with NumPy.
+
+    windows: The feature_windows of the batch, computed if None.
+    Return: A dictionary of arrays, the lengths, the GCs (as percentages) and the "<region>_start"/"<region>_end" of the windows."""
+    length = np.diff(offsets)
+    bf = {"length": length}
+    bf.update(windows if windows is not None else feature_windows(length, cdnaStart, cdnaEnd, s, c))
+    bf["5pUTR_len"] = bf["5pUTR_end"] - bf["5pUTR_start"]
+    bf["3pUTR_len"] = bf["3pUTR_end"] - bf["3pUTR_start"]
+    gcCum = gc_cumsum(buf)
+    bf["GC"] = segment_gc(gcCum, offsets[:-1], offsets[1:])
+    bf["5pUTR_GC"] = segment_gc(gcCum, offsets[:-1] + bf["5pUTR_start"], offsets[:-1] + bf["5pUTR_end"])
+    bf["3pUTR_GC"] = segment_gc(gcCum, offsets[:-1] + bf["3pUTR_start"], offsets[:-1] + bf["3pUTR_end"])
+    return bf
+
+
 def get_kozak(rec, s=10, c=20):
     """Extract both Kozak sequence and context from a SeqIO record.
     (s and c define the extremeties of a Koxak sequence and are chosen by convention.)
@@ -338,7 +2311,7 @@ def get_3utr(rec, tf3p, lim):
         tf3p.write(">{}_3PUTR\n{}\n".format(rec.id, utr3p))
     else:
         tf3p.write(">{}_3PUTR\n{}\n".format(rec.id, "N"))
-    return(utr3plen, GC(utr3p))
+    return(utr3plen, SeqUtils.GC(utr3p))
 
 
 def get_5utr(rec, tf5p):
@@ -350,7 +2323,7 @@ def get_5utr(rec, tf5p):
         tf5p.write(">{}_5PUTR\n{}\n".format(rec.id, utr5p))
     else:
         tf5p.write(">{}_5PUTR\n{}\n".format(rec.id, "N"))
-    return(len(utr5p), GC(utr5p))
+    return(len(utr5p), SeqUtils.GC(utr5p))
 
 
 def get_coding(rec, codf):
@@ -364,71 +2337,507 @@ def get_coding(rec, codf):
     codf.write(">{}_CDS\n{}\n".format(rec.id, cds))
 
 
-def calculate_free_energy(ffile, col):
+def fasta_sequences(ffile, suffixLen=0):
+    """Return: The (id, sequence) tuples of a fasta file, without the last <suffixLen> characters of the ids (e.g. _5PUTR), or ffile itself if it is already a list."""
+    if not isinstance(ffile, str):
+        return ffile
+    return [(rec.id[0:len(rec.id) - suffixLen], str(rec.seq)) for rec in SeqIO.parse(ffile, "fasta")]
+
+
+def calculate_free_energy(ffile, col, workers=1, pool=None, cache=None, span=None, maxLength=None, prefix=""):
     """Method to perform the free energy calculation by RNAfold and parsing of the results.
 
+    ffile: A list of (id, sequence) tuples, or a UTR fasta file (the ids end with the _5PUTR/_3PUTR suffix).
+    The sequences are folded in length balanced batches over <workers> RNAfold processes (see fold_sequences), sequences found in the cache are not folded again.
+    span: Fold with base pairs of at most span nt apart (RNAfold --maxBPspan), in a time linear in the length of the sequences instead of cubic.
+    maxLength: The sequences longer than maxLength nt are not folded, their MFE is NaN.
+    Return: A data frame with the MFE and the MFE per nucleotide of each sequence (<col>_<prefix>MFE and <col>_<prefix>MfeBP).
     Needs the RNA Vienna package to be installed."""
-    pdf = pd.DataFrame(columns=['{}_MFE'.format(col), '{}_MfeBP'.format(col)])
-    cmd = 'RNAfold --verbose --noPS --jobs -i {}'.format(ffile)
-    proc = subprocess.check_output(shlex.split(cmd))
-    proc = proc.decode()  # Convert it to proper string.
-    outList = proc.splitlines()  # Retrieve STDOUT.
-    for i in range(0, len(outList), 3):
-        idt = outList[i][1:-6]  # To exclude the _UTR suffix.
-        seq = outList[i+1]
-        fold = outList[i+2]
-        mfeRE = re.compile(r"[-+]?\d*\.\d+|\d+")
-        mfe = float(mfeRE.search(fold).group())
-        mfeBp = mfe / float(len(seq))
-        pdf.loc[idt] = [mfe, mfeBp]
+    seqs = fasta_sequences(ffile, 6)  # To exclude the _UTR suffix.
+    mfes = [None] * len(seqs)
+    indices = [i for i, (_, seq) in enumerate(seqs) if maxLength is None or len(seq) <= maxLength]
+    with stats_stage("{}free_energy_{}".format(prefix + "_" if prefix else "", col), len(indices)):
+        if indices:
+            foldedMfes = cached_call(cache, "RNAfold", rnafold_params(span), [seqs[i][1] for i in indices], lambda ss: fold_sequences(list(enumerate(ss)), workers, pool, span))
+            for i, mfe in zip(indices, foldedMfes):
+                mfes[i] = mfe
+    if len(indices) < len(seqs):
+        print("{} {} longer than {} nt not folded in full.".format(len(seqs) - len(indices), col, maxLength), file=sys.stderr)
+    pdf = pd.DataFrame({'{}_{}MFE'.format(col, prefix): mfes}, index=[idt for idt, _ in seqs], dtype=float)
+    pdf['{}_{}MfeBP'.format(col, prefix)] = pdf['{}_{}MFE'.format(col, prefix)] / [float(len(seq)) for _, seq in seqs]
     return pdf
 
 
-def calculate_local_score(file, scoring, cliping):
+def calculate_window_free_energy(ffile, col, window=FOLD_WINDOW, step=None, span=FOLD_MAX_BP_SPAN, workers=1, pool=None, cache=None):
+    """Fold sliding windows of the sequences with a maximum base pair span (as RNAplfold does) and summarise their MFE per nucleotide.
+
+    Each sequence is cut in windows of <window> nt every <step> nt (window // 3 by default), the last one ending at the end of the sequence, a sequence shorter than the window is one window.
+    The cost is linear in the length of the sequences, the windows are folded and cached as the sequences of calculate_free_energy.
+    Return: A data frame with the mean and the minimum of the MFE per nucleotide of the windows of each sequence (<col>_winMfeBP_mean and <col>_winMfeBP_min)."""
+    seqs = fasta_sequences(ffile, 6)  # To exclude the _UTR suffix.
+    owners, bounds = sliding_windows([len(seq) for _, seq in seqs], window, step or max(window // 3, 1))
+    winSeqs = [seqs[o][1][start:end] for o, (start, end) in zip(owners.tolist(), bounds.tolist())]
+    with stats_stage("window_free_energy_{}".format(col), len(winSeqs)):
+        mfes = cached_call(cache, "RNAfold", rnafold_params(span), winSeqs, lambda ss: fold_sequences(list(enumerate(ss)), workers, pool, span))
+    perNt = np.array(mfes, dtype=float) / np.maximum(bounds[:, 1] - bounds[:, 0], 1)
+    counts = np.bincount(owners, minlength=len(seqs))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(owners, weights=perNt, minlength=len(seqs)) / counts
+    low = np.full(len(seqs), np.nan)
+    if len(owners):
+        # The windows of a sequence are contiguous.
+        firsts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        low[owners[firsts]] = np.minimum.reduceat(perNt, firsts)
+    return pd.DataFrame({'{}_winMfeBP_mean'.format(col): mean, '{}_winMfeBP_min'.format(col): low}, index=[idt for idt, _ in seqs])
+
+
+def sliding_windows(lengths, window, step):
+    """Cut sequences of the given lengths in sliding windows (see calculate_window_free_energy), the empty sequences have none.
+
+    Return: The index of the sequence of each window and the (start, end) array of the windows."""
+    owners = []
+    bounds = []
+    for i, length in enumerate(lengths):
+        if length <= window:
+            starts = [0] if length else []
+        else:
+            starts = list(range(0, length - window + 1, step))
+            if starts[-1] != length - window:
+                starts.append(length - window)
+        owners.extend([i] * len(starts))
+        bounds.extend((start, min(start + window, length)) for start in starts)
+    return np.array(owners, dtype=np.int64), np.array(bounds, dtype=np.int64).reshape(-1, 2)
+
+
+def rnafold_params(span=None):
+    """Return: The parameters of RNAfold keying its cached results, with the maximum base pair span if any."""
+    params = {"version": rnafold_version(), "options": "--noPS"}
+    if span:
+        params["options"] += " --maxBPspan={}".format(span)
+    return params
+
+
+def fold_sequences(seqs, workers=1, pool=None, span=None):
+    """Fold a list of (id, sequence) tuples with RNAfold.
+
+    With a single worker all the sequences go to one RNAfold process which is multi-threaded by itself (--jobs), the pool is not used.
+    Otherwise the sequences are sharded into length balanced batches that run on a pool of <workers> threads, each driving its own RNAfold process. A ThreadPoolExecutor can be passed as <pool> to share the workers between several calls.
+    span: The maximum base pair span (RNAfold --maxBPspan), or None for none.
+
+    Return: A list of the MFEs in the input order."""
+    if not seqs:
+        return []
+    if workers <= 1:
+        return run_rnafold(seqs, jobs=True, span=span)
+    batches = fold_batches(seqs, workers, span=span)
+    mfes = [None] * len(seqs)
+    ownPool = pool is None
+    if ownPool:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(run_rnafold, [seqs[i] for i in batch], len(batches) == 1, span): batch for batch in batches}
+        # Stream the results back in the input order as soon as each batch is done.
+        for fut in as_completed(futures):
+            for i, mfe in zip(futures[fut], fut.result()):
+                mfes[i] = mfe
+    finally:
+        if ownPool:
+            pool.shutdown()
+    return mfes
+
+
+def fold_batches(seqs, workers, perWorker=4, span=None):
+    """Shard a list of (id, sequence) tuples into length balanced batches.
+
+    The folding cost grows with the cube of the sequence length (length * span**2 with a maximum base pair span), so the longest sequences are dealt first, each to the least loaded batch (LPT scheduling). There are <perWorker> batches per worker to even out the load.
+
+    Return: A list of batches, each a sorted list of indices in seqs."""
+    nBatches = min(len(seqs), max(1, workers * perWorker))
+    heap = [(0, b) for b in range(nBatches)]
+    batches = [[] for _ in range(nBatches)]
+    for i in sorted(range(len(seqs)), key=lambda i: len(seqs[i][1]), reverse=True):
+        load, b = heapq.heappop(heap)
+        batches[b].append(i)
+        length = len(seqs[i][1])
+        heapq.heappush(heap, (load + length * min(length, span or length) ** 2, b))
+    return [sorted(batch) for batch in batches if batch]
+
+
+def run_rnafold(seqs, jobs=False, span=None):
+    """Run one RNAfold process on a list of (id, sequence) tuples streamed through STDIN (see iter_rnafold).
+
+    Return: A list of the MFEs in the input order."""
+    mfes = list(iter_rnafold(seqs, jobs, span))
+    if len(mfes) != len(seqs):
+        raise RuntimeError("RNAfold returned {} structures for {} sequences.".format(len(mfes), len(seqs)))
+    return mfes
+
+
+def iter_rnafold(seqs, jobs=False, span=None):
+    """Fold an iterable of (id, sequence) tuples with one RNAfold process, over pipes and without files.
+
+    A thread writes the sequences to STDIN while the structures are parsed from STDOUT as they come, neither the input nor the output are held as a whole (the pipes are bounded by the OS buffers).
+    span: The maximum base pair span (RNAfold --maxBPspan), or None for none.
+    Return: A generator of the MFEs in the input order."""
+    cmd = ['RNAfold', '--verbose', '--noPS']
+    if jobs:
+        cmd.append('--jobs')
+    if span:
+        cmd.append('--maxBPspan={}'.format(span))
+    start = time.perf_counter()
+    nFolded = 0
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+
+    def feed():
+        try:
+            for idt, seq in seqs:
+                proc.stdin.write(">{}\n{}\n".format(idt, seq))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass  # RNAfold stopped, its return code tells why.
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    mfeRE = re.compile(r"[-+]?\d*\.\d+|\d+")
+    try:
+        # Each result is 3 lines: the header, the sequence and the structure with the MFE.
+        for i, line in enumerate(proc.stdout):
+            if i % 3 == 2:
+                nFolded += 1
+                yield float(mfeRE.search(line).group())
+    finally:
+        proc.stdout.close()
+        feeder.join()
+        retcode = proc.wait()
+        if STATS is not None:
+            STATS.add_time("rnafold_process", time.perf_counter() - start, nFolded)
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, cmd)
+
+
+@functools.lru_cache(maxsize=None)
+def rnafold_version():
+    """Return the version string of the installed RNAfold (it keys the cached folding results)."""
+    proc = subprocess.run(['RNAfold', '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    return proc.stdout.strip()
+
+
+def cached_call(cache, tool, params, seqs, func):
+    """Apply func to a list of sequences, only for the sequences whose result is not already in the cache.
+
+    func takes a list of sequences and returns the list of their results, which are then stored in the cache.
+    seqs can also be (buf, starts, ends) segments of a packed buffer (see as_segments), func is then given the segments of the missing sequences.
+    Return: A list of the results in the input order."""
+    if cache is None:
+        return func(seqs)
+    segments = seqs if isinstance(seqs, tuple) else None
+    if segments is not None:
+        buf, starts, ends = segments
+        seqs = [buf[start:end].tobytes() for start, end in zip(starts.tolist(), ends.tolist())]
+    values = cache.get_many(tool, params, seqs)
+    missing = [i for i, value in enumerate(values) if value is None]
+    stats_count("cache_hits_{}".format(tool), len(seqs) - len(missing))
+    stats_count("cache_misses_{}".format(tool), len(missing))
+    if missing:
+        computed = func([seqs[i] for i in missing] if segments is None else (buf, starts[missing], ends[missing]))
+        for i, value in zip(missing, computed):
+            values[i] = value
+        cache.put_many(tool, params, [seqs[i] for i in missing], computed)
+    return values
+
+
+def calculate_local_score(file, scoring, cliping, cache=None):
     """Calculate the local score for a given scoring functionself.
 
-    Here we use a scoring for TOP mRNAs and we clip at 50nts."""
-    lsdf = pd.DataFrame(columns=["TOP_localScore"])
-    for seq in SeqIO.parse(file, "fasta"):
-        lss = local_score.local_score(seq.seq, scoring, cliping)
-        ls = max(lss)
-        idt = seq.id[0:-6]  # To exclude the _UTR suffix.
-        lsdf.loc[idt] = [ls]
+    Here we use a scoring for TOP mRNAs and we clip at 50nts.
+    file: A list of (id, sequence) tuples, a UTR fasta file, or the ids and segments of the sequences (see sequence_segments)."""
+    ids, segments = sequence_segments(file, 6)  # To exclude the _UTR suffix.
+    params = {"engine": "lindley", "scoring": scoring, "clip": cliping}
+    with stats_stage("local_score", len(ids)):
+        lss = cached_call(cache, "localScore", params, segments, lambda segs: local_score_batch(segs, scoring, cliping).tolist())
+    lsdf = pd.DataFrame({"TOP_localScore": lss}, index=ids)
     return lsdf
 
 
-def calculate_CAI(file):
-    """Calculate the Codon Adaptation Index."""
-    caidf = pd.DataFrame(columns=["CAI"])
-    SeqCai = CodonUsage.CodonAdaptationIndex()
-    # This is a hardcoded dictionary of Human Codon Usage.
-    # TODO add the dictionary as an extrenal file.
-    cd = {'TGT': 0.8702111503037429, 'TGC': 1.0, 'GAT': 0.8919495548736023, 'GAC': 1.0, 'TCT': 0.7949052866841392, 'TCG': 0.22194237466812908, 'TCA': 0.6751176840795687, 'TCC': 0.9325302290137666, 'AGC': 1.0, 'AGT': 0.6446166000591615, 'CAA': 0.36557721064940213, 'CAG': 1.0, 'ATG': 1.0, 'AAC': 1.0, 'AAT': 0.9167950453806337, 'CCT': 0.9598027851341862, 'CCG': 0.3423870541180509, 'CCA': 0.8954468700782404, 'CCC': 1.0, 'AAG': 1.0, 'AAA': 0.7820458110744462, 'TAG': 0.39839601407311903, 'TGA': 1.0, 'TAA': 0.4993990515941522, 'ACC': 1.0, 'ACA': 0.8243839054123085, 'ACG': 0.3079245460812466, 'ACT': 0.6988042631910452, 'TTT': 0.8810552718261763, 'TTC': 1.0, 'GCA': 0.6052034041191565, 'GCC': 1.0, 'GCG': 0.2529539023333213, 'GCT': 0.6818593783377271, 'GGT': 0.5201125620871452, 'GGG': 0.7639857828207199, 'GGA': 0.7931219592131955, 'GGC': 1.0, 'ATC': 1.0, 'ATA': 0.37077941502861167, 'ATT': 0.7888742533460711, 'TTA': 0.20061570678529916, 'TTG': 0.33545687046611355, 'CTC': 0.49199681375495974, 'CTT': 0.36116788906256264, 'CTG': 1.0, 'CTA': 0.1842292142599495, 'CAT': 0.7411430218961734, 'CAC': 1.0, 'CGA': 0.5186182319761956, 'CGC': 0.7978946422396193, 'CGG': 0.9315700115466449, 'CGT': 0.3788960157237558, 'AGG': 0.9686853431854282, 'AGA': 1.0, 'TGG': 1.0, 'GTA': 0.26778952716201065, 'GTC': 0.5314909271801801, 'GTG': 1.0, 'GTT': 0.40739620258411974, 'GAG': 1.0, 'GAA': 0.7605787579698675, 'TAT': 0.8258415992012675, 'TAC': 1.0}
-    SeqCai.set_cai_index(cd)
-    for seq in SeqIO.parse(file, "fasta"):
-        cai = SeqCai.cai_for_gene(str(seq.seq))
-        idt = seq.id[0:-4]  # To exclude the _Coding suffix.
-        caidf.loc[idt] = [cai]
+def sequence_segments(file, suffixLen=0):
+    """Return: The ids and the (buf, starts, ends) segments of the sequences of a fasta file or of a list of (id, sequence) tuples (see fasta_sequences), or file itself if it is already (ids, segments)."""
+    if isinstance(file, tuple):
+        return file
+    recs = fasta_sequences(file, suffixLen)
+    return [idt for idt, _ in recs], as_segments([seq for _, seq in recs])
+
+
+def as_segments(seqs):
+    """Return the (buf, starts, ends) segments of either a list of sequences (that are packed) or of an already packed (buf, starts, ends) tuple."""
+    if isinstance(seqs, tuple):
+        return seqs
+    buf, offsets = pack_sequences(seqs)
+    return buf, offsets[:-1], offsets[1:]
+
+
+def local_score_batch(seqs, scoring, clip=None, blockSize=2**22):
+    """Calculate the local score of many sequences for a scoring dictionary.
+
+    The local score is the maximum of the Lindley process U_i = max(0, U_(i-1) + score(x_i)), U_0 = 0, over the first <clip> nucleotides of a sequence (all of them if clip is None).
+    It is computed as max_i(S_i - min_(j<=i) S_j) where S are the cumulative sums of the scores, for blocks of sequences at once (about blockSize nucleotides per block).
+    Letters missing from the scoring dictionary score 0.
+
+    seqs: A list of sequences or a (buf, starts, ends) tuple of segments of a packed buffer (see pack_sequences).
+    Return: A NumPy array of the local scores."""
+    buf, starts, ends = as_segments(seqs)
+    values = np.array(list(scoring.values()))
+    lut = np.zeros(256, dtype=values.dtype)
+    for letter, score in scoring.items():
+        lut[ord(letter.upper())] = score
+        lut[ord(letter.lower())] = score
+    lens = ends - starts
+    if clip is not None:
+        lens = np.minimum(lens, clip)
+    scores = np.zeros(len(starts), dtype=values.dtype)
+    if not len(starts) or not lens.max():
+        return scores
+    width = int(lens.max())
+    cols = np.arange(width)
+    step = max(1, blockSize // width)
+    for b in range(0, len(starts), step):
+        pos = starts[b:b+step, None] + cols
+        valid = cols < lens[b:b+step, None]
+        # Scores of each position, 0 past the end of the sequence (which does not change the maximum).
+        x = np.where(valid, lut[buf[np.where(valid, pos, 0)]], 0)
+        cum = np.zeros((len(x), width + 1), dtype=x.dtype)
+        np.cumsum(x, axis=1, out=cum[:, 1:])
+        scores[b:b+step] = (cum - np.minimum.accumulate(cum, axis=1)).max(axis=1)
+    return scores
+
+
+# This is a hardcoded dictionary of Human Codon Usage (the default codon table), other tables are loaded from files (see load_codon_index).
+HUMAN_CODON_INDEX = {'TGT': 0.8702111503037429, 'TGC': 1.0, 'GAT': 0.8919495548736023, 'GAC': 1.0, 'TCT': 0.7949052866841392, 'TCG': 0.22194237466812908, 'TCA': 0.6751176840795687, 'TCC': 0.9325302290137666, 'AGC': 1.0, 'AGT': 0.6446166000591615, 'CAA': 0.36557721064940213, 'CAG': 1.0, 'ATG': 1.0, 'AAC': 1.0, 'AAT': 0.9167950453806337, 'CCT': 0.9598027851341862, 'CCG': 0.3423870541180509, 'CCA': 0.8954468700782404, 'CCC': 1.0, 'AAG': 1.0, 'AAA': 0.7820458110744462, 'TAG': 0.39839601407311903, 'TGA': 1.0, 'TAA': 0.4993990515941522, 'ACC': 1.0, 'ACA': 0.8243839054123085, 'ACG': 0.3079245460812466, 'ACT': 0.6988042631910452, 'TTT': 0.8810552718261763, 'TTC': 1.0, 'GCA': 0.6052034041191565, 'GCC': 1.0, 'GCG': 0.2529539023333213, 'GCT': 0.6818593783377271, 'GGT': 0.5201125620871452, 'GGG': 0.7639857828207199, 'GGA': 0.7931219592131955, 'GGC': 1.0, 'ATC': 1.0, 'ATA': 0.37077941502861167, 'ATT': 0.7888742533460711, 'TTA': 0.20061570678529916, 'TTG': 0.33545687046611355, 'CTC': 0.49199681375495974, 'CTT': 0.36116788906256264, 'CTG': 1.0, 'CTA': 0.1842292142599495, 'CAT': 0.7411430218961734, 'CAC': 1.0, 'CGA': 0.5186182319761956, 'CGC': 0.7978946422396193, 'CGG': 0.9315700115466449, 'CGT': 0.3788960157237558, 'AGG': 0.9686853431854282, 'AGA': 1.0, 'TGG': 1.0, 'GTA': 0.26778952716201065, 'GTC': 0.5314909271801801, 'GTG': 1.0, 'GTT': 0.40739620258411974, 'GAG': 1.0, 'GAA': 0.7605787579698675, 'TAT': 0.8258415992012675, 'TAC': 1.0}
+
+# Directories of the codon table files, named after their ENSEMBL dataset (<dataset>.tsv): in the source tree and where setup.py installs them.
+CODON_TABLES_DIRS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "codon_tables"), os.path.join(sys.prefix, "share", "rnaFeaturesLib", "codon_tables")]
+
+# Encoding of the nucleotides to 0-3 (4 for anything else), a codon is encoded as 16*b1 + 4*b2 + b3.
+NUC_CODES = np.full(256, 4, dtype=np.int64)
+for _code, _letters in enumerate(["Aa", "Cc", "Gg", "TtUu"]):
+    NUC_CODES[[ord(l) for l in _letters]] = _code
+
+
+def load_codon_index(table="hsapiens_gene_ensembl"):
+    """Load a codon adaptation index (the relative adaptiveness of each codon).
+
+    table: Either a path to a tab separated file with a codon and its weight per line, or an ENSEMBL dataset name (as in geneIDs2fasta.py --dataset) with a file <dataset>.tsv in one of CODON_TABLES_DIRS. The human index is built in.
+    Return: A dictionary of codon: weight."""
+    if os.path.isfile(table):
+        path = table
+    elif table == "hsapiens_gene_ensembl":
+        return dict(HUMAN_CODON_INDEX)
+    else:
+        paths = [os.path.join(directory, "{}.tsv".format(table)) for directory in CODON_TABLES_DIRS]
+        path = next((path for path in paths if os.path.isfile(path)), None)
+        if path is None:
+            raise ValueError("No codon table file or codon table for the dataset: {}, the datasets with a codon table are {}. Give a codon table file with --codon-table.".format(table, ", ".join(codon_table_datasets())))
+    return dict(read_codon_table(os.path.abspath(path), os.stat(path).st_mtime_ns))
+
+
+def codon_index_hash(codonIndex):
+    """Return: A hash of the weights of a codon index (they key the record hashes of the CAI, see features_params)."""
+    return hashlib.sha1(json.dumps(codonIndex, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def codon_table_datasets():
+    """Return: The sorted ENSEMBL datasets with a codon table (built in or in CODON_TABLES_DIRS)."""
+    datasets = {"hsapiens_gene_ensembl"}
+    for directory in CODON_TABLES_DIRS:
+        if os.path.isdir(directory):
+            datasets.update(name[:-4] for name in os.listdir(directory) if name.endswith(".tsv"))
+    return sorted(datasets)
+
+
+def codon_table(options, dataset=None):
+    """Return: The codon table of the CAI, options.codonTable if set, else the table of the dataset of the gene IDs if any, else the human one."""
+    return getattr(options, "codonTable", None) or dataset or "hsapiens_gene_ensembl"
+
+
+@functools.lru_cache(maxsize=None)
+def read_codon_table(path, mtime=None):
+    """Read a codon table file once per path and modification time (a long-running server reads it again only if it changed).
+
+    Return: A tuple of (codon, weight)."""
+    index = {}
+    with open(path) as cf:
+        for line in cf:
+            if line.strip() and not line.startswith("#"):
+                codon, weight = line.split()[:2]
+                index[codon.upper().replace("U", "T")] = float(weight)
+    return tuple(index.items())
+
+
+def codon_log_weights(index):
+    """Precompute the table of the log weights of the 64 codons of a codon index, by codon code (see NUC_CODES).
+
+    As in Bio.SeqUtils.CodonUsage, ATG and TGG are excluded (NaN) as well as the codons missing from the index. The 65th entry (NaN) is for codons with other letters.
+    Return: A NumPy array of 65 log weights."""
+    logWeights = np.full(65, np.nan)
+    for codon, weight in index.items():
+        if codon not in ["ATG", "TGG"]:
+            b1, b2, b3 = NUC_CODES[[ord(l) for l in codon]]
+            logWeights[16 * b1 + 4 * b2 + b3] = math.log(weight)
+    return logWeights
+
+
+def cai_batch(seqs, logWeights):
+    """Calculate the Codon Adaptation Index of many coding sequences in one vectorised pass.
+
+    Codons are encoded as integers 0-63 straight from the packed buffer and their log weights summed per sequence. Incomplete trailing codons and codons without a weight are skipped.
+    The mean is taken over (number of codons - 1) to give the same values as Bio.SeqUtils.CodonUsage.
+    Bio.SeqUtils.CodonUsage raised on the codons with other letters than ACGT (e.g. N) and on the incomplete trailing codons: they are skipped here,
+    counted in the cai_ambiguous_codons and cai_partial_codons counters of the run statistics, and the ambiguous ones are reported.
+
+    seqs: A list of sequences or a (buf, starts, ends) tuple of segments of a packed buffer (see pack_sequences).
+    logWeights: The table of codon_log_weights.
+    Return: A NumPy array of the CAIs (NaN with less than two codons)."""
+    buf, starts, ends = as_segments(seqs)
+    nCodons = (ends - starts) // 3
+    seg = np.repeat(np.arange(len(starts)), nCodons)
+    # Position of the first nucleotide of each codon.
+    first = np.zeros(len(starts), dtype=np.int64)
+    np.cumsum(nCodons[:-1], out=first[1:])
+    pos = np.repeat(starts, nCodons) + 3 * (np.arange(len(seg)) - np.repeat(first, nCodons))
+    nucs = NUC_CODES[buf[np.stack([pos, pos + 1, pos + 2])]]
+    codes = np.where((nucs < 4).all(axis=0), 16 * nucs[0] + 4 * nucs[1] + nucs[2], 64)
+    nAmbiguous = int((codes == 64).sum())
+    stats_count("cai_ambiguous_codons", nAmbiguous)
+    stats_count("cai_partial_codons", int(((ends - starts) % 3 != 0).sum()))
+    if nAmbiguous:
+        print("{} codons with other letters than ACGT are skipped by the CAI.".format(nAmbiguous), file=sys.stderr)
+    weights = logWeights[codes]
+    valid = ~np.isnan(weights)
+    total = np.bincount(seg, weights=np.where(valid, weights, 0.0), minlength=len(starts))
+    count = np.bincount(seg, weights=valid, minlength=len(starts))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 1, np.exp(total / (count - 1)), np.nan)
+
+
+def calculate_CAI(file, cache=None, codonIndex=HUMAN_CODON_INDEX):
+    """Calculate the Codon Adaptation Index.
+
+    file: A list of (id, sequence) tuples, a coding sequences fasta file, or the ids and segments of the sequences (see sequence_segments)."""
+    ids, segments = sequence_segments(file, 4)  # To exclude the _CDS suffix.
+    params = {"engine": "vectorised", "index": codonIndex}
+    logWeights = codon_log_weights(codonIndex)
+    with stats_stage("CAI", len(ids)):
+        cais = cached_call(cache, "CAI", params, segments, lambda segs: cai_batch(segs, logWeights).tolist())
+    caidf = pd.DataFrame({"CAI": cais}, index=ids)
     return caidf
 
 
-def predict_binding(ffile, motifs):
-    """Method to run a FIMO search and parse and collect the results.
-
-    Requires the intallation of the MEME suite."""
-    # TODO implement the method!!!
-    subprocess.call('fimo --verbosity 1 ' + motifs + ' ' + ffile.name, shell=True)
-    fimo_tab = pd.read_csv("fimo_out/fimo.tsv", sep="\t")
-    fimo_tab = fimo_tab.reset_index(drop=True)
-    return None
-
-
-def txt2fasta(cdna_feat_table, fastaOut):
-    """Write the ENSEMBL features to a fasta file with the appropriate first fasta line."""
-    with fastaOut as ff:
-        for i, r in cdna_feat_table.iterrows():
-            ff.write(">{} |GeneID:{}|GeneName:{}|cDNA_start:{}|cDNA_end:{}|TSL:{}|APPRIS:{}|Source:{}|{}\n".format(i, r["Gene stable ID"], r["Gene name"], r["cDNA coding start"], r["cDNA coding end"], r["Transcript support level (TSL)"], r["APPRIS annotation"], r["Source (transcript)"], r["Gene description"]))
-            ff.write("{}\n".format(r["cDNA sequences"]))
+def read_meme_motifs(path):
+    """Read the motifs of a MEME format file (MEME, DREME, STREME, the MEME databases of RNA binding proteins...), with a DNA or RNA alphabet.
+
+    The background letter frequencies of the file are used, uniform if there are none.
+    Return: A list of Motif."""
+    with open(path) as fh:
+        lines = fh.read().splitlines()
+    motifs = []
+    background = np.full(4, 0.25)
+    name = None
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if line.startswith("ALPHABET") and not any(a in line.upper() for a in ("ACGT", "ACGU", "DNA", "RNA")):
+            raise ValueError("Only DNA and RNA motifs can be scanned, not the alphabet of {}: {}".format(path, line))
+        if line.startswith("Background letter frequencies"):
+            values = []
+            while i + 1 < len(lines) and lines[i + 1].strip() and len(values) < 8:
+                i += 1
+                values += lines[i].split()
+            freqs = {letter.upper().replace("U", "T"): float(value) for letter, value in zip(values[0::2], values[1::2])}
+            background = np.array([freqs.get(letter, 0.25) for letter in "ACGT"])
+            background /= background.sum()
+        elif line.startswith("MOTIF"):
+            name = line.split()[1]
+        elif line.startswith("letter-probability matrix"):
+            fields = dict(re.findall(r"(\S+)=\s*(\S+)", line))
+            width = int(fields["w"])
+            probs = np.array([[float(x) for x in lines[i + 1 + r].split()] for r in range(width)])
+            if probs.shape[1] != 4:
+                raise ValueError("The motif {} of {} does not have 4 letters.".format(name, path))
+            motifs.append(Motif(name, probs / probs.sum(axis=1, keepdims=True), background, float(fields.get("nsites", 20))))
+            i += width
+        i += 1
+    if not motifs:
+        raise ValueError("No motif found in {}.".format(path))
+    return motifs
+
+
+def motif_log_odds(motif, pseudocount=0.1):
+    """Return: The log-odds score matrix (in bits, width x ACGT) of a Motif, its probabilities with a pseudocount weighted by the background (as FIMO)."""
+    probs = (motif.probs * motif.nsites + pseudocount * motif.background) / (motif.nsites + pseudocount)
+    return np.log2(probs / motif.background)
+
+
+def motif_score_pvalues(intScores, background):
+    """Compute the exact distribution of the integer scores of a motif over random sequences of the background, by dynamic programming over its columns.
+
+    intScores: The integer score matrix (width x ACGT), of non negative scores.
+    Return: A NumPy array of the p-values P(score >= s) for each score s from 0 to the maximum score."""
+    dist = np.ones(1)
+    for col in intScores:
+        new = np.zeros(len(dist) + col.max())
+        for score, freq in zip(col, background):
+            new[score:score + len(dist)] += freq * dist
+        dist = new
+    return np.minimum(np.cumsum(dist[::-1])[::-1], 1.0)
+
+
+@functools.lru_cache(maxsize=None)
+def load_motif_scanner(path, pvalue=1e-4):
+    """Return: The MotifScanner of the motifs of a MEME file (built once per file and p-value)."""
+    return MotifScanner(read_meme_motifs(path), pvalue)
+
+
+def motif_columns(options):
+    """Return: The columns of the motifs of options.motifs in the features' table (the number of hits and the best score of each motif in each region of options.motifRegions), none without motifs."""
+    if not getattr(options, "motifs", None):
+        return []
+    scanner = load_motif_scanner(options.motifs, getattr(options, "motifPvalue", 1e-4))
+    return ["{}_{}_{}".format(region, name, col) for region in getattr(options, "motifRegions", ["3pUTR"]) for name in scanner.names for col in ("hits", "best")]
+
+
+def predict_binding(ffile, motifs, col="3pUTR", pvalue=1e-4, cache=None):
+    """Scan motifs (e.g. of RNA binding proteins) over sequences, in process (see MotifScanner).
+
+    ffile: A list of (id, sequence) tuples, or a UTR fasta file (the ids end with the _5PUTR/_3PUTR suffix).
+    motifs: A MEME format motifs file or a MotifScanner.
+    Return: Pandas data frame with the number of hits (p-value below pvalue) and the best log-odds score of each motif, the columns are named <col>_<motif>_hits and <col>_<motif>_best."""
+    seqs = fasta_sequences(ffile, 6)  # To exclude the _UTR suffix.
+    scanner = motifs if isinstance(motifs, MotifScanner) else load_motif_scanner(motifs, pvalue)
+    params = {"motifs": scanner.names, "tables": hashlib.sha1(b"".join(t.tobytes() for tables in scanner.tables for t in tables)).hexdigest(), "thresholds": scanner.thresholds}
+
+    def scan(ss):
+        hits, best = scanner.scan(ss)
+        return [h + b for h, b in zip(hits.tolist(), best.tolist())]
+
+    with stats_stage("motifs_{}".format(col), len(seqs)):
+        values = cached_call(cache, "motifs", params, [seq for _, seq in seqs], scan)
+    nMotifs = len(scanner.names)
+    values = np.array(values, dtype=float).reshape(len(seqs), 2 * nMotifs)
+    columns = {}
+    for m, name in enumerate(scanner.names):
+        columns["{}_{}_hits".format(col, name)] = values[:, m].astype(np.int64)
+        columns["{}_{}_best".format(col, name)] = values[:, nMotifs + m]
+    return pd.DataFrame(columns, index=[idt for idt, _ in seqs])
+
+
+def txt2fasta(cdna_feat_table, fastaOut, close=True):
+    """Write the ENSEMBL features to a fasta file with the appropriate first fasta line.
+
+    The file is closed at the end, unless close=False (to append more tables to it)."""
+    for i, r in cdna_feat_table.iterrows():
+        fastaOut.write(">{} |GeneID:{}|GeneName:{}|cDNA_start:{}|cDNA_end:{}|TSL:{}|APPRIS:{}|Source:{}|{}\n".format(i, r["Gene stable ID"], r["Gene name"], r["cDNA coding start"], r["cDNA coding end"], r["Transcript support level (TSL)"], r["APPRIS annotation"], r["Source (transcript)"], r["Gene description"]))
+        fastaOut.write("{}\n".format(r["cDNA sequences"]))
+    if close:
+        fastaOut.close()
 
 
 def chunks(l, n):
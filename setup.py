@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import glob
 from distutils.core import setup
 
 import rnaFeaturesLib
@@ -14,9 +15,10 @@ config = {
   'long_description': open("README.md").read(),
   'download_url': 'https://github.com/parisepigenetics/rna_feat_ext.git',
   'py_modules': ['rnaFeaturesLib'],
-  'scripts': ['bin/fasta2table.py', 'bin/geneIDs2fasta.py'],
-  'requires': ['biomart', 'biopython', 'pandas', 'prettytable'],
+  'scripts': ['bin/fasta2table.py', 'bin/geneIDs2fasta.py', 'bin/geneIDs2table.py', 'bin/ensemblDump2store.py'],
+  'requires': ['requests', 'biopython', 'numpy', 'pandas', 'prettytable'],
   #'data_files': [('data', ['testRNAfeatExt_IDs.txt'])],
+  'data_files': [('share/rnaFeaturesLib/codon_tables', glob.glob('data/codon_tables/*.tsv'))],
   'license': 'GPL v3.0 or later',
   'classifiers': ['Programming Language :: Python', 'Topic :: Science :: Computational Biology'],
 }
@@ -0,0 +1,73 @@
+"""A local stand-in of the BioMart web service, to test the BioMart fetching without network.
+
+It answers the XML queries of BiomartFetcher with TSV responses (the display names of the attributes as header) from made up genes: each gene ID of the filter has two transcripts.
+Failures are injected on demand: the first <failFirst> queries get a 503, and the queries of more than <maxGenes> genes get a "Query ERROR" body (as BioMart does when it times out on a large query).
+"""
+
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree.ElementTree import fromstring
+
+import rnaFeaturesLib as rnalib
+
+
+def gene_rows(geneID, attributes):
+    """Return: The TSV rows of the made up transcripts of a gene."""
+    rows = []
+    for t in range(2):
+        values = {a: "{}_{}".format(a, geneID) for a in attributes}
+        values.update({"ensembl_gene_id": geneID, "ensembl_transcript_id": "{}T{}".format(geneID, t), "transcript_length": str(100 + t)})
+        rows.append("\t".join(values[a] for a in attributes))
+    return rows
+
+
+class BioMartHandler(BaseHTTPRequestHandler):
+    """Answer the BioMart queries (see the module doc)."""
+
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)["query"][0]
+        dataset = fromstring(query).find("Dataset")
+        ids = dataset.find("Filter").get("value").split(",")
+        attributes = [a.get("name") for a in dataset.findall("Attribute")]
+        with server.lock:
+            server.queries.append(ids)
+            fail = len(server.queries) <= server.failFirst
+        if server.delay:
+            time.sleep(server.delay(ids))
+        if fail:
+            self.reply(503, "Service Unavailable")
+        elif len(ids) > server.maxGenes:
+            self.reply(200, "Query ERROR: caught BioMart::Exception: too many genes")
+        else:
+            lines = ["\t".join(rnalib.BIOMART_COLUMNS[a] for a in attributes)] + [row for geneID in ids for row in gene_rows(geneID, attributes)]
+            self.reply(200, "\n".join(lines) + "\n")
+
+    def reply(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(failFirst=0, maxGenes=10**6, delay=None):
+    """Start a stand-in on a free local port, in a daemon thread.
+
+    delay: A function of the gene IDs of a query returning the seconds to wait before answering it (None for no wait).
+    Return: The server, its BioMart URL is server.url and the gene IDs of the queries received are in server.queries."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BioMartHandler)
+    server.daemon_threads = True
+    server.failFirst = failFirst
+    server.maxGenes = maxGenes
+    server.delay = delay
+    server.queries = []
+    server.lock = threading.Lock()
+    server.url = "http://127.0.0.1:{}/biomart/martservice".format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
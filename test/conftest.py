@@ -0,0 +1,28 @@
+"""Shared set up of the tests: the library and the benchmark modules are importable and the RNAfold stand-in of the benchmarks is first in the PATH."""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "bench")
+sys.path[:0] = [ROOT, BENCH]
+os.environ["PATH"] = BENCH + os.pathsep + os.environ.get("PATH", "")
+
+import synthTranscriptome  # noqa: E402
+
+
+def features_options(**kwargs):
+    """Return: The options of fasta2table.py with their default values, updated with kwargs."""
+    options = dict(utr3len=20000, utrFiles=None, clip=20, workers=1, codonTable="hsapiens_gene_ensembl", motifs=None, motifPvalue=1e-4, motifRegions=["3pUTR"],
+                   maxBPspan=100, spanAbove=None, foldWindow=None, foldStep=None, features=None, recordHash=False, cacheDir=None)
+    options.update(kwargs)
+    return SimpleNamespace(**options)
+
+
+@pytest.fixture(scope="session")
+def synth(tmp_path_factory):
+    """A small synthetic dataset (see synthTranscriptome.write_dataset), the paths of its files."""
+    return synthTranscriptome.write_dataset(str(tmp_path_factory.mktemp("synth") / "synth"), 300, seed=1)
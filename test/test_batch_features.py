@@ -0,0 +1,59 @@
+"""Tests of the batch NumPy kernel of the sequence features against the per-record functions it replaces (get_5utr, get_3utr, get_kozak and Bio.SeqUtils.GC)."""
+
+import io
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from Bio.Seq import Seq
+
+import rnaFeaturesLib as rnalib
+
+# (sequence, cDNA start, cDNA end): the edge cases and a few random records.
+EDGE_CASES = [
+    ("ATGAAACCCGGGTTTTAG" + "ACGT" * 10, 1, 18),      # Start at 1: empty 5'UTR, the Kozak windows start before the sequence.
+    ("CC" + "ATGAAATAG", 3, 11),                      # Empty 3'UTR and Kozak windows past both ends.
+    ("GGGCCATGGCCTAA", 6, 14),                        # A sequence shorter than the Kozak context.
+    ("acgtNNnsSgcATGgcgTAGnnnNacgu", 12, 20),         # N, S and lowercase bases.
+    ("NNNNNNNNNNATGNNNTAGNNNN", 11, 19),              # Only Ns around the CDS (GC of 0).
+    ("A" * 40 + "ATG" + "C" * 30 + "TAA", 41, 76),    # The Kozak windows inside the 5'UTR.
+]
+
+
+def random_cases(n, seed=0):
+    """Return: n random (sequence, cDNA start, cDNA end), with any letters and coordinates up to the ends."""
+    rnd = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        length = rnd.randint(3, 120)
+        seq = "".join(rnd.choice("ACGTacgtNS") for _ in range(length))
+        start = rnd.randint(1, length)
+        cases.append((seq, start, rnd.randint(start, length)))
+    return cases
+
+
+def per_record(seq, start, end):
+    """Return: The features of a record with the per-record functions."""
+    rec = SimpleNamespace(id="t", seq=Seq(seq), features={"cDNA_start": str(start), "cDNA_end": str(end)})
+    len5, gc5 = rnalib.get_5utr(rec, io.StringIO())
+    len3, gc3 = rnalib.get_3utr(rec, io.StringIO(), 10**6)
+    kozak, context = rnalib.get_kozak(rec)
+    return {"5pUTR_len": len5, "5pUTR_GC": gc5, "3pUTR_len": len3, "3pUTR_GC": gc3, "GC": rnalib.SeqUtils.GC(seq), "Kozak": kozak, "KozakContext": context}
+
+
+@pytest.mark.parametrize("cases", [EDGE_CASES, random_cases(500)], ids=["edge_cases", "random"])
+def test_batch_features_match_per_record_functions(cases):
+    seqs = [seq for seq, _, _ in cases]
+    buf, offsets = rnalib.pack_sequences(seqs)
+    cdnaStart = np.array([start for _, start, _ in cases])
+    cdnaEnd = np.array([end for _, _, end in cases])
+    bf = rnalib.batch_features(buf, offsets, cdnaStart, cdnaEnd)
+    for i, (seq, start, end) in enumerate(cases):
+        expected = per_record(seq, start, end)
+        for col in ("5pUTR_len", "3pUTR_len"):
+            assert bf[col][i] == expected[col], (col, seq, start, end)
+        for col in ("GC", "5pUTR_GC", "3pUTR_GC"):
+            assert bf[col][i] == pytest.approx(expected[col]), (col, seq, start, end)
+        for region in ("Kozak", "KozakContext"):
+            assert seq[bf[region + "_start"][i]:bf[region + "_end"][i]] == expected[region], (region, seq, start, end)
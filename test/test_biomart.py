@@ -0,0 +1,66 @@
+"""Tests of BiomartFetcher against a local BioMart stand-in (see bioMartStandIn)."""
+
+import pytest
+
+import bioMartStandIn
+import rnaFeaturesLib as rnalib
+
+GENES = ["ENSG{:011d}".format(g) for g in range(37, 0, -1)]
+
+
+@pytest.fixture
+def standin():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(bioMartStandIn.serve(**kwargs))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def fetch(server, genes=GENES, **kwargs):
+    """Return: The features and transcripts data frames of the genes from the stand-in."""
+    options = dict(concurrency=3, chunkSize=8, minChunk=2, retries=3, backoff=0, timeout=10)
+    options.update(kwargs)
+    fetcher = rnalib.BiomartFetcher("hsapiens_gene_ensembl", server.url, **options)
+    return fetcher, fetcher.fetch(genes, [rnalib.FEATURE_ATTRIBUTES, rnalib.TRANSCRIPT_ATTRIBUTES])
+
+
+def expected_ids(genes):
+    return [gene for gene in genes for _ in range(2)]
+
+
+def test_fetch_returns_all_genes_in_order(standin):
+    # The first chunks are answered last.
+    server = standin(delay=lambda ids: 0.2 if ids[0] == GENES[0] else 0)
+    _, (features, transcripts) = fetch(server)
+    assert features["Gene stable ID"].tolist() == expected_ids(GENES)
+    assert transcripts["Gene stable ID"].tolist() == expected_ids(GENES)
+    assert list(features.columns) == [rnalib.BIOMART_COLUMNS[a] for a in rnalib.FEATURE_ATTRIBUTES]
+
+
+def test_failed_queries_are_retried(standin):
+    server = standin(failFirst=4)
+    _, (features, _) = fetch(server)
+    assert features["Gene stable ID"].tolist() == expected_ids(GENES)
+    # The queries of both attribute lists and their retries.
+    assert len(server.queries) == 4 + 2 * 5
+
+
+def test_failing_chunks_are_split(standin):
+    server = standin(maxGenes=3)
+    _, (features, transcripts) = fetch(server, retries=1)
+    assert features["Gene stable ID"].tolist() == expected_ids(GENES)
+    assert transcripts["Gene stable ID"].tolist() == expected_ids(GENES)
+    # The chunks were shrunk until they were answered (the chunk size grows back after the successes, it is not checked).
+    assert max(len(ids) for ids in server.queries) == 8
+    assert any(len(ids) <= 3 for ids in server.queries)
+
+
+def test_chunk_failing_below_the_minimum_is_an_error(standin):
+    server = standin(maxGenes=1)
+    with pytest.raises(RuntimeError, match="failed after 2 attempts"):
+        fetch(server, retries=2, minChunk=4)
@@ -0,0 +1,46 @@
+"""Tests of the codon tables of the CAI."""
+
+from types import SimpleNamespace
+
+import pytest
+
+import rnaFeaturesLib as rnalib
+
+SHIPPED = ["celegans_gene_ensembl", "dmelanogaster_gene_ensembl", "ggallus_gene_ensembl", "mmusculus_gene_ensembl", "scerevisiae_gene_ensembl"]
+
+
+def test_shipped_tables_are_found():
+    assert set(SHIPPED + ["hsapiens_gene_ensembl"]) <= set(rnalib.codon_table_datasets())
+
+
+@pytest.mark.parametrize("dataset", SHIPPED)
+def test_shipped_tables_are_relative_adaptiveness(dataset):
+    index = rnalib.load_codon_index(dataset)
+    assert sorted(index) == sorted(rnalib.HUMAN_CODON_INDEX)
+    assert all(0 < weight <= 1 for weight in index.values())
+    # The most used codons of each amino acid (and the stop) have a weight of 1.
+    assert sum(weight == 1 for weight in index.values()) >= 21
+    assert index != rnalib.HUMAN_CODON_INDEX
+
+
+def test_unknown_dataset_is_an_error():
+    with pytest.raises(ValueError, match="mmusculus_gene_ensembl"):
+        rnalib.load_codon_index("xlaevis_gene_ensembl")
+
+
+def test_codon_table_defaults_to_the_dataset():
+    assert rnalib.codon_table(SimpleNamespace(codonTable=None)) == "hsapiens_gene_ensembl"
+    assert rnalib.codon_table(SimpleNamespace(codonTable=None), "mmusculus_gene_ensembl") == "mmusculus_gene_ensembl"
+    assert rnalib.codon_table(SimpleNamespace(codonTable="table.tsv"), "mmusculus_gene_ensembl") == "table.tsv"
+
+
+def test_skipped_codons_are_counted(monkeypatch, capsys):
+    monkeypatch.setattr(rnalib, "STATS", None)
+    stats = rnalib.enable_stats()
+    logWeights = rnalib.codon_log_weights(rnalib.HUMAN_CODON_INDEX)
+    clean = "ATGGCTGCCAAAGAGTTT"
+    # A codon with an N and an incomplete trailing codon, both skipped.
+    cais = rnalib.cai_batch(["ATGGCTNCCGCCAAAGAGTTT", clean + "GC", clean], logWeights)
+    assert stats.counters["cai_ambiguous_codons"] == 1 and stats.counters["cai_partial_codons"] == 1
+    assert cais[1] == cais[2]
+    assert "1 codons with other letters than ACGT" in capsys.readouterr().err
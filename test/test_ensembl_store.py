@@ -0,0 +1,60 @@
+"""Tests of the local ENSEMBL store."""
+
+import pandas as pd
+import pytest
+
+import rnaFeaturesLib as rnalib
+import synthTranscriptome
+
+DATASET = "hsapiens_gene_ensembl"
+
+
+@pytest.fixture(scope="module")
+def biomart():
+    """The BioMart features and transcripts data frames of a small synthetic transcriptome, and its gene IDs."""
+    dfFeat, dfTrans, _ = synthTranscriptome.synthetic_transcriptome(60, seed=2)
+    return dfFeat, dfTrans, dfFeat["Gene stable ID"].unique().tolist()
+
+
+@pytest.fixture(scope="module")
+def dump(biomart, tmp_path_factory):
+    """An ENSEMBL dump of the transcriptome: the cDNA FASTA (with versioned IDs) and the attributes TSV."""
+    dfFeat, dfTrans, _ = biomart
+    directory = tmp_path_factory.mktemp("dump")
+    seqCol = rnalib.BIOMART_COLUMNS['cdna']
+    with open(directory / "cdna.fa", "w") as fa:
+        fa.writelines(">{}.1 cdna\n{}\n".format(t, seq) for t, seq in zip(dfFeat["Transcript stable ID"], dfFeat[seqCol]))
+    attrib = dfFeat.drop(columns=[seqCol]).merge(dfTrans[["Transcript stable ID", "Transcript support level (TSL)", "APPRIS annotation", "Source (transcript)"]], on="Transcript stable ID")
+    attrib.to_csv(directory / "attrib.tsv", sep="\t", index=False)
+    return str(directory / "cdna.fa"), str(directory / "attrib.tsv")
+
+
+def sorted_rows(df):
+    return df.astype(str).sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_adding_genes_twice_does_not_duplicate_them(biomart, tmp_path):
+    dfFeat, dfTrans, genes = biomart
+    store = rnalib.EnsemblStore(str(tmp_path / "store.sqlite"))
+    store.check_dataset(DATASET)
+    store.add(genes, dfFeat, dfTrans)
+    store.add(genes[:10], dfFeat[dfFeat["Gene stable ID"].isin(genes[:10])], dfTrans[dfTrans["Gene stable ID"].isin(genes[:10])])
+    feat, trans, missing = store.lookup(genes, DATASET)
+    assert missing == []
+    assert len(feat) == len(dfFeat) and len(trans) == len(dfTrans)
+    assert not feat["Transcript stable ID"].duplicated().any()
+
+
+@pytest.mark.parametrize("chunkSize", [7, 1000])
+def test_building_a_store_twice_does_not_duplicate_it(biomart, dump, tmp_path, chunkSize):
+    dfFeat, dfTrans, genes = biomart
+    path = str(tmp_path / "store.sqlite")
+    for _ in range(2):
+        store = rnalib.EnsemblStore.build_from_dump(path, DATASET, dump[0], dump[1], chunkSize=chunkSize)
+    feat, trans, missing = store.lookup(genes, DATASET)
+    assert missing == []
+    # All the transcripts of the genes split over two chunks are kept, once.
+    assert sorted(feat["Transcript stable ID"]) == sorted(dfFeat["Transcript stable ID"])
+    assert sorted(trans["Transcript stable ID"]) == sorted(dfTrans["Transcript stable ID"])
+    columns = [rnalib.BIOMART_COLUMNS[a] for a in rnalib.FEATURE_ATTRIBUTES if a != "description"]
+    pd.testing.assert_frame_equal(sorted_rows(feat[columns]), sorted_rows(dfFeat[columns]))
@@ -0,0 +1,60 @@
+"""The expression files of -e: the quantification tables without gene column (salmon, kallisto) select the same transcripts as the tables with one."""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import rnaFeaturesLib as rnalib
+import synthTranscriptome
+
+
+def coding(nTranscripts, seed):
+    """Return: The protein coding rows of the BioMart data frames of a synthetic transcriptome, and its expression data frame."""
+    dfFeat, dfTrans, dfExpr = synthTranscriptome.synthetic_transcriptome(nTranscripts, seed)
+    return dfFeat[dfFeat["Transcript type"] == "protein_coding"], dfTrans[dfTrans["Transcript type"] == "protein_coding"], dfExpr
+
+
+def write_quant_sf(path, dfExpr, seed=0):
+    """A salmon quant.sf of the expression data frame: versioned transcript IDs and no gene column, and a transcript ENSEMBL does not know."""
+    rng = np.random.RandomState(seed)
+    with open(path, "w") as out:
+        out.write("Name\tLength\tEffectiveLength\tTPM\tNumReads\n")
+        for trans, tpm in zip(dfExpr["transcript"], dfExpr.iloc[:, 2]):
+            length = rng.randint(300, 5000)
+            out.write("{}.{}\t{}\t{:.3f}\t{:.6f}\t{:.3f}\n".format(trans, rng.randint(1, 9), length, length - 180.5, tpm, tpm * length / 1000))
+        out.write("ENST99999999999.1\t1000\t819.500\t5000.000000\t4097.500\n")
+
+
+def expression_options(path, columns, header=True):
+    return SimpleNamespace(exprTrans=[str(path)], exprColumns=columns, exprSep=None, exprHeader=header, exprThreshold=1.0, exprAggregate="mean")
+
+
+def test_quant_sf_selection(tmp_path):
+    dfFeat, dfTrans, dfExpr = coding(1500, 5)
+    genes = sorted(set(dfTrans["Gene stable ID"]))
+    csvPath, quantPath = tmp_path / "expr.csv", tmp_path / "quant.sf"
+    dfExpr.to_csv(csvPath, header=False, index=False)
+    write_quant_sf(quantPath, dfExpr)
+    withGenes = rnalib.expression_options(expression_options(csvPath, "1,2,3", header=False), genes)
+    reader = rnalib.expression_options(expression_options(quantPath, "Name,TPM"), genes)
+    # Without a gene column the file is only read with the transcripts table.
+    assert callable(reader)
+    selected = rnalib.select_transcripts(dfTrans, dfFeat, reader)
+    assert list(selected.index) == list(rnalib.select_transcripts(dfTrans, dfFeat, withGenes).index)
+    assert list(selected.index) == list(rnalib.select_transcripts(dfTrans, dfFeat, rnalib.expression_options(expression_options(quantPath, "-,1,4"), genes)).index)
+
+
+def test_quant_sf_rows_are_filtered_while_read(tmp_path):
+    dfFeat, dfTrans, dfExpr = coding(1500, 6)
+    quantPath = tmp_path / "quant.sf"
+    write_quant_sf(quantPath, dfExpr)
+    transcriptGenes = dict(zip(dfTrans["Transcript stable ID"], dfTrans["Gene stable ID"]))
+    genes = sorted(set(dfTrans["Gene stable ID"]))[::4]
+    parsed = rnalib.read_transcripts_expression(str(quantPath), genes, [None, "Name", "TPM"], header=True, chunkSize=100, transcriptGenes=transcriptGenes)
+    assert set(parsed) <= set(genes) and parsed
+    expected = dfExpr[dfExpr["gene"].isin(genes) & dfExpr["transcript"].isin(transcriptGenes)]
+    expected = expected[expected.iloc[:, 2].round(6) >= 1.0]
+    assert sorted(t.trans_id for trans in parsed.values() for t in trans) == sorted(expected["transcript"])
+    with pytest.raises(ValueError, match="transcriptGenes"):
+        rnalib.read_transcripts_expression(str(quantPath), genes, [None, "Name", "TPM"], header=True)
@@ -0,0 +1,54 @@
+"""The parameters of the feature stages (register_feature params) key the record hashes of the transcripts."""
+
+import re
+
+import pandas as pd
+import pytest
+
+import rnaFeaturesLib as rnalib
+from conftest import features_options
+
+
+@pytest.fixture
+def gc_window_stage():
+    """A plugged-in stage with a parameter, the GC content of the first options.gcWindow nt of the 3'UTR."""
+    @rnalib.register_feature("GC_window", ['3pUTR_GCwindow'], inputs=["3pUTR"], cost=1, params=lambda options: "gcWindow:{}".format(options.gcWindow))
+    def gc_window_feature(fx, pool=None):
+        window = fx.options.gcWindow
+        return pd.DataFrame({'3pUTR_GCwindow': [sum(base in "GC" for base in seq[:window]) / max(len(seq[:window]), 1) for _, seq in fx.utr3p]}, index=fx.ids)
+    yield "GC_window"
+    del rnalib.FEATURE_STAGES["GC_window"]
+
+
+def store(synth):
+    with open(synth["fasta"]) as fh:
+        return next(rnalib.TranscriptStore.iter_fasta(fh))
+
+
+def test_stage_params_are_hashed(gc_window_stage):
+    options = features_options(features=["lengths", gc_window_stage], gcWindow=20)
+    assert rnalib.features_params(options) == "utr3len:20000|lengths:|GC_window:gcWindow:20"
+    options.gcWindow = 30
+    assert rnalib.features_params(options) == "utr3len:20000|lengths:|GC_window:gcWindow:30"
+
+
+def test_options_of_stages_not_planned_are_not_hashed():
+    params = rnalib.features_params(features_options(features=["lengths", "GC"]))
+    assert params == rnalib.features_params(features_options(features=["lengths", "GC"], clip=5, codonTable="mmusculus_gene_ensembl", spanAbove=500))
+    assert params != rnalib.features_params(features_options(features=["lengths", "GC", "TOP_localScore"]))
+    assert "clip:5" in rnalib.features_params(features_options(features=["TOP_localScore"], clip=5))
+    # The CAI is keyed by the weights of its codon table.
+    assert rnalib.features_params(features_options(features=["CAI"])) != rnalib.features_params(features_options(features=["CAI"], codonTable="mmusculus_gene_ensembl"))
+
+
+def test_update_recomputes_when_a_stage_param_changes(gc_window_stage, synth, capsys):
+    options = features_options(features=["lengths", gc_window_stage], gcWindow=20, recordHash=True)
+    previous = rnalib.FeaturesExtract(store(synth), options).extract()
+    capsys.readouterr()
+    rnalib.FeaturesExtract(store(synth), options, previous=previous).extract()
+    assert "0 to compute" in capsys.readouterr().err
+    options.gcWindow = 40
+    updated = rnalib.FeaturesExtract(store(synth), options, previous=previous).extract()
+    assert re.search(r"(?m)^0 transcripts unchanged", capsys.readouterr().err)
+    assert updated.equals(rnalib.FeaturesExtract(store(synth), options).extract())
+    assert not updated['3pUTR_GCwindow'].equals(previous['3pUTR_GCwindow'])
@@ -0,0 +1,78 @@
+"""Tests of the RNAfold driving (with the RNAfold stand-in of the benchmarks)."""
+
+import os
+import runpy
+from concurrent.futures import ThreadPoolExecutor
+
+import rnaFeaturesLib as rnalib
+from conftest import BENCH, features_options
+
+stub_mfe = runpy.run_path(os.path.join(BENCH, "RNAfold"))["stub_mfe"]
+
+SEQS = [("t{}".format(i), "ACGU" * (i + 1) + "G" * i) for i in range(12)]
+
+
+def record_calls(monkeypatch):
+    """Return: The list the (number of sequences, jobs) of the run_rnafold calls are appended to."""
+    calls = []
+    runRnafold = rnalib.run_rnafold
+
+    def run(seqs, jobs=False, span=None):
+        calls.append((len(seqs), jobs))
+        return runRnafold(seqs, jobs, span)
+    monkeypatch.setattr(rnalib, "run_rnafold", run)
+    return calls
+
+
+def test_single_worker_runs_one_multithreaded_rnafold(monkeypatch):
+    calls = record_calls(monkeypatch)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        mfes = rnalib.fold_sequences(SEQS, 1, pool)
+    assert calls == [(len(SEQS), True)]
+    assert mfes == [round(stub_mfe(seq), 2) for _, seq in SEQS]
+
+
+def test_workers_fold_batches_in_input_order(monkeypatch):
+    calls = record_calls(monkeypatch)
+    mfes = rnalib.fold_sequences(SEQS, 3)
+    assert len(calls) > 1 and not any(jobs for _, jobs in calls)
+    assert sum(n for n, _ in calls) == len(SEQS)
+    assert mfes == [round(stub_mfe(seq), 2) for _, seq in SEQS]
+
+
+def test_extract_folds_each_utr_set_once_with_one_worker(monkeypatch, synth):
+    calls = record_calls(monkeypatch)
+    store = next(rnalib.TranscriptStore.iter_fasta(open(synth["fasta"]), None))
+    dd = rnalib.FeaturesExtract(store, features_options()).extract()
+    assert sorted(calls) == [(len(dd), True), (len(dd), True)]
+
+
+def test_span_folding_has_its_own_columns(monkeypatch, synth):
+    spans = []
+    runRnafold = rnalib.run_rnafold
+
+    def run(seqs, jobs=False, span=None):
+        spans.append((len(seqs), span))
+        return runRnafold(seqs, jobs, span)
+    monkeypatch.setattr(rnalib, "run_rnafold", run)
+    store = next(rnalib.TranscriptStore.iter_fasta(open(synth["fasta"]), None))
+    full = rnalib.FeaturesExtract(store, features_options()).extract()
+    spans.clear()
+    dd = rnalib.FeaturesExtract(store, features_options(spanAbove=700, maxBPspan=80)).extract()
+    assert list(dd.columns[dd.columns.get_loc('3pUTR_MfeBP') + 1:][:2]) == ['3pUTR_spanMFE', '3pUTR_spanMfeBP']
+    # The full folding of the short 3'UTRs only, the span limited folding of all of them.
+    long = dd['3pUTR_len'] > 700
+    assert long.any() and not long.all()
+    assert dd.loc[long, ['3pUTR_MFE', '3pUTR_MfeBP']].isnull().all().all()
+    assert dd.loc[~long, '3pUTR_MFE'].equals(full.loc[~long, '3pUTR_MFE'])
+    assert dd['3pUTR_spanMFE'].notnull().all()
+    # The 3'UTRs of at most 80 nt are folded once, the span cannot change their folding.
+    short = dd['3pUTR_len'] <= 80
+    assert short.any()
+    assert dd.loc[short, '3pUTR_spanMFE'].equals(dd.loc[short, '3pUTR_MFE'])
+    assert sorted(spans, key=str) == sorted([(len(dd), None), (int((~long).sum()), None), (int((~short).sum()), 80)], key=str)
+    # Without the full folding of the 3'UTRs, all of them are folded with the span.
+    spans.clear()
+    alone = rnalib.FeaturesExtract(store, features_options(features=["lengths", "spanMFE_3pUTR"], spanAbove=700, maxBPspan=80)).extract()
+    assert spans == [(len(dd), 80)]
+    assert alone['3pUTR_spanMFE'].equals(dd['3pUTR_spanMFE'])
@@ -0,0 +1,23 @@
+"""The size limit of a ResultsCache directory shared by several processes (-P)."""
+
+import sqlite3
+
+import rnaFeaturesLib as rnalib
+
+
+def stored_size(cacheDir):
+    with sqlite3.connect(str(cacheDir / "rnaFeaturesCache.sqlite")) as db:
+        return db.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM results").fetchone()
+
+
+def test_shared_directory_stays_within_its_size(tmp_path):
+    # Each entry takes 64 bytes of key and 4 of value, the cache holds 10 of them.
+    first, second = (rnalib.ResultsCache(str(tmp_path), maxSize=680) for _ in range(2))
+    for i in range(4):
+        # Each cache adds 6 entries at a time, which fit in the size it last saw.
+        for cache, name in ((first, "a"), (second, "b")):
+            cache.put_many("tool", {}, ["{}{}_{}".format(name, i, j) for j in range(6)], [-1.5] * 6)
+            size, count = stored_size(tmp_path)
+            assert size <= 680 and count <= 10
+    # The most recent entries are kept.
+    assert second.get_many("tool", {}, ["b3_{}".format(j) for j in range(6)]) == [-1.5] * 6
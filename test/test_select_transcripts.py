@@ -0,0 +1,56 @@
+"""select_transcripts against the row by row selection it replaced (bench/referenceSelection.py), on synthetic transcriptomes."""
+
+import pytest
+
+import rnaFeaturesLib as rnalib
+import referenceSelection
+import synthTranscriptome
+
+
+def coding(nTranscripts, seed):
+    """Return: The protein coding rows of the BioMart data frames of a synthetic transcriptome, and its expression data frame."""
+    dfFeat, dfTrans, dfExpr = synthTranscriptome.synthetic_transcriptome(nTranscripts, seed)
+    return dfFeat[dfFeat["Transcript type"] == "protein_coding"], dfTrans[dfTrans["Transcript type"] == "protein_coding"], dfExpr
+
+
+def assert_same_selection(selected, reference):
+    """The same transcripts in the same order, with the same values in the columns of the reference."""
+    assert list(selected.index) == list(reference.index)
+    assert set(reference.columns) <= set(selected.columns)
+    for column in reference.columns:
+        assert list(selected[column].astype(str)) == list(reference[column].astype(str)), column
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_classification_selection(seed):
+    dfFeat, dfTrans, _ = coding(1500, seed)
+    selected = rnalib.select_transcripts(dfTrans, dfFeat, None)
+    assert_same_selection(selected, referenceSelection.select_transcripts(dfTrans, dfFeat, None))
+    # One transcript per gene with complete data, the input frames are left alone.
+    assert selected["Gene stable ID"].is_unique
+    assert "Transcript stable ID" in dfTrans.columns and "Transcript stable ID" in dfFeat.columns
+
+
+def test_expression_selection(tmp_path):
+    dfFeat, dfTrans, dfExpr = coding(1500, 3)
+    # The reference fails on the transcripts of the file that are not in the tables.
+    dfExpr = dfExpr[dfExpr["transcript"].isin(dfTrans["Transcript stable ID"])]
+    exprFile = tmp_path / "expr.csv"
+    dfExpr.to_csv(exprFile, header=False, index=False)
+    with open(exprFile) as handle:
+        selected = rnalib.select_transcripts(dfTrans, dfFeat, handle)
+    with open(exprFile) as handle:
+        reference = referenceSelection.select_transcripts(dfTrans, dfFeat, handle)
+    assert_same_selection(selected, reference)
+
+
+def test_incomplete_best_transcript():
+    # The best ranked transcript has no coding coordinates, the next one is selected.
+    dfFeat, dfTrans, _ = coding(300, 4)
+    best = rnalib.rank_transcripts(dfTrans)
+    best = best[best["rank"] == 0]["Transcript stable ID"]
+    dfFeat = dfFeat.copy()
+    dfFeat.loc[dfFeat["Transcript stable ID"].isin(best.iloc[::3]), "cDNA coding start"] = None
+    selected = rnalib.select_transcripts(dfTrans, dfFeat, None)
+    assert_same_selection(selected, referenceSelection.select_transcripts(dfTrans, dfFeat, None))
+    assert not selected.index.isin(best.iloc[::3]).any()
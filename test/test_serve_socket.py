@@ -0,0 +1,48 @@
+"""The Unix socket of a features server: a stale one is replaced, a live one or another file is left alone."""
+
+import os
+import socket
+
+import pytest
+
+import rnaFeaturesLib as rnalib
+from conftest import features_options
+
+
+def listening_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(1)
+    return sock
+
+
+def test_stale_socket_is_removed(tmp_path):
+    path = str(tmp_path / "features.sock")
+    # A socket left by a server that was killed: the file is there, nobody listens.
+    listening_socket(path).close()
+    assert os.path.exists(path)
+    rnalib.remove_stale_socket(path)
+    assert not os.path.exists(path)
+    # Nothing to remove.
+    rnalib.remove_stale_socket(path)
+
+
+def test_live_socket_is_kept(tmp_path):
+    path = str(tmp_path / "features.sock")
+    sock = listening_socket(path)
+    try:
+        with pytest.raises(FileExistsError, match="already listening"):
+            rnalib.remove_stale_socket(path)
+        assert os.path.exists(path)
+    finally:
+        sock.close()
+
+
+def test_other_files_are_kept(tmp_path):
+    path = tmp_path / "table.csv"
+    path.write_text("not a socket\n")
+    with pytest.raises(FileExistsError, match="not a socket"):
+        rnalib.remove_stale_socket(str(path))
+    with pytest.raises(FileExistsError):
+        rnalib.FeaturesService(features_options()).serve("unix:{}".format(path))
+    assert path.read_text() == "not a socket\n"
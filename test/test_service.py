@@ -0,0 +1,29 @@
+"""The requests of FeaturesService: the FASTA and gene ID bodies are UTF-8 text."""
+
+import rnaFeaturesLib as rnalib
+from conftest import features_options
+
+
+def fasta_records(synth, n):
+    """Return: The text of the first n records of the synthetic FASTA file."""
+    with open(synth["fasta"]) as fh:
+        records = fh.read().split(">")[1:n + 1]
+    return "".join(">" + record for record in records)
+
+
+def test_non_ascii_header(synth):
+    # A gene description with accents and a Greek letter.
+    fasta = fasta_records(synth, 3).replace("\n", " Protéine kinase α\n", 1)
+    service = rnalib.FeaturesService(features_options())
+    status, contentType, table = service.handle("POST", "/fasta", fasta.encode("utf-8"))
+    assert (status, contentType) == (200, "text/csv")
+    assert len([line for line in table.splitlines() if line and not line.startswith("#")]) == 4
+    assert service.handle("POST", "/fasta", fasta_records(synth, 3).encode("ascii"))[2] == table
+
+
+def test_undecodable_body_is_a_bad_request(synth):
+    service = rnalib.FeaturesService(features_options())
+    status, _, text = service.handle("POST", "/fasta", fasta_records(synth, 1).encode("ascii") + b"\xff\xfe")
+    assert status == 400 and "UTF-8" in text
+    assert service.handle("POST", "/genes", b"ENSG\xe9")[0] == 400
+    assert service.jobs == 0
@@ -0,0 +1,53 @@
+"""The tables of the sharded runs (-P N, --shard and merge) are the table of a run over a single process, rows in the same order."""
+
+import io
+import os
+import subprocess
+import sys
+
+import rnaFeaturesLib as rnalib
+from conftest import ROOT, features_options
+
+
+def table_lines(text):
+    """Return: The lines of a CSV table, without the trailer of the command line and date."""
+    return [line for line in text.splitlines() if not line.startswith("#")]
+
+
+def single_process_table(path, options):
+    out = io.StringIO()
+    with open(path) as fh:
+        rnalib.stream_features(rnalib.TranscriptStore.iter_fasta(fh), options, out)
+    return table_lines(out.getvalue())
+
+
+def test_processes_keep_the_input_order(synth, tmp_path):
+    options = features_options()
+    expected = single_process_table(synth["fasta"], options)
+    outPath = tmp_path / "table.csv"
+    with open(outPath, "w") as out:
+        rnalib.stream_features_sharded(synth["fasta"], options, out, 3)
+    assert table_lines(outPath.read_text()) == expected
+
+
+def test_merge_keeps_the_input_order(synth, tmp_path):
+    expected = single_process_table(synth["fasta"], features_options())
+    shardPaths = []
+    for i in (1, 2):
+        shardPaths.append(str(tmp_path / "shard{}.csv".format(i)))
+        with open(synth["fasta"]) as fh, open(shardPaths[-1], "w") as out:
+            rnalib.stream_features(rnalib.TranscriptStore.iter_fasta(fh), features_options(shard=(i, 2)), out)
+    merged = subprocess.run([sys.executable, os.path.join(ROOT, "bin", "fasta2table.py"), "merge", *shardPaths, "-i", synth["fasta"]],
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True, env=dict(os.environ, PYTHONPATH=ROOT)).stdout
+    assert table_lines(merged) == expected
+
+
+def test_order_features_puts_unknown_transcripts_last(synth):
+    with open(synth["fasta"]) as fh:
+        store = next(rnalib.TranscriptStore.iter_fasta(fh))
+    dd = rnalib.FeaturesExtract(store, features_options(features=["lengths"])).extract()
+    order = rnalib.fasta_ids(synth["fasta"])
+    assert list(rnalib.order_features(dd.iloc[::-1], order).index) == order
+    ordered = rnalib.order_features(dd, order[10:] + order[:5])
+    assert list(ordered.index[:-5]) == order[10:] + order[:5]
+    assert list(ordered.index[-5:]) == list(rnalib.sort_features(dd.loc[order[5:10]]).index)
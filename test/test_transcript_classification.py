@@ -0,0 +1,72 @@
+"""transcript_classification and rank_transcripts against the row by row classification they replaced (bench/referenceSelection.py)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rnaFeaturesLib as rnalib
+import referenceSelection
+
+COLUMNS = ["Gene stable ID", "Transcript stable ID", "Transcript support level (TSL)", "APPRIS annotation", "Source (transcript)", "Transcript length (including UTRs and CDS)"]
+# The annotations found in ENSEMBL, and the odd ones.
+TSL_VALUES = ["tsl1", "tsl2", "tsl5", "tsl1 (assigned to previous version 4)", "tsl3 (assigned to previous version 7)", "tslNA", np.nan, ""]
+APPRIS_VALUES = ["principal1", "principal2", "principal4", "principal10", "alternative1", "alternative2", "alternative10", "minor", np.nan, ""]
+SOURCE_VALUES = ["ensembl_havana", "ensembl", "havana", "insdc", np.nan]
+
+
+def table(rows):
+    """Return: A classification table (as returned by BiomartFetcher) from (gene, transcript, TSL, APPRIS, source, length) rows."""
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def assert_same_classification(ensemblTable):
+    """The same genes in the same order, with the same transcripts in the same order and the same sort keys."""
+    reference = referenceSelection.transcript_classification(ensemblTable)
+    classified = rnalib.transcript_classification(ensemblTable)
+    assert list(classified) == list(reference)
+    for gene in reference:
+        assert [t.trans_id for t in classified[gene]] == [t.trans_id for t in reference[gene]], gene
+        assert [tuple(t.sort) for t in classified[gene]] == [t.sort for t in reference[gene]], gene
+    # The ranks of rank_transcripts are the positions in these lists.
+    ranking = rnalib.rank_transcripts(ensemblTable)
+    genes = list(reference)
+    assert [(genes[g], reference[genes[g]][r].trans_id) for g, r in zip(ranking["gene_order"], ranking["rank"])] == \
+        [(gene, t.trans_id) for gene in genes for t in reference[gene]]
+
+
+def test_ties_keep_the_table_order():
+    # All the keys are equal, the order of the table is kept.
+    assert_same_classification(table([("G1", "T{}".format(i), "tsl1", "principal1", "ensembl_havana", 1000) for i in range(5)]))
+    # Equal but for the length, the longest first.
+    assert_same_classification(table([("G1", "T1", "tsl2", "alternative1", "havana", 900), ("G1", "T2", "tsl2", "alternative1", "havana", 1200),
+                                      ("G1", "T3", "tsl2", "alternative1", "havana", 900)]))
+
+
+def test_missing_tsl():
+    # NaN, tslNA and an empty TSL are last, and equal to each other.
+    assert_same_classification(table([("G1", "T1", np.nan, "principal1", "ensembl_havana", 1000), ("G1", "T2", "tslNA", "principal1", "ensembl_havana", 1000),
+                                      ("G1", "T3", "tsl5", "principal1", "ensembl_havana", 1000), ("G1", "T4", "", "principal1", "ensembl_havana", 1000),
+                                      ("G1", "T5", "tsl1 (assigned to previous version 4)", "principal1", "ensembl_havana", 500)]))
+
+
+def test_appris_variants():
+    # The numbers are compared as strings: principal10 is before principal2, as in the original classification.
+    rows = [("G1", "T{}".format(i), "tsl1", appris, "ensembl_havana", 1000) for i, appris in enumerate(APPRIS_VALUES)]
+    assert_same_classification(table(rows))
+    ranked = [t.appris for t in rnalib.transcript_classification(table(rows))["G1"]]
+    assert ranked[:4] == ["principal1", "principal10", "principal2", "principal4"]
+
+
+def test_sources():
+    assert_same_classification(table([("G1", "T{}".format(i), "tsl1", "principal1", source, 1000) for i, source in enumerate(SOURCE_VALUES)]))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_tables(seed):
+    # Few genes with many transcripts drawn from few values, for ties on every key.
+    rng = np.random.RandomState(seed)
+    n = 2000
+    genes = rng.randint(0, 60, n)
+    columns = [["G{}".format(g) for g in genes], ["T{}".format(i) for i in range(n)], rng.choice(np.array(TSL_VALUES, dtype=object), n),
+               rng.choice(np.array(APPRIS_VALUES, dtype=object), n), rng.choice(np.array(SOURCE_VALUES, dtype=object), n), rng.choice([500, 1000, 1500], n)]
+    assert_same_classification(pd.DataFrame(dict(zip(COLUMNS, columns))))
@@ -0,0 +1,44 @@
+"""The columns of TranscriptStore and FastaIndex, and the kernels given the segments of the store buffer instead of strings."""
+
+import numpy as np
+
+import rnaFeaturesLib as rnalib
+from conftest import features_options
+
+
+def store(synth):
+    with open(synth["fasta"]) as fh:
+        return next(rnalib.TranscriptStore.iter_fasta(fh))
+
+
+def test_string_columns(synth, tmp_path):
+    transcripts = store(synth)
+    for column in (transcripts.ids, transcripts.geneIDs, transcripts.geneNames, transcripts.tsl, transcripts.appris, transcripts.source):
+        assert column.dtype == object and all(isinstance(value, str) for value in column)
+    # The annotations are codes in a few categories.
+    codes, categories = transcripts.annotations["appris"]
+    assert len(categories) < len(transcripts) and list(categories[codes]) == list(transcripts.appris)
+    part = rnalib.TranscriptStore.concat([transcripts.take([5, 2]), transcripts.take([7])])
+    assert list(part.appris) == [transcripts.appris[i] for i in (5, 2, 7)] and list(part.ids) == [transcripts.ids[i] for i in (5, 2, 7)]
+    # The index is saved and loaded with the same IDs.
+    indexPath = str(tmp_path / "synth.idx.npz")
+    built = rnalib.FastaIndex(synth["fasta"], indexPath)
+    loaded = rnalib.FastaIndex(synth["fasta"], indexPath)
+    assert built.ids.dtype == loaded.ids.dtype == object
+    assert list(loaded.ids) == list(built.ids) == list(transcripts.ids)
+
+
+def test_kernels_read_the_buffer(synth, tmp_path):
+    fx = rnalib.FeaturesExtract(store(synth), features_options(features=["lengths", "5pUTR_MFE"]))
+    fx.collect_features()
+    codonIndex = rnalib.load_codon_index("hsapiens_gene_ensembl")
+    coding = [(recID, rnalib.TranscriptStore.text(fx.store.cds(i))) for recID, i in zip(fx.ids, fx.keep)]
+    scoring = {'A': -1, 'C': 1, 'G': -1, 'T': 1, "N": 0}
+    cache = rnalib.ResultsCache(str(tmp_path / "cache"))
+    for run in range(2):
+        # Computed, then read from the cache.
+        cais = rnalib.calculate_CAI(fx.segments("CDS"), cache, codonIndex)
+        assert np.allclose(cais["CAI"], rnalib.calculate_CAI(coding, None, codonIndex)["CAI"], equal_nan=True)
+        scores = rnalib.calculate_local_score(fx.segments("5pUTR"), scoring, 20, cache)
+        assert list(scores["TOP_localScore"]) == list(rnalib.calculate_local_score(fx.utr5p, scoring, 20)["TOP_localScore"])
+    assert cache.hits["CAI"] == len(fx.ids)
@@ -0,0 +1,92 @@
+"""Updates of a features' table (--previous-table): the table is the one of a full run, whatever features the previous table has."""
+
+import gc
+import io
+
+import pytest
+
+import rnaFeaturesLib as rnalib
+from conftest import features_options
+
+# Two motifs in the MEME format (see load_motif_scanner).
+MOTIFS = """MEME version 5
+
+ALPHABET= ACGU
+
+strands: +
+
+Background letter frequencies
+A 0.28 C 0.22 G 0.22 U 0.28
+
+MOTIF M1 UUUAUUU
+
+letter-probability matrix: alength= 4 w= 7 nsites= 20 E= 0
+0.02 0.02 0.02 0.94
+0.02 0.02 0.02 0.94
+0.02 0.02 0.02 0.94
+0.94 0.02 0.02 0.02
+0.02 0.02 0.02 0.94
+0.02 0.02 0.02 0.94
+0.02 0.02 0.02 0.94
+
+MOTIF M2 GCGCG
+
+letter-probability matrix: alength= 4 w= 5 nsites= 20 E= 0
+0.05 0.05 0.85 0.05
+0.05 0.85 0.05 0.05
+0.05 0.05 0.85 0.05
+0.05 0.85 0.05 0.05
+0.05 0.05 0.85 0.05
+"""
+
+
+def run(path, options):
+    """Return: The lines of the CSV table of a FASTA file, without the trailer of the command line and date."""
+    out = io.StringIO()
+    with open(path) as fh:
+        rnalib.stream_features(rnalib.TranscriptStore.iter_fasta(fh), options, out)
+    return [line for line in out.getvalue().splitlines() if not line.startswith("#")]
+
+
+def previous_table(path, tmp_path, **kwargs):
+    """Return: The path of a table of the FASTA file written with --record-hash and the options of kwargs."""
+    tablePath = tmp_path / "previous.csv"
+    tablePath.write_text("\n".join(run(path, features_options(recordHash=True, **kwargs))) + "\n")
+    return str(tablePath)
+
+
+def test_unchanged_rows_are_reused(synth, tmp_path, capsys):
+    previous = previous_table(synth["fasta"], tmp_path)
+    assert run(synth["fasta"], features_options(previousTable=previous)) == run(synth["fasta"], features_options(recordHash=True))
+    assert "0 to compute" in capsys.readouterr().err
+
+
+def test_previous_table_with_other_features(synth, tmp_path, capsys):
+    # The previous table has the lengths only, all the transcripts are computed.
+    previous = previous_table(synth["fasta"], tmp_path, features=["lengths"])
+    assert run(synth["fasta"], features_options(previousTable=previous)) == run(synth["fasta"], features_options(recordHash=True))
+    assert "all the transcripts are computed" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("kind", ["foldWindow", "motifs"])
+def test_previous_table_without_the_new_columns(synth, tmp_path, capsys, kind):
+    # A previous table of the default features, updated with the windowed folding or the motifs.
+    previous = previous_table(synth["fasta"], tmp_path)
+    if kind == "foldWindow":
+        options = dict(foldWindow=150, spanAbove=1000)
+    else:
+        motifsPath = tmp_path / "motifs.meme"
+        motifsPath.write_text(MOTIFS)
+        options = dict(motifs=str(motifsPath), motifRegions=["5pUTR", "3pUTR"])
+    updated = run(synth["fasta"], features_options(previousTable=previous, **options))
+    assert updated == run(synth["fasta"], features_options(recordHash=True, **options))
+    assert len(updated[0].split(";")) > len(run(synth["fasta"], features_options())[0].split(";"))
+    assert "all the transcripts are computed" in capsys.readouterr().err
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_failed_init_is_cleaned_up():
+    # __del__ runs on the half initialised object.
+    with pytest.raises(ValueError):
+        rnalib.FeaturesExtract([], features_options(features=["no_such_feature"]))
+    gc.collect()